@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Одноразове декодування аудіо у 16 кГц моно float32.
+
+Той самий буфер використовується і для тривалості (кількість відліків),
+і для model.transcribe, тож на запит запускається лише один процес ffmpeg.
+"""
+import asyncio
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Частота дискретизації, з якою працює Whisper
+SAMPLE_RATE = 16000
+# Максимальний час декодування одного файлу в секундах
+DECODE_TIMEOUT = float(os.getenv('DECODE_TIMEOUT', '600'))
+
+# Демультиплексори ffmpeg для розширень, які визначає uploads.sniff_audio_type
+FFMPEG_FORMATS = {
+    ".wav": "wav",
+    ".mp3": "mp3",
+    ".ogg": "ogg",
+    ".flac": "flac",
+    ".m4a": "mov",
+    ".webm": "matroska",
+    ".amr": "amr",
+    ".aac": "aac",
+}
+
+
+_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+async def decode_audio(path: str, timeout: float = DECODE_TIMEOUT) -> np.ndarray:
+    """Декодувати файл у моно float32 з частотою SAMPLE_RATE, як whisper.load_audio"""
+    input_format = FFMPEG_FORMATS.get(Path(path).suffix.lower())
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0"]
+    if input_format:
+        # Тип контейнера вже відомий, ffmpeg не потрібно його вгадувати
+        cmd += ["-f", input_format]
+    cmd += ["-i", path, "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise AudioDecodeError("ffmpeg не знайдено")
+    try:
+        with stage_timer("decode"):
+            out, err = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise AudioDecodeError(f"Декодування перевищило {timeout:.0f} с")
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        message = err.decode(errors="replace").strip().splitlines()[-1:] or ["невідома помилка"]
+        raise AudioDecodeError(f"Не вдалося декодувати аудіо: {message[0]}")
+
+    return pcm16_to_float(out)
+
+
+async def transcode_opus(src: str, dst: str, bitrate: str, timeout: float = DECODE_TIMEOUT) -> Optional[float]:
+    """Перекодувати файл у моно Ogg Opus; повертає тривалість оригіналу в секундах"""
+    cmd = [
+        "ffmpeg", "-nostdin", "-y", "-i", src,
+        # Теги оригіналу переносяться в новий файл
+        "-map_metadata", "0", "-vn", "-ac", "1",
+        "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+        "-f", "ogg", dst,
+    ]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise AudioDecodeError("ffmpeg не знайдено")
+    try:
+        _, err = await asyncio.wait_for(process.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        process.kill()
+        await process.wait()
+        raise
+    log = err.decode(errors="replace")
+    if process.returncode != 0:
+        message = log.strip().splitlines()[-1:] or ["невідома помилка"]
+        raise AudioDecodeError(f"Не вдалося перекодувати аудіо: {message[0]}")
+
+    # Тривалість з опису вхідного файлу: "Duration: 00:01:02.34"
+    match = _DURATION.search(log)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def pcm16_to_float(data: bytes) -> np.ndarray:
+    """16-бітний PCM little-endian у float32 у діапазоні [-1, 1)"""
+    return np.frombuffer(data, "<i2").astype(np.float32) / 32768.0
+
+
+def resample(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Лінійна передискретизація до SAMPLE_RATE"""
+    if sample_rate == SAMPLE_RATE or not len(audio):
+        return audio
+    length = int(round(len(audio) * SAMPLE_RATE / sample_rate))
+    positions = np.arange(length) * (sample_rate / SAMPLE_RATE)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+class FfmpegStreamDecoder:
+    """Потокове декодування стиснутого аудіо (Ogg/WebM Opus) через stdin ffmpeg.
+
+    Декодовані відліки передаються в on_audio в міру того, як ffmpeg їх видає.
+    """
+
+    READ_SIZE = 8192
+
+    def __init__(self, input_format: str, on_audio: Callable[[np.ndarray], None]):
+        self.input_format = input_format
+        self.on_audio = on_audio
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self):
+        cmd = [
+            "ffmpeg", "-nostdin", "-loglevel", "error",
+            # Мінімальне зондування входу, щоб перші відліки з'являлися одразу
+            "-fflags", "nobuffer", "-probesize", "4096", "-analyzeduration", "0",
+            "-f", self.input_format, "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-",
+        ]
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            raise AudioDecodeError("ffmpeg не знайдено")
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        remainder = b""
+        while True:
+            data = await self.process.stdout.read(self.READ_SIZE)
+            if not data:
+                break
+            data = remainder + data
+            usable = len(data) - len(data) % 2
+            remainder = data[usable:]
+            if usable:
+                self.on_audio(pcm16_to_float(data[:usable]))
+
+    async def write(self, data: bytes):
+        try:
+            self.process.stdin.write(data)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            raise AudioDecodeError("ffmpeg завершився під час декодування потоку")
+
+    async def finish(self):
+        """Закрити вхід і дочекатися, поки ffmpeg віддасть залишок відліків"""
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        await self._reader
+        await self.process.wait()
+
+    def kill(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+
+
+def get_duration(audio: Optional[np.ndarray]) -> float:
+    """Тривалість декодованого аудіо в секундах"""
+    if audio is None:
+        return 0
+    return len(audio) / SAMPLE_RATE
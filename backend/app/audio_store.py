@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Спільне сховище аудіо для /transcribe, /jobs та /history.
+
+Кожен файл зберігається один раз під іменем свого sha256, тож запис
+історії може посилатися на аудіо, вже завантажене для транскрибування,
+без повторного завантаження. Актуальний файл хешу (оригінал чи
+перекодований .opus) записаний в audio_blobs. Для транскрибування
+повторне завантаження завжди отримує оригінал, а не перекодовану копію.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import AsyncContextManager, Optional
+
+from fastapi import HTTPException, Request
+
+from .db import restore_original
+from .uploads import SpooledUpload, UploadForm, receive_form
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+AUDIO_DIR = BASE_DIR / "audio_files"
+BLOB_DIR = AUDIO_DIR / "blobs"
+UPLOAD_TMP_DIR = AUDIO_DIR / "tmp"
+# Скільки годин зберігати аудіо, на яке не посилається жоден запис історії
+ORPHAN_BLOB_TTL_HOURS = float(os.getenv('ORPHAN_BLOB_TTL_HOURS', '24'))
+# Файл, якого торкалися нещодавно, може саме зараз зберігатися повторно - його не видаляємо одразу
+RECENT_BLOB_SECONDS = 600
+
+# Пошук файлу за хешем і заміна чи видалення оригіналу не перетинаються:
+# інакше запит отримав би шлях файлу, який ось-ось буде видалено.
+# Під блокуванням лише швидкі операції з файлами, без очікування БД
+BLOB_LOCK = threading.Lock()
+# Розширення перекодованих файлів: завантажений Ogg зберігається як .ogg, тож їх не сплутати
+TRANSCODED_SUFFIX = ".opus"
+TRANSCODED_CONTENT_TYPE = "audio/ogg"
+
+os.makedirs(BLOB_DIR, exist_ok=True)
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+
+def store_blob(upload: SpooledUpload) -> Path:
+    """Переносить завантажений файл у сховище; дублікат просто видаляється.
+
+    Якщо у сховищі лише перекодована копія, завантажений оригінал зберігається
+    поруч із нею: транскрибування не повинно отримати аудіо після стиснення з втратами.
+    """
+    with BLOB_LOCK:
+        path = find_original(upload.sha256) or BLOB_DIR / f"{upload.sha256}{upload.extension}"
+        if path.exists():
+            os.unlink(upload.path)
+            # Оновлюємо час, щоб очищення не видалило файл до того, як на нього пошлються
+            os.utime(path)
+            logger.info(f"Аудіо вже є у сховищі: {path.name}")
+        else:
+            os.replace(upload.path, path)
+            logger.info(f"Аудіо збережено у сховищі: {path.name}")
+    return path
+
+
+def touch_blob(audio_hash: str) -> Optional[Path]:
+    """Файл сховища за хешем з оновленим часом, щоб його не видалили й не підмінили одразу"""
+    with BLOB_LOCK:
+        path = find_blob(audio_hash)
+        if path is not None:
+            os.utime(path)
+    return path
+
+
+def blob_content_type(path: Path, uploaded: Optional[str]) -> Optional[str]:
+    """Тип файлу у сховищі: посилання за хешем могло знайти лише перекодовану копію"""
+    return TRANSCODED_CONTENT_TYPE if path.suffix == TRANSCODED_SUFFIX else uploaded
+
+
+def install_transcoded(src: Path, temp_path: Path, dst: Path) -> bool:
+    """Кладе перекодований файл у сховище, якщо на оригінал ніхто щойно не послався"""
+    with BLOB_LOCK:
+        if recently_used(src):
+            return False
+        os.replace(temp_path, dst)
+    return True
+
+
+def recently_used(path: Path) -> float:
+    """Скільки ще секунд файл вважається потрібним запиту, що щойно на нього послався"""
+    try:
+        return max(0.0, RECENT_BLOB_SECONDS - (time.time() - path.stat().st_mtime))
+    except FileNotFoundError:
+        return 0.0
+
+
+def receive_upload_form(request: Request, max_files: Optional[int] = None) -> AsyncContextManager[UploadForm]:
+    """Форма запиту, файли якої пишуться на диск поруч зі сховищем, щоб перенесення було лише перейменуванням"""
+    return receive_form(request, UPLOAD_TMP_DIR, max_files=max_files)
+
+
+async def store_upload(upload: SpooledUpload) -> SpooledUpload:
+    """Перенести записаний файл форми у сховище; upload.path вказує на файл у сховищі"""
+    if upload.size == 0:
+        raise HTTPException(status_code=400, detail="Файл порожній")
+    upload.path = await asyncio.to_thread(store_blob, upload)
+    transcoded = BLOB_DIR / f"{upload.sha256}{TRANSCODED_SUFFIX}"
+    if transcoded.exists():
+        # Оригінал знову у сховищі: запис вказує на нього, а перекодування повториться,
+        # коли файл перестане бути потрібним для транскрибування
+        await restore_original(
+            upload.sha256, relative_audio_path(upload.path), upload.content_type, upload.size
+        )
+        await asyncio.to_thread(remove_blob, relative_audio_path(transcoded))
+    return upload
+
+
+def _blob_files(audio_hash: str):
+    if not audio_hash or not all(c in "0123456789abcdef" for c in audio_hash):
+        return []
+    return list(BLOB_DIR.glob(f"{audio_hash}.*"))
+
+
+def find_original(audio_hash: str) -> Optional[Path]:
+    for path in _blob_files(audio_hash):
+        if path.suffix != TRANSCODED_SUFFIX:
+            return path
+    return None
+
+
+def find_blob(audio_hash: str) -> Optional[Path]:
+    """Файл за хешем; оригінал, якщо він ще є, інакше перекодована копія"""
+    files = _blob_files(audio_hash)
+    return next((path for path in files if path.suffix != TRANSCODED_SUFFIX), files[0] if files else None)
+
+
+def blob_hash(path: str) -> Optional[str]:
+    """sha256 аудіо зі шляху файлу у сховищі"""
+    path = Path(path)
+    if path.parent != BLOB_DIR:
+        return None
+    return path.stem
+
+
+def relative_audio_path(path: Path) -> str:
+    return path.relative_to(AUDIO_DIR).as_posix()
+
+
+def remove_blob(relative_path: str) -> bool:
+    """Видаляє файл сховища, на який більше не посилаються записи.
+
+    Нещодавно використаний файл лишається - його видалить фонове очищення,
+    якщо за цей час на нього ніхто не пошлеться.
+    """
+    path = AUDIO_DIR / relative_path
+    if path.parent != BLOB_DIR:
+        return False
+    try:
+        with BLOB_LOCK:
+            if recently_used(path):
+                return False
+            os.unlink(path)
+    except FileNotFoundError:
+        return False
+    logger.info(f"Аудіо без посилань видалено: {path.name}")
+    return True
+
+
+async def sweep_orphan_blobs(is_referenced) -> int:
+    """Видаляє старі файли, на які не посилаються записи історії чи задачі"""
+    deadline = time.time() - ORPHAN_BLOB_TTL_HOURS * 3600
+    removed = 0
+    for path in list(BLOB_DIR.iterdir()):
+        try:
+            if path.stat().st_mtime > deadline:
+                continue
+        except FileNotFoundError:
+            continue
+        if await is_referenced(path):
+            continue
+        try:
+            os.unlink(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    # Незавершені завантаження, що лишилися після падіння
+    for path in list(UPLOAD_TMP_DIR.glob("*.part")):
+        try:
+            if path.stat().st_mtime < deadline:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+    if removed:
+        logger.info(f"Видалено {removed} аудіофайлів без посилань")
+    return removed
+
+
+async def run_blob_sweeper(is_referenced, interval: float = 3600):
+    while True:
+        try:
+            await sweep_orphan_blobs(is_referenced)
+        except Exception as e:
+            logger.error(f"Помилка очищення сховища аудіо: {str(e)}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Пакетне транскрибування багатьох файлів.
+
+Короткі записи (до 30 с, одне вікно Whisper) збираються в групи і
+проходять через енкодер і декодер одним батчем. Довші записи
+транскрибуються звичайним шляхом. Результати віддаються в міру готовності.
+За замовчуванням пакет іде в планувальник класом bulk і не затримує
+інтерактивні запити.
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+
+import numpy as np
+
+from .audio import SAMPLE_RATE, decode_audio, get_duration
+from .cache import cache, make_key
+from .inference import wait_pool
+from .metrics import CACHE_RESULTS
+from .models import resolve_model
+from .scheduler import BULK, Ticket
+from .transcription import DECODE_OPTIONS, transcribe_decoded
+
+logger = logging.getLogger(__name__)
+
+# Кількість коротких записів в одному батчі
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '8'))
+# Скільки файлів декодується ffmpeg одночасно
+BATCH_DECODE_CONCURRENCY = int(os.getenv('BATCH_DECODE_CONCURRENCY', '4'))
+# Довжина одного вікна Whisper у секундах
+WINDOW_SECONDS = 30
+# Позначка в черзі результатів: уся робота пакету завершилась
+_DONE = object()
+
+
+def batch_options(options: dict) -> dict:
+    """Ключ кешу для пакетного режиму відрізняється: без fallback по температурі
+    і з одним сегментом на запис результат не такий самий, як у transcribe"""
+    return {**options, "mode": "batch"}
+
+
+@dataclass
+class BatchItem:
+    index: int
+    file_name: str
+    path: Path
+    audio_hash: str
+
+
+def run_batch_decode(model, audios: List[np.ndarray], options: dict) -> List[dict]:
+    """Один прохід енкодера і декодера для групи записів до 30 с"""
+    import torch
+    import whisper
+
+    if not isinstance(model, whisper.model.Whisper):
+        # Інші бекенди не мають whisper.decode - транскрибуємо записи по черзі
+        return [
+            {"text": r["text"], "segments": r["segments"]}
+            for r in (model.transcribe(audio, verbose=None, **options) for audio in audios)
+        ]
+
+    mels = torch.stack([
+        whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels)
+        for audio in audios
+    ]).to(model.device)
+    options = whisper.DecodingOptions(
+        language=options["language"],
+        without_timestamps=True,
+        fp16=model.device.type != "cpu",
+    )
+    results = whisper.decode(model, mels, options)
+
+    outputs = []
+    for audio, result in zip(audios, results):
+        # Той самий критерій тиші, що й у whisper.transcribe
+        silent = result.no_speech_prob > 0.6 and result.avg_logprob < -1.0
+        segments = [] if silent else [{
+            "id": 0,
+            "seek": 0,
+            "start": 0.0,
+            "end": round(get_duration(audio), 3),
+            "text": result.text,
+            "tokens": result.tokens,
+            "temperature": result.temperature,
+            "avg_logprob": result.avg_logprob,
+            "compression_ratio": result.compression_ratio,
+            "no_speech_prob": result.no_speech_prob,
+        }]
+        outputs.append({"text": "" if silent else result.text, "segments": segments})
+    return outputs
+
+
+def _ok(item: BatchItem, result: dict) -> dict:
+    return {
+        "index": item.index,
+        "fileName": item.file_name,
+        "status": "ok",
+        "audioHash": item.audio_hash,
+        "text": result["text"],
+        "segments": result["segments"],
+    }
+
+
+def _error(item: BatchItem, error: Exception) -> dict:
+    logger.error(f"Помилка пакетного транскрибування {item.file_name}: {str(error)}")
+    return {
+        "index": item.index,
+        "fileName": item.file_name,
+        "status": "error",
+        "detail": str(error),
+    }
+
+
+async def transcribe_batch(
+    items: List[BatchItem],
+    model_name: Optional[str] = None,
+    options: Optional[dict] = None,
+    priority: str = BULK,
+    client: Optional[str] = None,
+) -> AsyncIterator[dict]:
+    """Транскрибує всі записи і віддає результати в порядку завершення"""
+    pool = await wait_pool()
+    model_name = resolve_model(model_name)
+    options = DECODE_OPTIONS if options is None else options
+    results: "asyncio.Queue[dict]" = asyncio.Queue()
+    decode_semaphore = asyncio.Semaphore(BATCH_DECODE_CONCURRENCY)
+    pending: List[Tuple[BatchItem, np.ndarray]] = []
+    group_tasks: List[asyncio.Task] = []
+
+    async def remember(item: BatchItem, key_options: dict, result: dict):
+        """Помилка кешу не скасовує вже готовий результат"""
+        try:
+            await cache.aput(make_key(item.audio_hash, model_name, key_options), result)
+        except Exception as e:
+            logger.warning(f"Не вдалося закешувати результат {item.file_name}: {str(e)}")
+
+    async def run_group(group: List[Tuple[BatchItem, np.ndarray]]):
+        # Група декодується за одне вікно - стільки, скільки найдовший запис
+        ticket = Ticket(priority, max(get_duration(audio) for _, audio in group), client)
+        try:
+            outputs = await pool.submit_waiting(
+                run_batch_decode, [audio for _, audio in group], options,
+                model_name=model_name, ticket=ticket
+            )
+        except Exception as e:
+            for item, _ in group:
+                results.put_nowait(_error(item, e))
+            return
+        for (item, _), output in zip(group, outputs):
+            await remember(item, batch_options(options), output)
+            results.put_nowait(_ok(item, output))
+
+    def flush():
+        if pending:
+            group = pending[:]
+            pending.clear()
+            group_tasks.append(asyncio.create_task(run_group(group)))
+
+    # Файли, які ще кешуються чи декодуються; поки вони є, неповний батч може доповнитися
+    undecoded = len(items)
+
+    def decoded():
+        nonlocal undecoded
+        undecoded -= 1
+        if undecoded == 0:
+            # Залишок коротких записів, що не набрав повного батчу, - не чекаючи довгих файлів
+            flush()
+
+    async def load(item: BatchItem) -> Optional[np.ndarray]:
+        """Декодоване аудіо або None, якщо результат уже віддано з кешу"""
+        # Повний результат звичайного транскрибування кращий за пакетний
+        for key_options in (options, batch_options(options)):
+            cached = await cache.aget(make_key(item.audio_hash, model_name, key_options))
+            CACHE_RESULTS.inc("miss" if cached is None else "hit")
+            if cached is not None:
+                results.put_nowait(_ok(item, cached))
+                return None
+
+        async with decode_semaphore:
+            return await decode_audio(str(item.path))
+
+    async def process(item: BatchItem):
+        try:
+            audio = await load(item)
+        except Exception as e:
+            results.put_nowait(_error(item, e))
+            audio = None
+        if audio is not None and len(audio) <= WINDOW_SECONDS * SAMPLE_RATE:
+            pending.append((item, audio))
+            if len(pending) >= BATCH_MAX_SIZE:
+                flush()
+            audio = None
+        decoded()
+        if audio is None:
+            return
+
+        try:
+            result = await transcribe_decoded(audio, None, model_name, options, priority, client)
+        except Exception as e:
+            results.put_nowait(_error(item, e))
+            return
+        await remember(item, options, result)
+        results.put_nowait(_ok(item, result))
+
+    async def run_all() -> Optional[BaseException]:
+        try:
+            outcomes = await asyncio.gather(*(process(item) for item in items), return_exceptions=True)
+            outcomes += await asyncio.gather(*group_tasks, return_exceptions=True)
+            return next((e for e in outcomes if isinstance(e, Exception)), None)
+        finally:
+            results.put_nowait(_DONE)
+
+    runner = asyncio.create_task(run_all())
+    try:
+        reported = set()
+        while True:
+            result = await results.get()
+            if result is _DONE:
+                break
+            reported.add(result["index"])
+            yield result
+        # Записи, результат яких загубила неочікувана помилка, теж отримують відповідь
+        error = await runner or RuntimeError("Результат не отримано")
+        for item in items:
+            if item.index not in reported:
+                yield _error(item, error)
+    finally:
+        # Клієнт відключився - зупиняємо решту роботи
+        if not runner.done():
+            runner.cancel()
+        for task in group_tasks:
+            task.cancel()
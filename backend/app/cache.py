@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Кеш результатів транскрибування за хешем вмісту аудіо.
+
+Ключ - sha256 аудіо разом з назвою моделі та параметрами декодування.
+Перший рівень - LRU у пам'яті, другий - SQLite файл, який переживає
+перезапуск. Обидва рівні мають обмеження розміру і витісняють записи,
+що найдовше не використовувалися.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CACHE_DB_PATH = Path(os.getenv('CACHE_DB_PATH', str(BASE_DIR / "transcription_cache.sqlite3")))
+# Кількість записів у пам'яті
+CACHE_MEMORY_ENTRIES = int(os.getenv('CACHE_MEMORY_ENTRIES', '256'))
+# Обмеження розміру дискового рівня в байтах; 0 вимикає дисковий рівень
+CACHE_DISK_MAX_BYTES = int(os.getenv('CACHE_DISK_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """Хеш файлу, прочитаного частинами"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(audio_hash: str, model: str, options: dict) -> str:
+    payload = json.dumps({"audio": audio_hash, "model": model, "options": options}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TranscriptionCache:
+    def __init__(self, db_path: Path, memory_entries: int, disk_max_bytes: int):
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_bytes = 0
+        if disk_max_bytes > 0:
+            self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+            self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            disk_entries = 0
+            if self._conn is not None:
+                disk_entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memoryEntries": len(self._memory),
+                "diskEntries": disk_entries,
+                "diskBytes": self._disk_bytes,
+            }
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._remember(key, value)
+            if self._conn is None:
+                return
+            data = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+            row = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._disk_bytes -= row[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _remember(self, key: str, value: dict):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # Звільняємо з запасом до 90% ліміту, щоб не витісняти на кожному записі
+        target = int(self.disk_max_bytes * 0.9)
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache ORDER BY accessed_at"):
+            if self._disk_bytes <= target:
+                break
+            evicted.append((key,))
+            self._disk_bytes -= size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        logger.info(f"Кеш: витіснено {len(evicted)} записів з диска")
+
+    async def aget(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: dict):
+        await asyncio.to_thread(self.put, key, value)
+
+
+cache = TranscriptionCache(CACHE_DB_PATH, CACHE_MEMORY_ENTRIES, CACHE_DISK_MAX_BYTES)
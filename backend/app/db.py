@@ -1,11 +1,22 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy.orm import sessionmaker, declarative_base, load_only, aliased
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, Text, DateTime, JSON, Float, Index,
+    event, select, delete, insert, update, exists, and_, or_, func, inspect, text
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
 import os
 import json
 from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 import logging
+from .metrics import stage_timer
+from .search import postings
+from .segments import apply_diff, diff_segments, is_packed, pack_segments, unpack_segments
 
 # Налаштування логування
 logging.basicConfig(level=logging.INFO)
@@ -18,10 +29,37 @@ DB_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 DB_PORT = os.getenv('POSTGRES_PORT', '5432')
 DB_NAME = os.getenv('POSTGRES_DB', 'voicetotext')
 
-DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Локальний SQLite файл, якщо Postgres не налаштовано
+SQLITE_PATH = Path(__file__).resolve().parent / "transcriptions.sqlite3"
+
+if os.getenv('DATABASE_URL'):
+    DATABASE_URL = os.environ['DATABASE_URL']
+elif os.getenv('POSTGRES_HOST'):
+    DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+else:
+    DATABASE_URL = f"sqlite+aiosqlite:///{SQLITE_PATH}"
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
 # Створення engine
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=os.getenv('DB_ECHO', '0') == '1',
+    future=True,
+    # Кирилиця як UTF-8, а не \uXXXX: текст сегментів займає втричі менше
+    json_serializer=lambda value: json.dumps(value, ensure_ascii=False),
+    **({"connect_args": {"timeout": 30}} if IS_SQLITE else {"pool_pre_ping": True})
+)
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL дозволяє читати паралельно із записом, busy_timeout - чекати на блокування замість помилки
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
 
 # Сесія
 AsyncSessionLocal = sessionmaker(
@@ -40,22 +78,155 @@ class Transcription(Base):
     __tablename__ = 'transcriptions'
     id = Column(Integer, primary_key=True, index=True)
     text = Column(Text, nullable=False)
+    # Сегменти у колонковому форматі (app.segments)
     segments = Column(JSON, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     filename = Column(String(256), nullable=True)
+    # Ідентифікатор роботи, який передає фронтенд
+    work_id = Column(String(64), nullable=True, index=True)
+    edited_text = Column(Text, nullable=True)
+    # Різниця відредагованих сегментів з segments; None - не редагувалися
+    edited_segments = Column(JSON, nullable=True)
+    # Аудіо у спільному сховищі: sha256 вмісту і шлях відносно AUDIO_DIR на момент збереження;
+    # актуальний файл і його тип (після перекодування - .ogg) беруться з audio_blobs
+    audio_hash = Column(String(64), nullable=True, index=True)
+    audio_path = Column(String(512), nullable=True)
+    content_type = Column(String(64), nullable=True)
+
+# Аудіо у спільному сховищі: один файл на вміст, refcount - кількість записів, що на нього посилаються
+class AudioBlob(Base):
+    __tablename__ = 'audio_blobs'
+    hash = Column(String(64), primary_key=True)
+    path = Column(String(512), nullable=False)
+    content_type = Column(String(64), nullable=True)
+    size = Column(BigInteger, nullable=True)
+    refcount = Column(Integer, nullable=False, default=0)
+    # Тривалість і параметри оригіналу зберігаються і після перекодування
+    duration = Column(Float, nullable=True)
+    original_content_type = Column(String(64), nullable=True)
+    original_size = Column(BigInteger, nullable=True)
+    # Коли файл перевірено фоновим перекодуванням (None - ще не перевірено)
+    transcoded_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+def _add_blob_ref(record: Transcription):
+    """Insert або +1 до refcount одним запитом, без гонки між паралельними збереженнями"""
+    insert_blob = sqlite_insert if IS_SQLITE else pg_insert
+    statement = insert_blob(AudioBlob).values(
+        hash=record.audio_hash,
+        path=record.audio_path,
+        content_type=record.content_type,
+        refcount=1,
+        created_at=datetime.utcnow(),
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[AudioBlob.hash],
+        set_={"refcount": AudioBlob.refcount + 1},
+    )
+
+# Інвертований індекс для пошуку: термін -> запис і сегмент (None - повний текст)
+class SearchPosting(Base):
+    __tablename__ = 'search_postings'
+    id = Column(Integer, primary_key=True)
+    term = Column(String(64), nullable=False)
+    transcription_id = Column(Integer, nullable=False, index=True)
+    segment = Column(Integer, nullable=True)
+    start = Column(Float, nullable=True)
+    end = Column(Float, nullable=True)
+    __table_args__ = (
+        Index('search_postings_term', 'term', 'transcription_id'),
+    )
+
+# Версія змісту індексу; при зміні індекс перебудовується під час init_db
+SEARCH_INDEX_VERSION = 2
+
+class SearchIndexState(Base):
+    __tablename__ = 'search_index_state'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+def _search_rows(record: Transcription) -> List[dict]:
+    """Індексуються розпізнаний текст і відредагований, якщо він є"""
+    texts = [record.text]
+    segment_versions = [unpack_segments(record.segments)]
+    if record.edited_text is not None:
+        texts.append(record.edited_text)
+    if record.edited_segments is not None:
+        segment_versions.append(apply_diff(record.segments, record.edited_segments))
+    return postings(record.id, texts, segment_versions)
+
+def _add_missing_columns(connection):
+    """Додає колонки, яких немає в таблиці, створеній попередньою версією"""
+    existing = {column["name"] for column in inspect(connection).get_columns(Transcription.__tablename__)}
+    for column in Transcription.__table__.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=connection.dialect)
+            logger.info(f"Додаємо колонку {column.name} до {Transcription.__tablename__}")
+            connection.execute(text(
+                f"ALTER TABLE {Transcription.__tablename__} ADD COLUMN {column.name} {column_type}"
+            ))
+
+# Ключ advisory lock PostgreSQL, під яким виконується ініціалізація
+INIT_LOCK_KEY = 0x566f6963
+
+def _lock_file(path: str):
+    handle = open(path, "a")
+    try:
+        import fcntl
+    except ImportError:
+        # Windows: LK_LOCK чекає близько 10 с і кидає OSError, тож повторюємо
+        import msvcrt
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+    else:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+    return handle
+
+@asynccontextmanager
+async def init_lock():
+    """Ініціалізацію виконує один воркер за раз: інші чекають і бачать уже готову базу"""
+    if not IS_SQLITE:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": INIT_LOCK_KEY})
+            try:
+                yield
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INIT_LOCK_KEY})
+        return
+    database = engine.url.database
+    if not database or database == ":memory:":
+        yield
+        return
+    # SQLite - файл на тому самому хості, тож воркерів розводить блокування файлу поруч із ним
+    handle = await asyncio.to_thread(_lock_file, f"{database}.init.lock")
+    try:
+        yield
+    finally:
+        handle.close()
 
 # Функція для створення таблиць
 async def init_db():
     logger.info("Ініціалізація бази даних...")
-    try:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-        logger.info("База даних успішно ініціалізована")
-    except Exception as e:
-        logger.error(f"Помилка ініціалізації бази даних: {str(e)}")
-        # Продовжуємо роботу, оскільки ми використовуємо JSON
+    async with init_lock():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(_add_missing_columns)
+            logger.info("База даних успішно ініціалізована")
+        except Exception as e:
+            logger.error(f"Помилка ініціалізації бази даних: {str(e)}")
+            raise
+        await migrate_legacy_history()
+        await build_search_index()
+        await build_blob_refcounts()
+        await compact_segments()
 
-# Функції для роботи з "БД" (насправді JSON)
+# Старе сховище історії (JSON файл), з якого виконується одноразова міграція
 HISTORY_FILE = Path(__file__).resolve().parent / "transcription_history.json"
 
 def load_history():
@@ -65,64 +236,427 @@ def load_history():
                 history = json.load(f)
                 logger.info(f"Завантажено {len(history)} записів з історії")
                 return history
-        logger.info("Файл історії не знайдено, створюємо новий")
+        logger.info("Файл історії не знайдено")
         return []
     except Exception as e:
         logger.error(f"Помилка завантаження історії: {str(e)}")
         return []
 
-def save_history(history):
+def _parse_date(value: str) -> datetime:
+    """Дата у форматі ISO або у форматі фронтенду (06.05.2025, 19:37:50)"""
+    for parse in (
+        datetime.fromisoformat,
+        lambda v: datetime.strptime(v, "%d.%m.%Y, %H:%M:%S"),
+    ):
+        try:
+            return parse(value)
+        except (TypeError, ValueError):
+            continue
+    return datetime.utcnow()
+
+def _from_work(item: dict) -> Transcription:
+    segments = pack_segments(item.get("segments"))
+    return Transcription(
+        work_id=str(item.get("id")) if item.get("id") is not None else None,
+        text=item["transcribedText"],
+        edited_text=item.get("editedText"),
+        segments=segments,
+        edited_segments=diff_segments(segments, item.get("editedSegments")),
+        created_at=_parse_date(item.get("date")),
+        filename=item.get("fileName"),
+        audio_hash=item.get("audioHash"),
+        audio_path=item.get("audioPath"),
+        content_type=item.get("contentType")
+    )
+
+async def migrate_legacy_history():
+    """Одноразово переносить записи з transcription_history.json у таблицю"""
+    if not HISTORY_FILE.exists():
+        return
+    async with AsyncSessionLocal() as session:
+        count = await session.scalar(select(func.count()).select_from(Transcription))
+        if count:
+            logger.warning(f"Таблиця вже містить {count} записів, міграцію {HISTORY_FILE} пропущено")
+            return
+    history = load_history()
+    # Порядок файлу зберігається, тож id записів збігаються з колишніми позиціями
+    await bulk_create_transcriptions(history)
     try:
-        with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-            logger.info(f"Збережено {len(history)} записів в історію")
-    except Exception as e:
-        logger.error(f"Помилка збереження історії: {str(e)}")
+        HISTORY_FILE.rename(HISTORY_FILE.with_name(HISTORY_FILE.name + ".migrated"))
+    except FileNotFoundError:
+        # Файл уже перейменував інший процес
+        pass
+    logger.info(f"Перенесено {len(history)} записів з {HISTORY_FILE}")
+
+async def bulk_create_transcriptions(items: List[dict]) -> int:
+    """Зберегти багато записів і їхні постинги однією транзакцією (міграція, бенчмарки)"""
+    async with AsyncSessionLocal() as session:
+        records = [_from_work(item) for item in items]
+        session.add_all(records)
+        await session.flush()
+        rows = [row for record in records for row in _search_rows(record)]
+        if rows:
+            await session.execute(insert(SearchPosting), rows)
+        await session.commit()
+    return len(records)
+
+async def build_search_index(batch_size: int = 500):
+    """Заповнює індекс для записів, створених до його появи або до зміни його версії"""
+    async with AsyncSessionLocal() as session:
+        state = await session.get(SearchIndexState, 1)
+        if state is not None and state.version == SEARCH_INDEX_VERSION:
+            return
+        # Індекс попередньої версії або без позначки версії будується заново
+        await session.execute(delete(SearchPosting))
+        logger.info("Побудова пошукового індексу історії...")
+        indexed = 0
+        last_id = 0
+        while True:
+            records = list(await session.scalars(
+                select(Transcription)
+                .options(load_only(
+                    Transcription.id, Transcription.text, Transcription.edited_text,
+                    Transcription.segments, Transcription.edited_segments
+                ))
+                .where(Transcription.id > last_id)
+                .order_by(Transcription.id)
+                .limit(batch_size)
+            ))
+            if not records:
+                break
+            rows = [row for record in records for row in _search_rows(record)]
+            if rows:
+                await session.execute(insert(SearchPosting), rows)
+            await session.commit()
+            indexed += len(records)
+            last_id = records[-1].id
+            session.expunge_all()
+        # Версія записується останньою: перерваний запуск почне побудову знову
+        await session.merge(SearchIndexState(id=1, version=SEARCH_INDEX_VERSION))
+        await session.commit()
+        logger.info(f"Пошуковий індекс побудовано для {indexed} записів")
+
+async def build_blob_refcounts():
+    """Заповнює refcount для аудіо записів, створених до появи таблиці audio_blobs"""
+    async with AsyncSessionLocal() as session:
+        if await session.scalar(select(AudioBlob.hash).limit(1)) is not None:
+            return
+        rows = (await session.execute(
+            select(
+                Transcription.audio_hash,
+                func.min(Transcription.audio_path),
+                func.min(Transcription.content_type),
+                func.count()
+            )
+            .where(Transcription.audio_hash.is_not(None), Transcription.audio_path.is_not(None))
+            .group_by(Transcription.audio_hash)
+        )).all()
+        if not rows:
+            return
+        await session.execute(insert(AudioBlob), [
+            {
+                "hash": audio_hash,
+                "path": path,
+                "content_type": content_type,
+                "refcount": count,
+                "created_at": datetime.utcnow(),
+            }
+            for audio_hash, path, content_type, count in rows
+        ])
+        await session.commit()
+        logger.info(f"Підраховано посилання на {len(rows)} аудіофайлів")
+
+async def compact_segments(batch_size: int = 500):
+    """Переводить сегменти записів, збережених списком, у колонковий формат"""
+    json_type = func.json_type if IS_SQLITE else func.json_typeof
+    async with AsyncSessionLocal() as session:
+        converted = 0
+        while True:
+            records = list(await session.scalars(
+                select(Transcription)
+                .options(load_only(Transcription.id, Transcription.segments, Transcription.edited_segments))
+                .where(json_type(Transcription.segments) == "array")
+                .order_by(Transcription.id)
+                .limit(batch_size)
+            ))
+            if not records:
+                break
+            for record in records:
+                segments = pack_segments(record.segments)
+                edited = record.edited_segments
+                record.segments = segments
+                if edited is not None and not is_packed(edited):
+                    record.edited_segments = diff_segments(segments, edited)
+            await session.commit()
+            converted += len(records)
+            session.expunge_all()
+        if converted:
+            logger.info(f"Сегменти {converted} записів переведено в компактний формат")
+
+async def get_audio_blob(audio_hash: str) -> Optional[AudioBlob]:
+    async with AsyncSessionLocal() as session:
+        return await session.get(AudioBlob, audio_hash)
+
+async def pending_transcodes(limit: int = 1000) -> List[str]:
+    """Аудіо з посиланнями, яке ще не перевірялося перекодуванням"""
+    async with AsyncSessionLocal() as session:
+        return list(await session.scalars(
+            select(AudioBlob.hash)
+            .where(AudioBlob.transcoded_at.is_(None), AudioBlob.refcount > 0)
+            .limit(limit)
+        ))
+
+async def finish_transcode(
+    audio_hash: str,
+    path: Optional[str] = None,
+    content_type: Optional[str] = None,
+    size: Optional[int] = None,
+    original_size: Optional[int] = None,
+    duration: Optional[float] = None
+):
+    """Позначає аудіо перевіреним; якщо передано path - файл замінено перекодованим"""
+    async with AsyncSessionLocal() as session:
+        blob = await session.get(AudioBlob, audio_hash)
+        if blob is None:
+            return
+        blob.transcoded_at = datetime.utcnow()
+        if duration is not None:
+            blob.duration = duration
+        if path is not None:
+            blob.original_content_type = blob.content_type
+            blob.original_size = original_size
+            blob.path, blob.content_type, blob.size = path, content_type, size
+        await session.commit()
+
+async def restore_original(audio_hash: str, path: str, content_type: Optional[str], size: int):
+    """Оригінал перекодованого аудіо завантажено знову: запис вказує на нього, а перекодування
+    повториться, коли файл перестане бути потрібним для транскрибування"""
+    async with AsyncSessionLocal() as session:
+        blob = await session.get(AudioBlob, audio_hash)
+        if blob is None or blob.path == path:
+            return
+        blob.path = path
+        blob.content_type = blob.original_content_type or content_type
+        blob.size = blob.original_size or size
+        blob.transcoded_at = None
+        await session.commit()
+
+# Скільки постингів терміна рахувати, вибираючи найрідкісніший термін запиту
+SEARCH_FREQUENCY_CAP = 1000
+
+def _term_condition(term: str, prefix: bool, posting=SearchPosting):
+    if prefix:
+        # Діапазон замість LIKE, щоб використовувався індекс за term
+        return and_(posting.term >= term, posting.term < term + "\uffff")
+    return posting.term == term
+
+async def _term_frequency(session, term: str, prefix: bool) -> int:
+    """Кількість постингів терміна, не більше SEARCH_FREQUENCY_CAP - лише з індексу"""
+    capped = (
+        select(SearchPosting.transcription_id)
+        .where(_term_condition(term, prefix))
+        .limit(SEARCH_FREQUENCY_CAP)
+        .subquery()
+    )
+    return await session.scalar(select(func.count()).select_from(capped))
+
+async def search_transcriptions(
+    terms: List[Tuple[str, bool]],
+    limit: int,
+    after: Optional[int] = None
+) -> List[dict]:
+    """Записи, повний текст яких містить усі терміни, від новіших до старіших,
+    разом із сегментами, де трапляється хоча б один термін"""
+    async with AsyncSessionLocal() as session:
+        frequencies = [0]
+        if len(terms) > 1:
+            frequencies = [await _term_frequency(session, term, prefix) for term, prefix in terms]
+            if not all(frequencies):
+                return []
+        # Постинги найрідкіснішого терміна обходимо за індексом (term, transcription_id)
+        # від новіших записів і зупиняємося на limit; решту термінів перевіряє EXISTS
+        driver_index = min(range(len(terms)), key=lambda i: (frequencies[i], terms[i][1]))
+        driver = aliased(SearchPosting)
+        ids_query = (
+            select(driver.transcription_id)
+            .where(_term_condition(*terms[driver_index], driver), driver.segment.is_(None))
+            .order_by(driver.transcription_id.desc())
+            .limit(limit)
+        )
+        if terms[driver_index][1]:
+            # Префікс може збігтися з кількома термінами одного запису
+            ids_query = ids_query.distinct()
+        for index, (term, prefix) in enumerate(terms):
+            if index == driver_index:
+                continue
+            other = aliased(SearchPosting)
+            ids_query = ids_query.where(exists().where(
+                other.transcription_id == driver.transcription_id,
+                other.segment.is_(None),
+                _term_condition(term, prefix, other),
+            ))
+        if after is not None:
+            ids_query = ids_query.where(driver.transcription_id < after)
+
+        ids = list(await session.scalars(ids_query))
+        if not ids:
+            return []
+        records = await session.scalars(
+            select(Transcription)
+            .options(load_only(Transcription.id, Transcription.filename, Transcription.created_at))
+            .where(Transcription.id.in_(ids))
+        )
+        by_id = {record.id: record for record in records}
+        hits = await session.execute(
+            select(
+                SearchPosting.transcription_id, SearchPosting.segment,
+                SearchPosting.start, SearchPosting.end, SearchPosting.term
+            )
+            .where(
+                SearchPosting.transcription_id.in_(ids),
+                SearchPosting.segment.is_not(None),
+                or_(*(_term_condition(term, prefix) for term, prefix in terms))
+            )
+        )
+
+    segments: Dict[int, Dict[int, dict]] = {record_id: {} for record_id in ids}
+    for record_id, index, start, end, term in hits:
+        segment = segments[record_id].setdefault(
+            index, {"index": index, "start": start, "end": end, "terms": set()}
+        )
+        segment["terms"].add(term)
+
+    results = []
+    for record_id in ids:
+        record = by_id.get(record_id)
+        if record is None:
+            continue
+        found = sorted(segments[record_id].values(), key=lambda s: s["index"])
+        results.append({
+            "id": str(record_id),
+            "fileName": record.filename,
+            "date": record.created_at.isoformat(),
+            "segments": [
+                {"index": s["index"], "start": s["start"], "end": s["end"], "matches": len(s["terms"])}
+                for s in found
+            ],
+        })
+    return results
 
-# Функції для імітації роботи з БД
 async def get_all_transcriptions():
     """Отримати всі транскрипції"""
-    history = load_history()
-    return [Transcription(
-        id=i,
-        text=item["transcribedText"],
-        segments=item["segments"],
-        created_at=datetime.fromisoformat(item["date"]),
-        filename=item["fileName"]
-    ) for i, item in enumerate(history, 1)]
+    async with AsyncSessionLocal() as session:
+        result = await session.scalars(select(Transcription).order_by(Transcription.id))
+        return list(result)
 
-async def get_transcription_by_id(transcription_id: int):
+async def list_transcriptions(limit: int, after: Optional[int] = None, columns: Iterable[str] = ("id",)):
+    """Сторінка транскрипцій від новіших до старіших, починаючи після id `after`.
+
+    Завантажуються лише колонки з `columns`, тож великі JSON поля не читаються,
+    якщо вони не потрібні.
+    """
+    query = (
+        select(Transcription)
+        .options(load_only(*(getattr(Transcription, name) for name in columns)))
+        .order_by(Transcription.id.desc())
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(Transcription.id < after)
+    async with AsyncSessionLocal() as session:
+        result = await session.scalars(query)
+        return list(result)
+
+async def iter_transcriptions(
+    columns: Iterable[str],
+    after: Optional[int] = None,
+    since: Optional[datetime] = None,
+    batch_size: int = 200
+) -> AsyncIterator[Transcription]:
+    """Записи за зростанням id порціями для експорту.
+
+    Сесія відкривається на кожну порцію і не тримається, поки споживач
+    обробляє записи, тож повільний клієнт не блокує БД.
+    """
+    last_id = after or 0
+    options = load_only(*(getattr(Transcription, name) for name in columns))
+    while True:
+        query = select(Transcription).options(options).where(Transcription.id > last_id)
+        if since is not None:
+            query = query.where(Transcription.created_at >= since)
+        async with AsyncSessionLocal() as session:
+            records = list(await session.scalars(query.order_by(Transcription.id).limit(batch_size)))
+        if not records:
+            return
+        for record in records:
+            yield record
+        last_id = records[-1].id
+
+async def get_transcription_by_id(transcription_id: int, columns: Optional[Iterable[str]] = None):
     """Отримати транскрипцію за ID"""
-    history = load_history()
-    if 0 < transcription_id <= len(history):
-        item = history[transcription_id - 1]
-        return Transcription(
-            id=transcription_id,
-            text=item["transcribedText"],
-            segments=item["segments"],
-            created_at=datetime.fromisoformat(item["date"]),
-            filename=item["fileName"]
+    async with AsyncSessionLocal() as session:
+        if columns is None:
+            return await session.get(Transcription, transcription_id)
+        return await session.scalar(
+            select(Transcription)
+            .options(load_only(*(getattr(Transcription, name) for name in columns)))
+            .where(Transcription.id == transcription_id)
         )
-    return None
 
 async def create_transcription(transcription: dict):
     """Створити нову транскрипцію"""
-    history = load_history()
-    history.append(transcription)
-    save_history(history)
-    return Transcription(
-        id=len(history),
-        text=transcription["transcribedText"],
-        segments=transcription["segments"],
-        created_at=datetime.fromisoformat(transcription["date"]),
-        filename=transcription["fileName"]
-    )
+    record = _from_work(transcription)
+    with stage_timer("db_write"):
+        async with AsyncSessionLocal() as session:
+            session.add(record)
+            # id потрібен для індексу; запис і його постинги зберігаються однією транзакцією
+            await session.flush()
+            rows = _search_rows(record)
+            if rows:
+                await session.execute(insert(SearchPosting), rows)
+            if record.audio_hash and record.audio_path:
+                await session.execute(_add_blob_ref(record))
+            await session.commit()
+    return record
 
-async def delete_transcription(transcription_id: int):
-    """Видалити транскрипцію"""
-    history = load_history()
-    if 0 < transcription_id <= len(history):
-        history.pop(transcription_id - 1)
-        save_history(history)
-        return True
-    return False 
\ No newline at end of file
+async def is_audio_referenced(audio_hash: str) -> bool:
+    """Чи посилається хоча б один запис на аудіо з таким хешем"""
+    async with AsyncSessionLocal() as session:
+        found = await session.scalar(
+            select(Transcription.id).where(Transcription.audio_hash == audio_hash).limit(1)
+        )
+        return found is not None
+
+async def delete_transcription(transcription_id: int) -> Tuple[bool, Optional[str]]:
+    """Видалити транскрипцію.
+
+    Повертає (чи видалено, шлях аудіо відносно AUDIO_DIR, на яке більше ніхто не посилається).
+    """
+    async with AsyncSessionLocal() as session:
+        record = await session.scalar(
+            select(Transcription)
+            .options(load_only(Transcription.id, Transcription.audio_hash, Transcription.audio_path))
+            .where(Transcription.id == transcription_id)
+        )
+        if record is None:
+            return False, None
+        await session.execute(
+            delete(Transcription).where(Transcription.id == transcription_id)
+        )
+        await session.execute(
+            delete(SearchPosting).where(SearchPosting.transcription_id == transcription_id)
+        )
+
+        unreferenced = None
+        if record.audio_hash and record.audio_path:
+            await session.execute(
+                update(AudioBlob)
+                .where(AudioBlob.hash == record.audio_hash)
+                .values(refcount=AudioBlob.refcount - 1)
+            )
+            blob = await session.get(AudioBlob, record.audio_hash, populate_existing=True)
+            if blob is not None and blob.refcount <= 0:
+                unreferenced = blob.path
+                await session.delete(blob)
+        await session.commit()
+        return True, unreferenced
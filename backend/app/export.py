@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Формати експорту історії: субтитри SRT/WebVTT і потоковий tar корпусу.
+
+tar збирається вручну з заголовків tarfile, щоб аудіо йшло у відповідь
+частинами: tarfile у режимі "w|" накопичив би весь файл у буфері.
+"""
+import tarfile
+from typing import Iterable, List
+
+import anyio
+
+TAR_BLOCK = tarfile.BLOCKSIZE
+# Кінець архіву - два порожні блоки
+TAR_END = b"\0" * (2 * TAR_BLOCK)
+# Розмір частини при читанні аудіо в архів
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _timestamp(seconds: float, separator: str) -> str:
+    milliseconds = max(0, int(round(seconds * 1000)))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def _cues(segments: Iterable[dict]) -> List[dict]:
+    """Сегменти з текстом; порожні субтитри плеєри показують як зайві паузи"""
+    return [segment for segment in segments if (segment.get("text") or "").strip()]
+
+
+def _cue_text(segment: dict) -> str:
+    # "-->" у тексті зламав би розбір репліки
+    return segment["text"].strip().replace("-->", "->")
+
+
+def to_srt(segments: Iterable[dict]) -> str:
+    blocks = []
+    for number, segment in enumerate(_cues(segments), start=1):
+        start = _timestamp(segment["start"], ",")
+        end = _timestamp(segment["end"], ",")
+        blocks.append(f"{number}\n{start} --> {end}\n{_cue_text(segment)}\n")
+    return "\n".join(blocks)
+
+
+def to_vtt(segments: Iterable[dict]) -> str:
+    blocks = ["WEBVTT\n"]
+    for segment in _cues(segments):
+        start = _timestamp(segment["start"], ".")
+        end = _timestamp(segment["end"], ".")
+        blocks.append(f"{start} --> {end}\n{_cue_text(segment)}\n")
+    return "\n".join(blocks)
+
+
+def tar_header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    # PAX - для довгих і не-ASCII імен
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8")
+
+
+def tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % TAR_BLOCK)
+
+
+def tar_bytes_member(name: str, data: bytes, mtime: float) -> bytes:
+    return tar_header(name, len(data), mtime) + data + tar_padding(len(data))
+
+
+async def tar_file_member(name: str, path, size: int, mtime: float):
+    """Заголовок і вміст файлу частинами; розмір фіксується заздалегідь"""
+    yield tar_header(name, size, mtime)
+    remaining = size
+    async with await anyio.open_file(path, "rb") as f:
+        while remaining > 0:
+            chunk = await f.read(min(EXPORT_CHUNK_SIZE, remaining))
+            if not chunk:
+                # Файл став коротшим під час читання - доповнюємо, щоб не зламати архів
+                chunk = b"\0" * min(EXPORT_CHUNK_SIZE, remaining)
+            remaining -= len(chunk)
+            yield chunk
+    yield tar_padding(size)
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""Пул воркерів для інференсу Whisper поза event loop.
+
+Кожна репліка живе у власному потоці з власним LRU завантажених моделей
+і обробляє задачі з обмеженої черги. Якщо черга заповнена, submit() одразу
+піднімає QueueFullError з оцінкою часу для заголовка Retry-After.
+
+Задачі з квитком (scheduler.Ticket) спершу чекають слот у планувальнику,
+тож порядок виконання визначає він, а не порядок надходження. Якщо той, хто
+чекає результат, скасований (клієнт відключився), задача в черзі
+пропускається, а запущена зупиняється на наступному оновленні прогресу.
+"""
+import asyncio
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .metrics import QUEUE_WAIT_SECONDS, SCHEDULER_CANCELLED, STAGE_SECONDS
+from .models import MODEL_MEMORY_BUDGET_MB, ModelCache, resolve_model
+from .scheduler import Scheduler, Ticket
+
+logger = logging.getLogger(__name__)
+
+# Налаштування пулу
+INFERENCE_REPLICAS = int(os.getenv('INFERENCE_REPLICAS', '1'))
+# 0 означає "поділити ядра порівну між репліками"
+INFERENCE_TORCH_THREADS = int(os.getenv('INFERENCE_TORCH_THREADS', '0'))
+INFERENCE_QUEUE_SIZE = int(os.getenv('INFERENCE_QUEUE_SIZE', '16'))
+
+
+class QueueFullError(Exception):
+    """Черга інференсу заповнена, клієнт має повторити запит пізніше"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Черга інференсу заповнена, повторіть через {retry_after} с")
+        self.retry_after = retry_after
+
+
+class JobCancelledError(Exception):
+    """Задачу скасовано під час виконання в репліці"""
+
+    def __init__(self):
+        super().__init__("Задачу скасовано")
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "loop", "model_name", "enqueued_at", "cancelled")
+
+    def __init__(self, fn, args, kwargs, future, loop, model_name):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.loop = loop
+        self.model_name = model_name
+        self.enqueued_at = time.monotonic()
+        self.cancelled = threading.Event()
+
+
+# Задача, яку зараз виконує потік репліки
+_current = threading.local()
+
+
+def raise_if_cancelled():
+    """Викликається з коду задачі в потоці репліки, наприклад з колбека прогресу"""
+    job = getattr(_current, "job", None)
+    if job is not None and job.cancelled.is_set():
+        raise JobCancelledError()
+
+
+def _set_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exc: BaseException):
+    if not future.done():
+        future.set_exception(exc)
+
+
+class InferencePool:
+    """Фіксована кількість реплік моделі, кожна у своєму потоці"""
+
+    def __init__(
+        self,
+        model_loader: Callable[[str, int], Any],
+        replicas: int = INFERENCE_REPLICAS,
+        torch_threads: int = INFERENCE_TORCH_THREADS,
+        queue_size: int = INFERENCE_QUEUE_SIZE,
+        memory_budget_mb: int = MODEL_MEMORY_BUDGET_MB,
+    ):
+        self.model_loader = model_loader
+        self.replicas = max(1, replicas)
+        if torch_threads <= 0:
+            torch_threads = max(1, (os.cpu_count() or 1) // self.replicas)
+        self.torch_threads = torch_threads
+        self.default_model = resolve_model(None)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._caches: List[ModelCache] = []
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=max(1, queue_size))
+        self.scheduler = Scheduler(self.replicas)
+        self._threads: List[threading.Thread] = []
+        self._busy = 0
+        self._lock = threading.Lock()
+        # Ковзне середнє тривалості задачі, для Retry-After
+        self._avg_job_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    def memory_usage(self) -> Dict[Tuple[str, str], int]:
+        """Оцінка пам'яті кожної завантаженої моделі: (репліка, модель) -> байти"""
+        return {
+            (str(index), spec): size
+            for index, cache in enumerate(self._caches)
+            for spec, size in cache.sizes().items()
+        }
+
+    def loaded_models(self) -> List[List[str]]:
+        """Завантажені моделі кожної репліки, від найдавніше вживаної"""
+        return [cache.loaded() for cache in self._caches]
+
+    def start(self):
+        """Запускає потоки реплік і чекає, поки кожна завантажить модель за замовчуванням"""
+        import torch
+
+        # Кількість потоків torch глобальна для процесу, але кожен потік,
+        # що викликає torch, отримує власну команду intra-op потоків цього розміру
+        torch.set_num_threads(self.torch_threads)
+        logger.info(
+            f"Запуск пулу інференсу: реплік {self.replicas}, "
+            f"потоків torch на репліку {self.torch_threads}"
+        )
+
+        ready = []
+        errors: List[BaseException] = []
+        for index in range(self.replicas):
+            event = threading.Event()
+            thread = threading.Thread(
+                target=self._worker,
+                args=(index, event, errors),
+                name=f"whisper-replica-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+            ready.append(event)
+
+        for event in ready:
+            event.wait()
+        if errors:
+            self.shutdown()
+            raise errors[0]
+        logger.info("Всі репліки моделі завантажені")
+
+    def shutdown(self, timeout: float = 5.0):
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    def retry_after(self) -> int:
+        """Оцінка в секундах, коли в черзі звільниться місце"""
+        # Місце в черзі звільняється, коли одна з реплік бере наступну задачу
+        average = self._avg_job_seconds or 30.0
+        return max(1, math.ceil(average / self.replicas))
+
+    async def submit(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        model_name: Optional[str] = None,
+        ticket: Optional[Ticket] = None,
+        **kwargs,
+    ) -> Any:
+        """Виконати fn(model, *args, **kwargs) в одній з реплік.
+
+        model_name - канонічна назва з models.resolve_model; None - модель за замовчуванням.
+        ticket - клас, тривалість і клієнт для планувальника; без нього задача йде в чергу одразу.
+        """
+        if ticket is not None:
+            async with self.scheduler.slot(ticket):
+                return await self.submit(fn, *args, model_name=model_name, **kwargs)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = _Job(fn, args, kwargs, future, loop, model_name or self.default_model)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(self.retry_after())
+        try:
+            return await future
+        except asyncio.CancelledError:
+            job.cancelled.set()
+            raise
+
+    async def submit_waiting(self, fn: Callable[..., Any], *args, ticket: Optional[Ticket] = None, **kwargs) -> Any:
+        """Як submit(), але замість QueueFullError чекає, поки в черзі звільниться місце"""
+        if ticket is not None:
+            async with self.scheduler.slot(ticket):
+                return await self.submit_waiting(fn, *args, **kwargs)
+        while True:
+            try:
+                return await self.submit(fn, *args, **kwargs)
+            except QueueFullError as e:
+                await asyncio.sleep(e.retry_after)
+
+    def _worker(self, index: int, ready: threading.Event, errors: List[BaseException]):
+        cache = ModelCache(lambda spec: self.model_loader(spec, self.torch_threads), self.memory_budget)
+        self._caches.append(cache)
+        try:
+            cache.get(self.default_model)
+            logger.info(f"Репліка {index}: модель завантажена")
+        except BaseException as e:
+            logger.error(f"Репліка {index}: помилка завантаження моделі: {str(e)}")
+            errors.append(e)
+            return
+        finally:
+            ready.set()
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            # Клієнт міг відключитися, поки задача чекала в черзі
+            if job.future.cancelled():
+                SCHEDULER_CANCELLED.inc("queued")
+                continue
+
+            with self._lock:
+                self._busy += 1
+            started = time.monotonic()
+            QUEUE_WAIT_SECONDS.observe(started - job.enqueued_at)
+            _current.job = job
+            try:
+                # Інша модель завантажується при першому запиті і лишається в LRU репліки
+                model = cache.get(job.model_name)
+                result = job.fn(model, *job.args, **job.kwargs)
+            except JobCancelledError as e:
+                SCHEDULER_CANCELLED.inc("running")
+                logger.info(f"Репліка {index}: задачу скасовано")
+                job.loop.call_soon_threadsafe(_set_exception, job.future, e)
+            except BaseException as e:
+                job.loop.call_soon_threadsafe(_set_exception, job.future, e)
+            else:
+                job.loop.call_soon_threadsafe(_set_result, job.future, result)
+            finally:
+                _current.job = None
+                elapsed = time.monotonic() - started
+                STAGE_SECONDS.observe(elapsed, "inference")
+                with self._lock:
+                    self._busy -= 1
+                    if self._avg_job_seconds:
+                        self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+                    else:
+                        self._avg_job_seconds = elapsed
+
+
+_pool: Optional[InferencePool] = None
+# Стан завантаження для /readyz: loading, ready або failed
+_pool_state = "loading"
+_pool_error: Optional[str] = None
+_pool_ready: Optional[asyncio.Event] = None
+
+
+def _ready_event() -> asyncio.Event:
+    global _pool_ready
+    if _pool_ready is None:
+        _pool_ready = asyncio.Event()
+    return _pool_ready
+
+
+def get_pool() -> InferencePool:
+    if _pool is None:
+        raise RuntimeError("Пул інференсу не запущено")
+    return _pool
+
+
+def pool_status() -> Tuple[str, Optional[str]]:
+    """Стан завантаження моделей і текст помилки, якщо воно не вдалося"""
+    return _pool_state, _pool_error
+
+
+async def wait_pool() -> InferencePool:
+    """Пул інференсу; поки моделі завантажуються у фоні, запит чекає"""
+    if _pool is None:
+        await _ready_event().wait()
+    if _pool is None:
+        raise RuntimeError(f"Модель не завантажилася: {_pool_error}")
+    return _pool
+
+
+async def start_pool(
+    model_loader: Callable[[str, int], Any],
+    warm_up: Optional[Callable[[InferencePool], Awaitable[None]]] = None,
+) -> InferencePool:
+    """Завантажити моделі реплік і прогріти їх; до завершення пул не вважається готовим"""
+    global _pool, _pool_state, _pool_error
+    pool = InferencePool(model_loader)
+    try:
+        await asyncio.to_thread(pool.start)
+        if warm_up is not None:
+            await warm_up(pool)
+    except Exception as e:
+        _pool_state, _pool_error = "failed", str(e)
+        _ready_event().set()
+        raise
+    _pool, _pool_state = pool, "ready"
+    _ready_event().set()
+    return pool
+
+
+def stop_pool():
+    global _pool, _pool_state, _pool_ready
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+    _pool_state = "loading"
+    _pool_ready = None
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""Асинхронні задачі транскрибування з локальною таблицею задач.
+
+Задачі зберігаються у SQLite, тому після перезапуску воркера незавершені
+задачі (queued/running) запускаються знову з файлу, що лишився на диску.
+Скасована задача (cancel()) переходить у стан cancelled і не відновлюється.
+
+Таблицю ділять кілька воркерів uvicorn: кожна незавершена задача належить
+одному воркеру, який періодично оновлює її heartbeat. Чужу задачу воркер
+забирає атомарним UPDATE лише тоді, коли її власник не оновлював heartbeat
+довше за JOBS_LEASE_SECONDS, тож задача не виконується двічі.
+Завершені задачі видаляються через JOBS_RETENTION_HOURS.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from .audio_store import blob_content_type, blob_hash, relative_audio_path
+from .db import create_transcription
+from .inference import QueueFullError, get_pool
+from .progress import hub
+from .scheduler import INTERACTIVE
+from .transcode import transcoder
+from .transcription import transcribe_file
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+JOBS_DB_PATH = Path(os.getenv('JOBS_DB_PATH', str(BASE_DIR / "jobs.sqlite3")))
+# Скільки задач може одночасно чекати в таблиці
+JOBS_MAX_PENDING = int(os.getenv('JOBS_MAX_PENDING', '64'))
+# Як часто воркер підтверджує, що його задачі ще виконуються
+JOBS_HEARTBEAT_SECONDS = float(os.getenv('JOBS_HEARTBEAT_SECONDS', '10'))
+# Через скільки секунд без heartbeat задачу може забрати інший воркер
+JOBS_LEASE_SECONDS = float(os.getenv('JOBS_LEASE_SECONDS', '60'))
+# Скільки годин зберігаються завершені задачі разом з результатом
+JOBS_RETENTION_HOURS = float(os.getenv('JOBS_RETENTION_HOURS', '168'))
+# Старі задачі видаляються не частіше ніж раз на годину
+JOBS_PRUNE_INTERVAL = 3600
+# Retry-After, поки моделі ще завантажуються і оцінки тривалості задачі немає
+JOBS_RETRY_AFTER_LOADING = 30
+
+# Формат id задачі, який може передати клієнт
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+UNFINISHED = (QUEUED, RUNNING)
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobStore:
+    """Таблиця задач у локальному SQLite файлі"""
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                file_name TEXT,
+                audio_path TEXT NOT NULL,
+                error TEXT,
+                result TEXT,
+                model TEXT,
+                options TEXT,
+                priority TEXT,
+                client TEXT,
+                owner TEXT,
+                heartbeat REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        # Таблиці, створені до вибору моделі клієнтом, планувальника і власників задач
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (
+            ("model", "TEXT"), ("options", "TEXT"), ("priority", "TEXT"), ("client", "TEXT"),
+            ("owner", "TEXT"), ("heartbeat", "REAL"),
+        ):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+
+    def insert(
+        self,
+        job_id: str,
+        file_name: str,
+        audio_path: str,
+        model: Optional[str] = None,
+        options: Optional[dict] = None,
+        priority: str = INTERACTIVE,
+        client: Optional[str] = None,
+        owner: Optional[str] = None,
+    ):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, state, file_name, audio_path, model, options, priority, client, "
+                "owner, heartbeat, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, QUEUED, file_name, audio_path, model,
+                    json.dumps(options) if options is not None else None, priority, client,
+                    owner, now, now, now,
+                ),
+            )
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def uses_audio(self, audio_path: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE audio_path = ? AND state IN (?, ?) LIMIT 1",
+                (audio_path, QUEUED, RUNNING),
+            ).fetchone()
+        return row is not None
+
+    def expired(self, lease: float):
+        """Незавершені задачі без власника або з простроченим heartbeat"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE state IN (?, ?) AND (owner IS NULL OR heartbeat IS NULL OR heartbeat < ?) "
+                "ORDER BY created_at",
+                (*UNFINISHED, time.time() - lease),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim(self, job_id: str, owner: str, lease: float) -> bool:
+        """Атомарно забрати задачу; False, якщо її вже забрав інший воркер"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET owner = ?, heartbeat = ?, state = ?, progress = 0, updated_at = ? "
+                "WHERE id = ? AND state IN (?, ?) AND (owner IS NULL OR heartbeat IS NULL OR heartbeat < ?)",
+                (owner, now, QUEUED, now, job_id, *UNFINISHED, now - lease),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, owner: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND state IN (?, ?)",
+                (time.time(), owner, *UNFINISHED),
+            )
+
+    def release(self, owner: str):
+        """Віддати незавершені задачі воркера, що зупиняється, іншим без очікування lease"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET owner = NULL WHERE owner = ? AND state IN (?, ?)", (owner, *UNFINISHED)
+            )
+
+    def prune(self, max_age: float) -> int:
+        """Видалити завершені задачі, старші за max_age секунд"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?, ?) AND updated_at < ?",
+                (*FINISHED, time.time() - max_age),
+            )
+        return cursor.rowcount
+
+
+class JobManager:
+    """Запускає задачі у фоні та відстежує їхній стан"""
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self._progress: Dict[str, int] = {}
+        self._done: Dict[str, asyncio.Event] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Задачі, скасовані клієнтом, на відміну від зупинки воркера
+        self._cancelled: Set[str] = set()
+        # Унікальний для процесу власник задач у спільній таблиці
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def submit(
+        self,
+        audio_path: str,
+        file_name: str,
+        job_id: Optional[str] = None,
+        content_type: Optional[str] = None,
+        model_name: Optional[str] = None,
+        options: Optional[dict] = None,
+        priority: str = INTERACTIVE,
+        client: Optional[str] = None,
+    ) -> str:
+        """Поставити задачу в чергу; job_id може згенерувати клієнт, щоб підписатися заздалегідь.
+
+        model_name і options - модель і параметри декодування з validate_model_options,
+        priority і client - клас і власник задачі для планувальника інференсу.
+        """
+        if self.pending >= JOBS_MAX_PENDING:
+            raise QueueFullError(retry_after=self.retry_after())
+        if job_id is None:
+            job_id = uuid.uuid4().hex
+        elif not JOB_ID_PATTERN.match(job_id):
+            raise ValueError("Невірний формат id задачі")
+        try:
+            await asyncio.to_thread(
+                self.store.insert, job_id, file_name, audio_path, model_name, options, priority, client,
+                self.owner
+            )
+        except sqlite3.IntegrityError:
+            raise ValueError("Задача з таким id вже існує")
+        self._start(job_id, audio_path, file_name, content_type, model_name, options, priority, client)
+        logger.info(f"Задачу {job_id} поставлено в чергу")
+        return job_id
+
+    def retry_after(self) -> int:
+        """Коли звільниться місце: оцінка пулу за тривалістю останніх задач"""
+        try:
+            return get_pool().retry_after()
+        except RuntimeError:
+            return JOBS_RETRY_AFTER_LOADING
+
+    async def resume(self):
+        """Забирає і перезапускає задачі, власник яких зупинився або не відповідає"""
+        jobs = await asyncio.to_thread(self.store.expired, JOBS_LEASE_SECONDS)
+        for job in jobs:
+            if job["id"] in self._tasks:
+                continue
+            if not await asyncio.to_thread(self.store.claim, job["id"], self.owner, JOBS_LEASE_SECONDS):
+                continue
+            if not os.path.exists(job["audio_path"]):
+                await asyncio.to_thread(
+                    self.store.update, job["id"], state=FAILED, error="Аудіофайл задачі втрачено"
+                )
+                continue
+            logger.info(f"Відновлення задачі {job['id']}")
+            options = json.loads(job["options"]) if job["options"] else None
+            self._start(
+                job["id"], job["audio_path"], job["file_name"], None, job["model"], options,
+                job["priority"] or INTERACTIVE, job["client"]
+            )
+
+    def progress(self, job_id: str) -> Optional[int]:
+        return self._progress.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None and job_id in self._progress:
+            job["progress"] = self._progress[job_id]
+        return job
+
+    async def wait(self, job_id: str) -> dict:
+        """Чекає завершення задачі і повертає її запис"""
+        event = self._done.get(job_id)
+        if event is not None:
+            await event.wait()
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        """Скасувати задачу в черзі або під час транскрибування; False, якщо вона вже завершена"""
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            return False
+        self._cancelled.add(job_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def run_maintenance(self):
+        """Фоновий цикл: heartbeat своїх задач, підхоплення покинутих і видалення старих"""
+        last_prune = 0.0
+        while True:
+            await asyncio.sleep(JOBS_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, self.owner)
+                await self.resume()
+                if time.monotonic() - last_prune >= JOBS_PRUNE_INTERVAL:
+                    last_prune = time.monotonic()
+                    pruned = await asyncio.to_thread(self.store.prune, JOBS_RETENTION_HOURS * 3600)
+                    if pruned:
+                        logger.info(f"Видалено завершених задач: {pruned}")
+            except Exception as e:
+                logger.error(f"Помилка обслуговування задач: {str(e)}")
+
+    async def shutdown(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        await asyncio.to_thread(self.store.release, self.owner)
+
+    def _start(
+        self,
+        job_id: str,
+        audio_path: str,
+        file_name: str,
+        content_type: Optional[str] = None,
+        model_name: Optional[str] = None,
+        options: Optional[dict] = None,
+        priority: str = INTERACTIVE,
+        client: Optional[str] = None,
+    ):
+        self._done[job_id] = asyncio.Event()
+        self._tasks[job_id] = asyncio.create_task(
+            self._run(job_id, audio_path, file_name, content_type, model_name, options, priority, client)
+        )
+
+    async def _run(
+        self,
+        job_id: str,
+        audio_path: str,
+        file_name: str,
+        content_type: Optional[str],
+        model_name: Optional[str],
+        options: Optional[dict],
+        priority: str,
+        client: Optional[str],
+    ):
+        last_saved = 0
+
+        async def report(progress: int):
+            nonlocal last_saved
+            if progress < self._progress.get(job_id, 0):
+                return
+            self._progress[job_id] = progress
+            hub.publish(job_id, progress, RUNNING)
+            # Пишемо прогрес у таблицю не частіше ніж кожні 5%
+            if progress - last_saved >= 5:
+                last_saved = progress
+                await asyncio.to_thread(self.store.update, job_id, progress=progress)
+
+        audio_hash = blob_hash(audio_path)
+        try:
+            await asyncio.to_thread(self.store.update, job_id, state=RUNNING)
+            hub.publish(job_id, 0, RUNNING)
+            # Якщо пул зайнятий, задача чекає свого часу
+            result = await transcribe_file(
+                audio_path, report, audio_hash, model_name, options, priority, client
+            )
+
+            # Зберігаємо результат в "БД"
+            transcription_data = {
+                "id": str(int(time.time())),  # Використовуємо timestamp як ID
+                "fileName": file_name,
+                "date": datetime.utcnow().isoformat(),
+                "transcribedText": result["text"],
+                "editedText": result["text"],
+                "segments": result["segments"],
+                "editedSegments": result["segments"],
+                "audioHash": audio_hash,
+                "audioPath": relative_audio_path(Path(audio_path)) if audio_hash else None,
+                # Той самий хеш міг уже бути перекодований в .ogg
+                "contentType": blob_content_type(Path(audio_path), content_type)
+            }
+            await create_transcription(transcription_data)
+            transcoder.schedule(audio_hash)
+
+            await asyncio.to_thread(
+                self.store.update, job_id, state=DONE, progress=100,
+                result=json.dumps(result, ensure_ascii=False)
+            )
+            hub.publish(job_id, 100, DONE)
+            logger.info(f"Задачу {job_id} завершено")
+        except asyncio.CancelledError:
+            if job_id not in self._cancelled:
+                # Воркер зупиняється, задача лишається незавершеною і відновиться при старті
+                raise
+            logger.info(f"Задачу {job_id} скасовано")
+            await asyncio.to_thread(self.store.update, job_id, state=CANCELLED)
+            hub.publish(job_id, self._progress.get(job_id, 0), CANCELLED)
+        except Exception as e:
+            logger.error(f"Помилка в задачі {job_id}: {str(e)}")
+            await asyncio.to_thread(self.store.update, job_id, state=FAILED, error=str(e))
+            hub.publish(job_id, self._progress.get(job_id, 0), FAILED, error=str(e))
+        finally:
+            self._cancelled.discard(job_id)
+            self._progress.pop(job_id, None)
+            self._tasks.pop(job_id, None)
+            event = self._done.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+
+manager = JobManager(JobStore(JOBS_DB_PATH))
+
+
+def job_to_dict(job: dict) -> dict:
+    return {
+        "id": job["id"],
+        "state": job["state"],
+        "progress": job["progress"],
+        "fileName": job["file_name"],
+        "error": job["error"],
+        "model": job["model"],
+        "priority": job["priority"] or INTERACTIVE,
+        "createdAt": datetime.utcfromtimestamp(job["created_at"]).isoformat(),
+        "updatedAt": datetime.utcfromtimestamp(job["updated_at"]).isoformat(),
+    }
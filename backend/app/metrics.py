@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Метрики сервісу у текстовому форматі Prometheus для GET /metrics.
+
+Лічильники і гістограми оновлюються з event loop і з потоків реплік,
+тому кожна метрика має власне блокування. Gauge читають значення колбеком
+у момент запиту /metrics, тож на гарячому шляху їх ніхто не оновлює.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Межі гістограм затримки, секунд: від мілісекунд (крок декодера) до довгих записів
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Межі real-time factor: 1.0 - обробка триває стільки ж, скільки звучить аудіо
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для кожного набору міток: кількість у кожному кошику (не накопичувальна), сума
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значення читається колбеком під час запиту: число або {значення міток: число}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._callback: Optional[Callable[[], object]] = None
+
+    def set_function(self, callback: Callable[[], object]):
+        self._callback = callback
+
+    def samples(self) -> List[str]:
+        if self._callback is None:
+            return []
+        try:
+            value = self._callback()
+        except Exception:
+            # Недоступне джерело (наприклад, пул ще не запущено) - просто без значення
+            return []
+        if isinstance(value, dict):
+            items: Iterable = value.items()
+        else:
+            items = [((), value)]
+        return [
+            f"{self.name}{_labels(self.labelnames, key if isinstance(key, tuple) else (key,))} {_number(v)}"
+            for key, v in items
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Етапи конвеєра: upload, decode, mel, encoder, decoder, inference, db_write, broadcast
+STAGE_SECONDS = registry.register(Histogram(
+    "transcriber_stage_seconds", "Duration of a pipeline stage", ("stage",)
+))
+QUEUE_WAIT_SECONDS = registry.register(Histogram(
+    "transcriber_queue_wait_seconds", "Time a job waited in the inference queue"
+))
+REALTIME_FACTOR = registry.register(Histogram(
+    "transcriber_realtime_factor", "Processing time divided by audio duration", buckets=RTF_BUCKETS
+))
+AUDIO_SECONDS = registry.register(Counter(
+    "transcriber_audio_seconds_total", "Seconds of audio transcribed by the models"
+))
+CACHE_RESULTS = registry.register(Counter(
+    "transcriber_cache_lookups_total", "Transcription cache lookups", ("result",)
+))
+SCHEDULER_WAIT_SECONDS = registry.register(Histogram(
+    "transcriber_scheduler_wait_seconds", "Time a request waited for an inference slot", ("priority",)
+))
+SCHEDULER_CANCELLED = registry.register(Counter(
+    "transcriber_scheduler_cancelled_total", "Requests cancelled before or during inference", ("stage",)
+))
+WEBSOCKET_CONNECTIONS = registry.register(Gauge(
+    "transcriber_websocket_connections", "Open WebSocket connections"
+))
+QUEUE_DEPTH = registry.register(Gauge(
+    "transcriber_inference_queue_depth", "Jobs waiting in the inference queue"
+))
+BUSY_WORKERS = registry.register(Gauge(
+    "transcriber_inference_busy_workers", "Replicas currently running a job"
+))
+SCHEDULER_WAITING = registry.register(Gauge(
+    "transcriber_scheduler_waiting", "Requests waiting for an inference slot", ("priority",)
+))
+MODEL_MEMORY_BYTES = registry.register(Gauge(
+    "transcriber_model_memory_bytes", "Estimated memory of loaded models", ("replica", "model")
+))
+
+
+def stage_timer(stage: str):
+    """with stage_timer("decode"): ... - записує тривалість етапу в гістограму"""
+    return STAGE_SECONDS.time(stage)
+
+
+_forward_started = threading.local()
+
+
+def instrument_model(model):
+    """Хуки forward для encoder і decoder моделі Whisper (PyTorch).
+
+    Декодер викликається на кожен токен, тож його гістограма - це час одного кроку.
+    Моделі без цих модулів (CTranslate2) лишаються без хуків.
+    """
+    for stage in ("encoder", "decoder"):
+        module = getattr(model, stage, None)
+        if module is None or not hasattr(module, "register_forward_pre_hook"):
+            continue
+
+        def started(_module, _inputs, stage=stage):
+            setattr(_forward_started, stage, time.perf_counter())
+
+        def finished(_module, _inputs, _output, stage=stage):
+            begin = getattr(_forward_started, stage, None)
+            if begin is not None:
+                STAGE_SECONDS.observe(time.perf_counter() - begin, stage)
+
+        module.register_forward_pre_hook(started)
+        module.register_forward_hook(finished)
+    return model
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""Реєстр моделей Whisper з кількома бекендами.
+
+Модель задається рядком "<розмір>[:<бекенд>]", наприклад "base",
+"small:int8" або "medium:ct2":
+
+- torch - еталонна модель PyTorch (за замовчуванням)
+- int8  - та сама модель з динамічно квантизованими до int8 лінійними шарами, лише CPU
+- ct2   - CTranslate2 через faster-whisper, якщо пакет встановлено
+
+Кожна репліка пулу тримає завантажені моделі в ModelCache - LRU з
+обмеженням пам'яті, тож часто вживані моделі лишаються "теплими".
+
+Ваги бекенду torch на CPU читаються з файлу через mmap: при першому
+завантаженні чекпойнт перезаписується у суцільний файл тензорів, і всі
+процеси-воркери на хості ділять його сторінки замість власних копій.
+"""
+import gc
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .metrics import instrument_model
+
+logger = logging.getLogger(__name__)
+
+# Модель за замовчуванням і список моделей, які може обрати клієнт
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'base')
+WHISPER_MODELS = [m.strip() for m in os.getenv('WHISPER_MODELS', WHISPER_MODEL).split(',') if m.strip()]
+# Скільки пам'яті можуть займати моделі однієї репліки
+MODEL_MEMORY_BUDGET_MB = int(os.getenv('MODEL_MEMORY_BUDGET_MB', '2048'))
+# Пристрій для бекенду torch; int8 і ct2 завжди працюють на CPU
+WHISPER_DEVICE = os.getenv('WHISPER_DEVICE') or None
+# Читати ваги через спільний mmap замість приватної копії в кожному процесі
+WHISPER_MMAP = os.getenv('WHISPER_MMAP', '1') == '1'
+BASE_DIR = Path(__file__).resolve().parent.parent
+MODEL_MMAP_DIR = Path(os.getenv('MODEL_MMAP_DIR', str(BASE_DIR / "model_cache")))
+# Вирівнювання тензорів у файлі ваг
+MMAP_ALIGNMENT = 64
+
+BACKENDS = ("torch", "int8", "ct2")
+
+# Приблизна кількість параметрів для оцінки пам'яті ще до завантаження
+APPROX_PARAMS = {
+    "tiny": 39e6,
+    "base": 74e6,
+    "small": 244e6,
+    "medium": 769e6,
+    "turbo": 809e6,
+    "large": 1550e6,
+}
+# Байтів на параметр для кожного бекенду
+BYTES_PER_PARAM = {"torch": 4, "int8": 1.5, "ct2": 1}
+
+
+class ModelNotAvailableError(ValueError):
+    pass
+
+
+def parse_model_spec(spec: str) -> Tuple[str, str]:
+    name, _, backend = spec.strip().partition(":")
+    return name, backend or "torch"
+
+
+def normalize_model_spec(spec: str) -> str:
+    """Канонічна назва; для torch без суфікса, щоб ключі кешу не змінилися"""
+    name, backend = parse_model_spec(spec)
+    return name if backend == "torch" else f"{name}:{backend}"
+
+
+def available_models() -> List[str]:
+    return [normalize_model_spec(spec) for spec in WHISPER_MODELS]
+
+
+def resolve_model(spec: Optional[str]) -> str:
+    """Перевірити вибір клієнта; None означає модель за замовчуванням"""
+    if not spec:
+        return normalize_model_spec(WHISPER_MODEL)
+    spec = normalize_model_spec(spec)
+    _, backend = parse_model_spec(spec)
+    if backend not in BACKENDS:
+        raise ModelNotAvailableError(f"Невідомий бекенд моделі: {backend}")
+    if spec not in available_models() and spec != normalize_model_spec(WHISPER_MODEL):
+        raise ModelNotAvailableError(f"Модель недоступна: {spec}")
+    if backend == "ct2" and importlib.util.find_spec("faster_whisper") is None:
+        raise ModelNotAvailableError("Бекенд ct2 потребує пакета faster-whisper")
+    return spec
+
+
+def estimate_model_bytes(spec: str) -> int:
+    name, backend = parse_model_spec(spec)
+    base = name.split(".")[0].split("-")[0]
+    params = APPROX_PARAMS.get(base, APPROX_PARAMS["large"])
+    return int(params * BYTES_PER_PARAM.get(backend, 4))
+
+
+def model_memory_bytes(model) -> int:
+    """Фактичний розмір ваг завантаженої моделі"""
+    memory = getattr(model, "memory_bytes", None)
+    if memory is not None:
+        return memory
+    import torch
+
+    total = sum(p.numel() * p.element_size() for p in model.parameters())
+    total += sum(b.numel() * b.element_size() for b in model.buffers())
+    # Ваги динамічно квантизованих шарів не входять у parameters()
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            total += module.weight().numel()
+    return total
+
+
+def _mmap_paths(name: str) -> Tuple[Path, Path]:
+    return MODEL_MMAP_DIR / f"{name}.json", MODEL_MMAP_DIR / f"{name}.bin"
+
+
+def _export_mmap(model, name: str):
+    """Записати всі параметри і буфери моделі в суцільний файл з індексом"""
+    os.makedirs(MODEL_MMAP_DIR, exist_ok=True)
+    index_path, data_path = _mmap_paths(name)
+    tensors = []
+    offset = 0
+    fd, temp_path = tempfile.mkstemp(dir=MODEL_MMAP_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            named = list(model.named_parameters()) + list(model.named_buffers())
+            for tensor_name, tensor in named:
+                sparse = tensor.is_sparse
+                array = (tensor.to_dense() if sparse else tensor).detach().cpu().contiguous().numpy()
+                padding = -offset % MMAP_ALIGNMENT
+                out.write(b"\0" * padding)
+                offset += padding
+                tensors.append({
+                    "name": tensor_name,
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                    "offset": offset,
+                    "sparse": sparse,
+                })
+                out.write(array.tobytes())
+                offset += array.nbytes
+        # Спочатку дані, потім індекс: індекс без даних ніколи не з'явиться
+        os.replace(temp_path, data_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    index = {"dims": vars(model.dims), "tensors": tensors}
+    fd, temp_path = tempfile.mkstemp(dir=MODEL_MMAP_DIR, suffix=".part")
+    with os.fdopen(fd, "w") as out:
+        json.dump(index, out)
+    os.replace(temp_path, index_path)
+    logger.info(f"Ваги моделі {name} записано для mmap: {offset / 2**20:.0f} МБ")
+
+
+def _load_mmap(name: str):
+    """Модель, чиї тензори - подання на спільний read-only mmap файлу ваг"""
+    index_path, data_path = _mmap_paths(name)
+    if not index_path.exists() or not data_path.exists():
+        return None
+    import numpy as np
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+
+    with open(index_path) as f:
+        index = json.load(f)
+    data = np.memmap(data_path, dtype=np.uint8, mode="r")
+
+    dims = ModelDimensions(**index["dims"])
+    try:
+        # Модель без пам'яті під ваги; тензори підставляються з файлу
+        with torch.device("meta"):
+            model = Whisper(dims)
+    except Exception:
+        # Деякі буфери не будуються на meta - тоді тимчасово виділяємо пам'ять
+        model = Whisper(dims)
+    with warnings.catch_warnings():
+        # torch попереджає про незаписувані масиви; ваги лише читаються
+        warnings.simplefilter("ignore", UserWarning)
+        for entry in index["tensors"]:
+            count = int(np.prod(entry["shape"])) if entry["shape"] else 1
+            array = np.frombuffer(data, dtype=np.dtype(entry["dtype"]), count=count, offset=entry["offset"])
+            tensor = torch.from_numpy(array.reshape(entry["shape"]))
+            if entry["sparse"]:
+                tensor = tensor.to_sparse()
+            module_name, _, leaf = entry["name"].rpartition(".")
+            module = model.get_submodule(module_name)
+            if leaf in module._parameters:
+                module._parameters[leaf] = torch.nn.Parameter(tensor, requires_grad=False)
+            else:
+                module._buffers[leaf] = tensor
+
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        logger.warning(f"Файл ваг {data_path.name} неповний, модель буде завантажено звичайно")
+        return None
+    return model.eval()
+
+
+def resolve_device(device: Optional[str] = None) -> str:
+    """Пристрій як у whisper.load_model: CUDA, якщо вона є і пристрій не задано"""
+    if device:
+        return device
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_torch_model(name: str, device: Optional[str] = None):
+    """whisper.load_model, але на CPU ваги читаються через спільний mmap"""
+    import whisper
+
+    device = resolve_device(device)
+    if not WHISPER_MMAP or device != "cpu":
+        return whisper.load_model(name, device=device)
+    try:
+        model = _load_mmap(name)
+        if model is None:
+            _export_mmap(whisper.load_model(name, device="cpu"), name)
+            gc.collect()
+            model = _load_mmap(name)
+    except Exception as e:
+        logger.warning(f"Не вдалося завантажити {name} через mmap: {str(e)}")
+        model = None
+    return model if model is not None else whisper.load_model(name, device="cpu")
+
+
+def _quantize_int8(model):
+    import torch
+    import whisper.model
+
+    # whisper.model.Linear лише приводить тип ваг у forward; quantize_dynamic
+    # розпізнає тільки точний тип nn.Linear
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    # inplace, щоб не копіювати ваги з mmap; квантизовані шари все одно приватні
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class FasterWhisperModel:
+    """Адаптер faster-whisper з інтерфейсом transcribe() як у whisper"""
+
+    # Прогрес повідомляється самим адаптером, а не через tqdm whisper
+    native_progress = True
+
+    def __init__(self, name: str, cpu_threads: int = 0):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(name, device="cpu", compute_type="int8", cpu_threads=cpu_threads)
+        self.memory_bytes = estimate_model_bytes(f"{name}:ct2")
+
+    def transcribe(
+        self,
+        audio,
+        verbose=None,
+        on_progress: Optional[Callable[[float], None]] = None,
+        language: Optional[str] = None,
+        initial_prompt: Optional[str] = None,
+        condition_on_previous_text: bool = True,
+        **options,
+    ) -> dict:
+        segments, info = self.model.transcribe(
+            audio,
+            language=language,
+            initial_prompt=initial_prompt,
+            condition_on_previous_text=condition_on_previous_text,
+        )
+        result = []
+        for segment in segments:
+            result.append({
+                "id": len(result),
+                "seek": segment.seek,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "tokens": list(segment.tokens),
+                "temperature": getattr(segment, "temperature", 0.0),
+                "avg_logprob": segment.avg_logprob,
+                "compression_ratio": segment.compression_ratio,
+                "no_speech_prob": segment.no_speech_prob,
+            })
+            if on_progress is not None and info.duration:
+                on_progress(min(segment.end / info.duration, 1.0))
+        return {"text": "".join(s["text"] for s in result), "segments": result, "language": info.language}
+
+
+def load_model(spec: str, cpu_threads: int = 0):
+    """Завантажити модель за канонічною назвою"""
+    name, backend = parse_model_spec(spec)
+    logger.info(f"Завантаження моделі {name}, бекенд {backend}")
+    if backend == "ct2":
+        return FasterWhisperModel(name, cpu_threads)
+
+    if backend == "int8":
+        return instrument_model(_quantize_int8(load_torch_model(name, "cpu")))
+    return instrument_model(load_torch_model(name, WHISPER_DEVICE))
+
+
+class ModelCache:
+    """LRU завантажених моделей однієї репліки з обмеженням пам'яті"""
+
+    def __init__(self, loader: Callable[[str], Any], budget_bytes: int = MODEL_MEMORY_BUDGET_MB * 1024 * 1024):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(self._sizes[spec] for spec in self._models)
+
+    def loaded(self) -> List[str]:
+        return list(self._models)
+
+    def sizes(self) -> Dict[str, int]:
+        return {spec: self._sizes[spec] for spec in list(self._models)}
+
+    def get(self, spec: str):
+        model = self._models.get(spec)
+        if model is not None:
+            self._models.move_to_end(spec)
+            return model
+
+        # Звільняємо місце заздалегідь, щоб не тримати дві великі моделі одночасно
+        self._evict(self._sizes.get(spec) or estimate_model_bytes(spec))
+        model = self.loader(spec)
+        self._models[spec] = model
+        self._sizes[spec] = model_memory_bytes(model)
+        logger.info(f"Модель {spec} завантажена, {self._sizes[spec] / 2**20:.0f} МБ")
+        self._evict(0, keep=spec)
+        return model
+
+    def _evict(self, incoming: int, keep: Optional[str] = None):
+        while self._models and self.used_bytes + incoming > self.budget_bytes:
+            spec = next(iter(self._models))
+            if spec == keep:
+                break
+            del self._models[spec]
+            gc.collect()
+            logger.info(f"Модель {spec} вивантажена з пам'яті")
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Розсилка прогресу задач через WebSocket з підпискою на конкретну задачу.
+
+publish() ніколи не чекає на сокет: він лише оновлює останнє значення для
+задачі у вихідній черзі кожного підписника. Окрема задача-відправник на
+кожен сокет забирає накопичені оновлення не частіше ніж раз на
+PROGRESS_MIN_INTERVAL секунд, тож повільний клієнт не гальмує інших.
+Службові повідомлення при переповненні відкидаються, а ті, що не можна
+втратити (підтверджений текст живого потоку), - ні: якщо їх накопичилося
+забагато, з'єднання закривається.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Мінімальний інтервал між відправками одному клієнту
+PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL', '0.25'))
+# Скільки задач може відстежувати одне з'єднання
+MAX_SUBSCRIPTIONS = int(os.getenv('WS_MAX_SUBSCRIPTIONS', '32'))
+# Розмір черги службових повідомлень на одне з'єднання
+OUTBOX_SIZE = int(os.getenv('WS_OUTBOX_SIZE', '32'))
+# Скільки невідправлених повідомлень, які не можна відкинути, терпимо до закриття з'єднання
+RELIABLE_OUTBOX_SIZE = int(os.getenv('WS_RELIABLE_OUTBOX_SIZE', '1024'))
+# Код закриття WebSocket "Try Again Later" для клієнта, що не встигає читати
+CLOSE_OVERLOADED = 1013
+# Якщо відправка триває довше, клієнт вважається завислим
+SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT', '10'))
+
+
+class Subscriber:
+    """Одне WebSocket з'єднання з обмеженою вихідною чергою"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.jobs: Set[str] = set()
+        # Останнє оновлення для кожної задачі; нові значення перезаписують старі
+        self._latest: Dict[str, dict] = {}
+        self._outbox: Deque[dict] = deque(maxlen=OUTBOX_SIZE)
+        self._reliable: Deque[dict] = deque()
+        self._overflowed = False
+        self._wakeup = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def offer_progress(self, job_id: str, message: dict):
+        self._latest[job_id] = message
+        self._wakeup.set()
+
+    def offer(self, message: dict):
+        """Службове повідомлення; при переповненні найстаріше відкидається"""
+        self._outbox.append(message)
+        self._wakeup.set()
+
+    def offer_reliable(self, message: dict):
+        """Повідомлення, яке не можна відкинути; відправляється після службових у тому ж порядку"""
+        if len(self._reliable) >= RELIABLE_OUTBOX_SIZE:
+            if not self._overflowed:
+                logger.warning("Клієнт не встигає читати повідомлення, з'єднання буде закрито")
+            self._overflowed = True
+        else:
+            self._reliable.append(message)
+        self._wakeup.set()
+
+    async def close(self):
+        self.closed = True
+        if self._sender is not None:
+            self._sender.cancel()
+            try:
+                await self._sender
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def _send_loop(self):
+        last_sent = 0.0
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                # Обмежуємо частоту: оновлення, що прийшли за цей час, зливаються в одне
+                delay = PROGRESS_MIN_INTERVAL - (time.monotonic() - last_sent)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._wakeup.clear()
+                if self._overflowed:
+                    # Явний розрив замість тихо втраченого тексту
+                    self.closed = True
+                    await self.websocket.close(code=CLOSE_OVERLOADED)
+                    return
+
+                messages = list(self._outbox)
+                self._outbox.clear()
+                messages.extend(self._reliable)
+                self._reliable.clear()
+                messages.extend(self._latest.values())
+                self._latest.clear()
+
+                for message in messages:
+                    with stage_timer("broadcast"):
+                        await asyncio.wait_for(self.websocket.send_json(message), SEND_TIMEOUT)
+                last_sent = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Помилка відправки прогресу: {str(e)}")
+            self.closed = True
+            try:
+                await self.websocket.close()
+            except Exception:
+                pass
+
+
+class ProgressHub:
+    """Реєстр з'єднань і підписок на задачі"""
+
+    def __init__(self):
+        self.connections: Set[Subscriber] = set()
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+
+    def connect(self, websocket: WebSocket) -> Subscriber:
+        subscriber = Subscriber(websocket)
+        subscriber.start()
+        self.connections.add(subscriber)
+        return subscriber
+
+    async def disconnect(self, subscriber: Subscriber):
+        for job_id in list(subscriber.jobs):
+            self.unsubscribe(subscriber, job_id)
+        self.connections.discard(subscriber)
+        await subscriber.close()
+
+    def subscribe(self, subscriber: Subscriber, job_id: str) -> bool:
+        if job_id not in subscriber.jobs and len(subscriber.jobs) >= MAX_SUBSCRIPTIONS:
+            return False
+        subscriber.jobs.add(job_id)
+        self._subscribers.setdefault(job_id, set()).add(subscriber)
+        return True
+
+    def unsubscribe(self, subscriber: Subscriber, job_id: str):
+        subscriber.jobs.discard(job_id)
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def publish(self, job_id: str, progress: int, state: Optional[str] = None, **extra):
+        """Неблокуюче оновлення для всіх підписників задачі"""
+        subscribers = self._subscribers.get(job_id)
+        if not subscribers:
+            return
+        message = {"job_id": job_id, "progress": progress}
+        if state is not None:
+            message["state"] = state
+        message.update(extra)
+        for subscriber in subscribers:
+            if not subscriber.closed:
+                subscriber.offer_progress(job_id, message)
+
+    async def close_all(self):
+        for subscriber in list(self.connections):
+            try:
+                await subscriber.websocket.close()
+            except Exception as e:
+                logger.error(f"Помилка закриття з'єднання: {str(e)}")
+            await self.disconnect(subscriber)
+
+
+hub = ProgressHub()
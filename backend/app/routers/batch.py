@@ -0,0 +1,88 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from typing import List
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from ..audio_store import AUDIO_DIR, blob_hash, receive_upload_form, store_upload, touch_blob
+from ..batch import BatchItem, transcribe_batch
+from ..cache import file_sha256
+from ..scheduler import BULK
+from ..transcription import client_id, validate_model_options, validate_priority
+
+# Налаштування логування
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/transcribe", tags=["transcribe"])
+
+# Максимальна кількість файлів в одному запиті
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '100'))
+
+async def resolve_stored(reference: str) -> Path:
+    """sha256 аудіо у сховищі або шлях відносно AUDIO_DIR"""
+    # Час файлу оновлюється, щоб перекодування не підмінило його під час декодування
+    path = await asyncio.to_thread(touch_blob, reference)
+    if path is not None:
+        return path
+    path = (AUDIO_DIR / reference).resolve()
+    if AUDIO_DIR.resolve() not in path.parents or not path.is_file():
+        raise FileNotFoundError(f"Stored audio not found: {reference}")
+    return path
+
+@router.post("/batch")
+async def transcribe_batch_endpoint(request: Request):
+    """Транскрибує багато файлів; результати приходять як NDJSON у міру готовності.
+
+    Форма: files (кілька), stored (JSON-список хешів чи шляхів), model, language, priority.
+    """
+    items: List[BatchItem] = []
+    errors: List[dict] = []
+
+    async with receive_upload_form(request, max_files=BATCH_MAX_FILES) as form:
+        files = form.files.get("files", [])
+        model_name, options = validate_model_options(form.get("model"), form.get("language"))
+        priority = validate_priority(form.get("priority"), BULK)
+        client = client_id(request)
+        stored = form.get("stored")
+        try:
+            references = json.loads(stored) if stored else []
+        except ValueError:
+            raise HTTPException(status_code=400, detail="stored must be a JSON list")
+        if not isinstance(references, list):
+            raise HTTPException(status_code=400, detail="stored must be a JSON list")
+        if not files and not references:
+            raise HTTPException(status_code=400, detail="No files to transcribe")
+        if len(files) + len(references) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} files per batch")
+
+        # Завантаження переносимо у сховище до початку відповіді: решту файлів форми видаляємо
+        for index, upload in enumerate(files):
+            try:
+                if not upload.declared_type or not upload.declared_type.startswith('audio/'):
+                    raise ValueError("File must be audio")
+                await store_upload(upload)
+                items.append(BatchItem(index, upload.file_name, upload.path, upload.sha256))
+            except Exception as e:
+                errors.append({"index": index, "fileName": upload.file_name, "status": "error", "detail": getattr(e, "detail", str(e))})
+
+    for offset, reference in enumerate(references, start=len(files)):
+        try:
+            path = await resolve_stored(str(reference))
+            audio_hash = blob_hash(str(path)) or await asyncio.to_thread(file_sha256, str(path))
+            items.append(BatchItem(offset, path.name, path, audio_hash))
+        except Exception as e:
+            errors.append({"index": offset, "fileName": str(reference), "status": "error", "detail": str(e)})
+
+    logger.info(f"Batch: {len(items)} files to transcribe, {len(errors)} rejected")
+
+    async def stream():
+        for error in errors:
+            yield json.dumps(error, ensure_ascii=False) + "\n"
+        if items:
+            async for result in transcribe_batch(items, model_name, options, priority, client):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,136 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from typing import Optional
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import quote
+from .history import (
+    AUDIO_COLUMNS, FIELD_COLUMNS, columns_for, parse_expand, parse_fields, resolve_audio, serialize
+)
+from ..db import get_transcription_by_id, iter_transcriptions
+from ..export import TAR_END, tar_bytes_member, tar_file_member, to_srt, to_vtt
+from ..segments import apply_diff, unpack_segments
+
+# Налаштування логування
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+SUBTITLE_FORMATS = {
+    "srt": (to_srt, "application/x-subrip"),
+    "vtt": (to_vtt, "text/vtt"),
+}
+
+def utc_naive(since: Optional[datetime]) -> Optional[datetime]:
+    """created_at зберігається в UTC без часового поясу"""
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+@router.get("/history.ndjson")
+async def export_history(
+    after: Optional[int] = None,
+    since: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None
+):
+    """Уся історія (або записи з id > after / створені після since) як NDJSON за зростанням id.
+
+    Записи читаються з БД порціями, тож пам'ять не залежить від розміру історії.
+    Для інкрементального експорту наступний запуск передає after = id останнього рядка.
+    """
+    selected = parse_fields(fields)
+    metrics = parse_expand(expand)
+    columns = columns_for(selected)
+
+    async def stream():
+        async for record in iter_transcriptions(columns, after, utc_naive(since)):
+            yield json.dumps(serialize(record, selected, metrics), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# Колонки для файлу корпусу: усі поля запису і те, що потрібно для пошуку аудіо
+CORPUS_COLUMNS = sorted(set(columns_for(list(FIELD_COLUMNS))) | set(AUDIO_COLUMNS))
+
+def corpus_entry(record, audio_name: Optional[str], metrics: bool) -> dict:
+    return {
+        "id": str(record.id),
+        "fileName": record.filename,
+        "date": record.created_at.isoformat(),
+        "audio": audio_name,
+        "transcribedText": record.text,
+        "editedText": record.edited_text if record.edited_text is not None else record.text,
+        "segments": unpack_segments(record.segments, metrics),
+        "editedSegments": apply_diff(record.segments, record.edited_segments, metrics),
+    }
+
+@router.get("/corpus.tar")
+async def export_corpus(
+    after: Optional[int] = None,
+    since: Optional[datetime] = None,
+    audio: bool = True,
+    expand: Optional[str] = None
+):
+    """Архів корпусу: для кожного запису <id>.json із сегментами і <id>.<ext> з аудіо.
+
+    Архів пишеться на льоту, аудіо читається частинами. Останній файл архіву,
+    export.json, містить lastId для наступного інкрементального експорту.
+    """
+    metrics = parse_expand(expand)
+
+    async def stream():
+        count, last_id = 0, after
+        async for record in iter_transcriptions(CORPUS_COLUMNS, after, utc_naive(since)):
+            mtime = record.created_at.replace(tzinfo=timezone.utc).timestamp()
+            audio_name = None
+            if audio:
+                file_path, _ = await resolve_audio(record)
+                try:
+                    stat = await asyncio.to_thread(os.stat, file_path)
+                except OSError:
+                    logger.warning(f"Audio for work {record.id} not found: {file_path}")
+                else:
+                    audio_name = f"{record.id}{file_path.suffix}"
+                    async for chunk in tar_file_member(audio_name, file_path, stat.st_size, mtime):
+                        yield chunk
+            entry = corpus_entry(record, audio_name, metrics)
+            data = json.dumps(entry, ensure_ascii=False, indent=1).encode("utf-8")
+            yield tar_bytes_member(f"{record.id}.json", data, mtime)
+            count, last_id = count + 1, record.id
+
+        summary = {"count": count, "lastId": last_id, "exportedAt": datetime.utcnow().isoformat()}
+        data = json.dumps(summary).encode("utf-8")
+        yield tar_bytes_member("export.json", data, datetime.now(timezone.utc).timestamp())
+        yield TAR_END
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": 'attachment; filename="corpus.tar"'}
+    )
+
+@router.get("/{work_id}/subtitles")
+async def export_subtitles(
+    work_id: int,
+    format: str = Query("srt", pattern="^(srt|vtt)$"),
+    edited: bool = True
+):
+    """Субтитри запису SRT або WebVTT; за замовчуванням з відредагованих сегментів"""
+    transcription = await get_transcription_by_id(work_id, ["id", "filename", "segments", "edited_segments"])
+    if not transcription:
+        raise HTTPException(status_code=404, detail="Work not found")
+    if edited:
+        segments = apply_diff(transcription.segments, transcription.edited_segments)
+    else:
+        segments = unpack_segments(transcription.segments)
+    render, media_type = SUBTITLE_FORMATS[format]
+    name = os.path.splitext(transcription.filename or "")[0] or str(work_id)
+    return Response(
+        render(segments),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(name)}.{format}"}
+    )
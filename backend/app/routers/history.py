@@ -1,18 +1,30 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
+import asyncio
 import json
+import mimetypes
 import os
-from datetime import datetime
 import logging
-import shutil
-from fastapi.responses import FileResponse
 from pathlib import Path
+from ..jobs import manager
+from ..audio_store import (
+    AUDIO_DIR, blob_content_type, receive_upload_form, relative_audio_path, remove_blob, store_upload,
+    touch_blob
+)
+from ..ranges import file_response
+from ..search import parse_query
+from ..segments import apply_diff, unpack_segments
+from ..transcode import transcoder
+from ..uploads import SNIFF_BYTES, sniff_audio_type
 from ..db import (
-    get_all_transcriptions,
+    list_transcriptions,
+    search_transcriptions,
     get_transcription_by_id,
     create_transcription,
     delete_transcription,
+    get_audio_blob,
+    AudioBlob,
     Transcription
 )
 
@@ -22,14 +34,21 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/history", tags=["history"])
 
-# Створюємо директорію для зберігання аудіофайлів
-BASE_DIR = Path(__file__).resolve().parent.parent.parent
-AUDIO_DIR = BASE_DIR / "audio_files"
-
-logger.info(f"Base directory: {BASE_DIR}")
 logger.info(f"Audio directory: {AUDIO_DIR}")
 
-os.makedirs(AUDIO_DIR, exist_ok=True)
+def audio_file_path(transcription: Transcription, blob: Optional[AudioBlob] = None) -> Path:
+    if blob is not None:
+        return AUDIO_DIR / blob.path
+    if transcription.audio_path:
+        return AUDIO_DIR / transcription.audio_path
+    # Файли, збережені до появи спільного сховища
+    return AUDIO_DIR / f"{transcription.work_id or transcription.id}_{transcription.filename}"
+
+async def resolve_audio(transcription: Transcription) -> Tuple[Path, Optional[AudioBlob]]:
+    """Файл аудіо запису; для спільного сховища - за рядком audio_blobs, бо перекодування
+    замінює файл уже після збереження запису"""
+    blob = await get_audio_blob(transcription.audio_hash) if transcription.audio_hash else None
+    return audio_file_path(transcription, blob), blob
 
 class SavedWork(BaseModel):
     id: str
@@ -40,102 +59,208 @@ class SavedWork(BaseModel):
     segments: List[dict]
     editedSegments: List[dict]
 
+# Поля відповіді та колонки, які для них потрібно прочитати з БД
+FIELD_COLUMNS = {
+    "id": ("id",),
+    "fileName": ("filename",),
+    "date": ("created_at",),
+    "transcribedText": ("text",),
+    "editedText": ("edited_text", "text"),
+    "segments": ("segments",),
+    "editedSegments": ("edited_segments", "segments"),
+}
+DEFAULT_LIST_FIELDS = ("id", "fileName", "date")
+# Що можна додати до сегментів через expand
+EXPAND_OPTIONS = ("metrics",)
+MAX_PAGE_SIZE = 500
+MAX_SEARCH_RESULTS = 100
+
+def parse_fields(fields: Optional[str], default=tuple(FIELD_COLUMNS)) -> List[str]:
+    if not fields:
+        return list(default)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in FIELD_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # id потрібен завжди, щоб клієнт міг запитати запис окремо
+    return ["id"] + [name for name in names if name != "id"]
+
+def parse_expand(expand: Optional[str]) -> bool:
+    """expand=metrics додає до сегментів метрики декодування Whisper"""
+    names = [name.strip() for name in (expand or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in EXPAND_OPTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown expand options: {', '.join(unknown)}")
+    return "metrics" in names
+
+def columns_for(fields: List[str]) -> List[str]:
+    columns = {"id"}
+    for name in fields:
+        columns.update(FIELD_COLUMNS[name])
+    return sorted(columns)
+
+def serialize(t: Transcription, fields: List[str], metrics: bool = False) -> dict:
+    item = {}
+    for name in fields:
+        if name == "id":
+            item["id"] = str(t.id)
+        elif name == "fileName":
+            item["fileName"] = t.filename
+        elif name == "date":
+            item["date"] = t.created_at.isoformat()
+        elif name == "transcribedText":
+            item["transcribedText"] = t.text
+        elif name == "editedText":
+            item["editedText"] = t.edited_text if t.edited_text is not None else t.text
+        elif name == "segments":
+            item["segments"] = unpack_segments(t.segments, metrics)
+        elif name == "editedSegments":
+            item["editedSegments"] = apply_diff(t.segments, t.edited_segments, metrics)
+    return item
+
 @router.get("/")
-async def get_history():
+async def get_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None
+):
+    """Сторінка історії від новіших записів; курсор наступної сторінки - у заголовку X-Next-Cursor"""
+    selected = parse_fields(fields, DEFAULT_LIST_FIELDS)
+    metrics = parse_expand(expand)
     try:
-        transcriptions = await get_all_transcriptions()
-        return [
-            {
-                "id": str(t.id),
-                "fileName": t.filename,
-                "date": t.created_at.isoformat(),
-                "transcribedText": t.text,
-                "editedText": t.text,  # Використовуємо той самий текст
-                "segments": t.segments,
-                "editedSegments": t.segments  # Використовуємо ті самі сегменти
-            }
-            for t in transcriptions
-        ]
+        transcriptions = await list_transcriptions(limit, after, columns_for(selected))
     except Exception as e:
         logger.error(f"Error in get_history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    if len(transcriptions) == limit:
+        response.headers["X-Next-Cursor"] = str(transcriptions[-1].id)
+    return [serialize(t, selected, metrics) for t in transcriptions]
 
-@router.post("/")
-async def save_to_history(
-    file: UploadFile = File(...),
-    work: str = Form(...)
+@router.get("/search")
+async def search_history(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+    after: Optional[int] = None
 ):
+    """Записи, що містять усі слова запиту, з часом сегментів, де ці слова трапляються.
+
+    Оголошено до /{work_id}, інакше "search" сприймався б як id запису.
+    """
+    terms = parse_query(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Query has no searchable words")
     try:
-        work_data = json.loads(work)
-        logger.info(f"Saving work with ID: {work_data['id']}")
-        logger.info(f"Received file: {file.filename}, content type: {file.content_type}")
-        
-        # Зберігаємо аудіофайл
-        file_path = AUDIO_DIR / f"{work_data['id']}_{work_data['fileName']}"
-        logger.info(f"Saving audio file to: {file_path}")
-        
-        # Перевіряємо, чи існує директорія
-        if not AUDIO_DIR.exists():
-            logger.info(f"Creating audio directory: {AUDIO_DIR}")
-            os.makedirs(AUDIO_DIR, exist_ok=True)
-        
-        # Зберігаємо файл
-        try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            logger.info(f"File saved successfully to {file_path}")
-        except Exception as e:
-            logger.error(f"Error saving file: {str(e)}")
-            raise
-        
-        # Перевіряємо, чи файл дійсно збережений
-        if not file_path.exists():
-            raise Exception(f"Failed to save audio file to {file_path}")
-        
-        file_size = file_path.stat().st_size
-        logger.info(f"Audio file saved successfully, size: {file_size} bytes")
-        
-        if file_size == 0:
-            raise Exception("Saved file is empty")
-        
+        results = await search_transcriptions(terms, limit, after)
+    except Exception as e:
+        logger.error(f"Error in search_history: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if len(results) == limit:
+        response.headers["X-Next-Cursor"] = results[-1]["id"]
+    return results
+
+@router.get("/{work_id}/segments")
+async def get_segments(work_id: int, expand: Optional[str] = None):
+    metrics = parse_expand(expand)
+    transcription = await get_transcription_by_id(work_id, columns_for(["segments", "editedSegments"]))
+    if not transcription:
+        raise HTTPException(status_code=404, detail="Work not found")
+    return serialize(transcription, ["id", "segments", "editedSegments"], metrics)
+
+@router.post("/")
+async def save_to_history(request: Request):
+    """Форма: work (JSON запису) і необов'язковий file, якщо аудіо не завантажене раніше"""
+    try:
+        async with receive_upload_form(request) as form:
+            work = form.get("work")
+            if work is None:
+                raise HTTPException(status_code=422, detail="Missing form field: work")
+            work_data = json.loads(work)
+            logger.info(f"Saving work with ID: {work_data['id']}")
+            upload = form.file("file")
+            if upload is not None:
+                # Файл уже записаний на диск під час читання запиту - переносимо у спільне сховище
+                logger.info(f"Received file: {upload.file_name}, content type: {upload.declared_type}")
+                await store_upload(upload)
+
+        if upload is not None:
+            audio_hash, blob_path = upload.sha256, upload.path
+            # Однакове аудіо могло вже бути перекодоване - тип беремо з файлу у сховищі
+            content_type = blob_content_type(blob_path, upload.content_type)
+        else:
+            # Аудіо вже завантажене через /transcribe, посилаємося на нього за хешем
+            audio_hash = work_data.get("audioHash")
+            # Оновлюємо час, щоб видалення іншого запису з цим аудіо не прибрало файл
+            blob_path = await asyncio.to_thread(touch_blob, audio_hash)
+            if blob_path is None:
+                raise HTTPException(status_code=400, detail="Audio file or known audioHash is required")
+            content_type = blob_content_type(blob_path, None)
+
+        logger.info(f"Audio stored at {blob_path}, size: {blob_path.stat().st_size} bytes")
+        work_data["audioHash"] = audio_hash
+        work_data["audioPath"] = relative_audio_path(blob_path)
+        work_data["contentType"] = content_type
+
         # Зберігаємо в "БД"
         transcription = await create_transcription(work_data)
-        
+        transcoder.schedule(audio_hash)
+
         return {"message": "Work saved successfully", "id": transcription.id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in save_to_history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/{work_id}/audio")
-async def get_audio(work_id: str):
+@router.get("/{work_id}")
+async def get_work(work_id: int, fields: Optional[str] = None, expand: Optional[str] = None):
+    selected = parse_fields(fields)
+    metrics = parse_expand(expand)
+    transcription = await get_transcription_by_id(work_id, columns_for(selected))
+    if not transcription:
+        raise HTTPException(status_code=404, detail="Work not found")
+    return serialize(transcription, selected, metrics)
+
+# Колонки, потрібні лише для пошуку аудіофайлу запису
+AUDIO_COLUMNS = ["id", "work_id", "filename", "audio_hash", "audio_path", "content_type"]
+
+def audio_content_type(transcription: Transcription, file_path: Path, blob: Optional[AudioBlob] = None) -> str:
+    """MIME тип збереженого аудіо; для старих записів визначається за сигнатурою файлу"""
+    content_type = blob.content_type if blob is not None else transcription.content_type
+    if content_type and content_type != "application/octet-stream":
+        return content_type
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    _, content_type = sniff_audio_type(head, transcription.filename)
+    if content_type == "application/octet-stream":
+        content_type = mimetypes.guess_type(transcription.filename or "")[0] or content_type
+    return content_type
+
+@router.api_route("/{work_id}/audio", methods=["GET", "HEAD"])
+async def get_audio(work_id: int, request: Request):
+    """Аудіо запису з підтримкою Range (206) і умовних запитів (304)"""
+    transcription = await get_transcription_by_id(work_id, AUDIO_COLUMNS)
+    if not transcription:
+        raise HTTPException(status_code=404, detail="Work not found")
+
+    file_path, blob = await resolve_audio(transcription)
+    if not file_path.is_file():
+        logger.error(f"Audio file not found: {file_path}")
+        raise HTTPException(status_code=404, detail="Audio file not found")
+
     try:
-        logger.info(f"Getting audio for work ID: {work_id}")
-        transcription = await get_transcription_by_id(int(work_id))
-        
-        if not transcription:
-            logger.error(f"Work not found: {work_id}")
-            raise HTTPException(status_code=404, detail="Work not found")
-        
-        file_path = AUDIO_DIR / f"{work_id}_{transcription.filename}"
-        logger.info(f"Looking for audio file at: {file_path}")
-        
-        if not file_path.exists():
-            logger.error(f"Audio file not found: {file_path}")
-            # Перевіряємо вміст директорії
-            logger.info(f"Contents of {AUDIO_DIR}: {list(AUDIO_DIR.glob('*'))}")
-            raise HTTPException(status_code=404, detail="Audio file not found")
-        
-        file_size = file_path.stat().st_size
-        logger.info(f"Audio file size: {file_size} bytes")
-        
-        if file_size == 0:
-            logger.error(f"Audio file is empty: {file_path}")
-            raise HTTPException(status_code=500, detail="Audio file is empty")
-        
-        return FileResponse(
+        content_type = await asyncio.to_thread(audio_content_type, transcription, file_path, blob)
+        # Файл у сховищі адресується вмістом, тож ім'я (sha256 і розширення) - готовий
+        # сильний ETag, який змінюється і після перекодування
+        etag = file_path.name if blob is not None or transcription.audio_path else None
+        return await file_response(
+            request,
             file_path,
-            media_type="audio/mpeg",
-            filename=transcription.filename
+            content_type,
+            filename=transcription.filename,
+            etag=etag,
         )
     except Exception as e:
         logger.error(f"Error in get_audio: {str(e)}")
@@ -151,18 +276,27 @@ async def delete_from_history(work_id: str):
             logger.error(f"Work not found: {work_id}")
             raise HTTPException(status_code=404, detail="Work not found")
         
-        # Видаляємо аудіофайл
-        file_path = AUDIO_DIR / f"{work_id}_{transcription.filename}"
-        if file_path.exists():
+        # Видаляємо аудіофайл старого формату
+        file_path = audio_file_path(transcription)
+        if not transcription.audio_path and file_path.exists():
             logger.info(f"Deleting audio file: {file_path}")
             os.remove(file_path)
         
         # Видаляємо з "БД"
-        success = await delete_transcription(int(work_id))
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to delete from database")
+        deleted, unreferenced = await delete_transcription(int(work_id))
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Work not found")
+
+        # Файл сховища, на який більше не посилаються записи, видаляємо одразу,
+        # якщо його не чекає задача; інакше його прибере фонове очищення
+        if unreferenced and not await asyncio.to_thread(
+            manager.store.uses_audio, str(AUDIO_DIR / unreferenced)
+        ):
+            remove_blob(unreferenced)
         
         return {"message": "Work deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in delete_from_history: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,69 @@
+from fastapi import APIRouter, HTTPException, Request
+import json
+import logging
+from ..inference import QueueFullError
+from ..audio_store import blob_hash, receive_upload_form, store_upload
+from ..jobs import manager, job_to_dict, DONE, FAILED
+from ..transcription import (
+    TranscriptionResponse, client_id, validate_audio_upload, validate_model_options, validate_priority
+)
+
+# Налаштування логування
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+@router.post("", status_code=202)
+async def create_job(request: Request):
+    """Форма: file, а також необов'язкові model, language, priority"""
+    async with receive_upload_form(request) as form:
+        upload = form.require_file("file")
+        logger.info(f"New job for file: {upload.file_name}, content type: {upload.declared_type}")
+        validate_audio_upload(upload)
+        model_name, options = validate_model_options(form.get("model"), form.get("language"))
+        priority = validate_priority(form.get("priority"))
+        await store_upload(upload)
+
+    try:
+        job_id = await manager.submit(
+            str(upload.path), upload.file_name, content_type=upload.content_type,
+            model_name=model_name, options=options, priority=priority, client=client_id(request)
+        )
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many pending jobs",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    return {"id": job_id, "state": "queued", "audioHash": upload.sha256}
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    job = await manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
+
+@router.get("/{job_id}/result", response_model=TranscriptionResponse)
+async def get_job_result(job_id: str):
+    job = await manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["state"] == FAILED:
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["state"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['state']}")
+    result = json.loads(job["result"])
+    result["audioHash"] = blob_hash(job["audio_path"])
+    return result
+
+@router.delete("/{job_id}")
+async def cancel_job(job_id: str):
+    """Скасувати задачу в черзі або під час транскрибування"""
+    if not await manager.cancel(job_id):
+        job = await manager.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job is {job['state']}")
+    return job_to_dict(await manager.get(job_id))
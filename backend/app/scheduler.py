@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Планувальник перед пулом інференсу: класи пріоритету, коротші записи першими і квоти клієнтів.
+
+Запит отримує слот, лише коли є вільна репліка, тож черга пулу не
+накопичує роботу в порядку надходження. З тих, хто чекає, першим іде запит
+з коротшим аудіо; запит класу bulk рахується як на SCHEDULER_BULK_PENALTY
+секунд довший, тож interactive зазвичай іде раніше. Водночас
+кожна секунда очікування зменшує "довжину" запиту на SCHEDULER_AGING секунд,
+тож ні довгі записи, ні пакетні задачі не чекають вічно під потоком
+коротких інтерактивних. Поки чекають запити інших клієнтів, один клієнт не
+тримає більше SCHEDULER_CLIENT_QUOTA слотів одночасно; вільні слоти, на які
+ніхто інший не претендує, він займає й понад квоту.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import SCHEDULER_CANCELLED, SCHEDULER_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITY_CLASSES = (INTERACTIVE, BULK)
+
+# Скільки слотів інференсу одночасно може тримати один клієнт, поки чекають інші; 0 - без обмеження
+SCHEDULER_CLIENT_QUOTA = int(os.getenv('SCHEDULER_CLIENT_QUOTA', '2'))
+# На скільки секунд аудіо "коротшає" запит за кожну секунду очікування
+SCHEDULER_AGING = float(os.getenv('SCHEDULER_AGING', '1.0'))
+# Наскільки bulk поступається interactive, у секундах аудіо: пакетна задача обганяє
+# нові інтерактивні, коли прочекала стільки секунд, поділених на SCHEDULER_AGING
+SCHEDULER_BULK_PENALTY = float(os.getenv('SCHEDULER_BULK_PENALTY', '300'))
+
+
+@dataclass
+class Ticket:
+    """Що планувальник знає про запит: клас, тривалість аудіо і клієнт"""
+    priority: str = INTERACTIVE
+    duration: float = 0.0
+    client: Optional[str] = None
+
+
+# (тривалість з поправкою на клас і очікування, номер, квиток, future слоту, час постановки)
+_Entry = Tuple[float, int, Ticket, asyncio.Future, float]
+
+
+class Scheduler:
+    """Видає слоти інференсу; кількість слотів дорівнює кількості реплік пулу"""
+
+    def __init__(
+        self,
+        slots: int = 1,
+        client_quota: int = SCHEDULER_CLIENT_QUOTA,
+        aging: float = SCHEDULER_AGING,
+        bulk_penalty: float = SCHEDULER_BULK_PENALTY,
+    ):
+        self.slots = max(1, slots)
+        self.client_quota = client_quota
+        self.aging = aging
+        self.penalties = {INTERACTIVE: 0.0, BULK: bulk_penalty}
+        self._waiting: List[_Entry] = []
+        self._running = 0
+        self._per_client: Dict[str, int] = {}
+        self._seq = itertools.count()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def waiting_by_priority(self) -> Dict[str, int]:
+        counts = dict.fromkeys(PRIORITY_CLASSES, 0)
+        for entry in self._waiting:
+            if not entry[3].done():
+                counts[entry[2].priority] += 1
+        return counts
+
+    def _allowed(self, client: Optional[str]) -> bool:
+        if not self.client_quota or client is None:
+            return True
+        return self._per_client.get(client, 0) < self.client_quota
+
+    def _take(self, ticket: Ticket):
+        self._running += 1
+        if ticket.client is not None:
+            self._per_client[ticket.client] = self._per_client.get(ticket.client, 0) + 1
+
+    def _grant(self, entry: _Entry):
+        ticket = entry[2]
+        self._take(ticket)
+        SCHEDULER_WAIT_SECONDS.observe(time.monotonic() - entry[4], ticket.priority)
+        entry[3].set_result(None)
+
+    def _dispatch(self):
+        """Роздає вільні слоти найкращим запитам, яким дозволяє квота"""
+        skipped: List[_Entry] = []
+        while self._running < self.slots and self._waiting:
+            entry = heapq.heappop(self._waiting)
+            # Запит скасовано, поки він чекав
+            if entry[3].done():
+                continue
+            if not self._allowed(entry[2].client):
+                skipped.append(entry)
+                continue
+            self._grant(entry)
+        # Усі, хто ще чекає, вичерпали квоту - слоти не простоюють, роздаємо їх за чергою
+        while self._running < self.slots and skipped:
+            self._grant(skipped.pop(0))
+        for entry in skipped:
+            heapq.heappush(self._waiting, entry)
+
+    async def acquire(self, ticket: Ticket):
+        if ticket.priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Невідомий клас пріоритету: {ticket.priority}")
+        now = time.monotonic()
+        # duration - aging * (зараз - now) впорядковує так само, як duration + aging * now
+        key = ticket.duration + self.penalties[ticket.priority] + self.aging * now
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (key, next(self._seq), ticket, future, now))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот видали в ту ж мить, коли запит скасували
+                self.release(ticket)
+            else:
+                SCHEDULER_CANCELLED.inc("queued")
+            raise
+
+    def release(self, ticket: Ticket):
+        self._running -= 1
+        if ticket.client is not None:
+            remaining = self._per_client.get(ticket.client, 1) - 1
+            if remaining > 0:
+                self._per_client[ticket.client] = remaining
+            else:
+                self._per_client.pop(ticket.client, None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, ticket: Ticket):
+        await self.acquire(ticket)
+        try:
+            yield
+        finally:
+            self.release(ticket)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Нормалізація тексту та побудова записів інвертованого індексу історії.
+
+Кожен запис історії дає постинги (термін, запис, сегмент, час): один набір
+для повного тексту (сегмент None) і по одному для тексту кожного сегмента,
+тож пошук повертає не лише запис, а й місце в аудіо. Індексуються і
+розпізнаний, і відредагований текст: запис знаходиться за словом з будь-якого.
+"""
+import re
+import unicodedata
+from typing import Iterable, List, Optional, Tuple
+
+# Варіанти апострофа в українських текстах: п'ять, п’ять, пʼять, п`ять
+APOSTROPHES = "'\u2019\u02bc\u2018`\u00b4\u2032"
+_APOSTROPHE_TABLE = str.maketrans("", "", APOSTROPHES)
+# Знак наголосу, який іноді ставлять у текстах
+_STRESS_MARK = "\u0301"
+
+_WORD = re.compile(r"[^\W_]+")
+_QUERY_WORD = re.compile(r"[^\W_]+\*?")
+
+# Довжина терміну в індексі
+MAX_TERM_LENGTH = 64
+# Скільки слів запиту враховується
+MAX_QUERY_TERMS = 10
+
+
+def normalize(text: str) -> str:
+    """Регістр, апострофи і наголоси зводяться до однієї форми.
+
+    NFC, а не NFD: розклад зламав би й та ї на літеру й діакритику.
+    """
+    text = unicodedata.normalize("NFC", text).replace(_STRESS_MARK, "")
+    return text.translate(_APOSTROPHE_TABLE).casefold()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [word[:MAX_TERM_LENGTH] for word in _WORD.findall(normalize(text))]
+
+
+def parse_query(query: str) -> List[Tuple[str, bool]]:
+    """Слова запиту як (термін, пошук за префіксом); "слово*" шукає за початком"""
+    terms = []
+    for word in _QUERY_WORD.findall(normalize(query)):
+        prefix = word.endswith("*")
+        term = word.rstrip("*")[:MAX_TERM_LENGTH]
+        if term and (term, prefix) not in terms:
+            terms.append((term, prefix))
+    return terms[:MAX_QUERY_TERMS]
+
+
+def postings(
+    transcription_id: int,
+    texts: Iterable[Optional[str]],
+    segment_versions: Iterable[Optional[Iterable[dict]]],
+) -> List[dict]:
+    """Рядки індексу для одного запису; кожен термін один раз на текст чи сегмент.
+
+    texts - версії повного тексту, segment_versions - відповідні версії сегментів;
+    сегменти з однаковим номером у різних версіях зливаються в один.
+    """
+    rows = [
+        {"term": term, "transcription_id": transcription_id, "segment": None, "start": None, "end": None}
+        for term in dict.fromkeys(term for text in texts for term in tokenize(text))
+    ]
+    seen = set()
+    for segments in segment_versions:
+        for index, segment in enumerate(segments or []):
+            for term in tokenize(segment.get("text")):
+                if (index, term) in seen:
+                    continue
+                seen.add((index, term))
+                rows.append({
+                    "term": term,
+                    "transcription_id": transcription_id,
+                    "segment": index,
+                    "start": segment.get("start"),
+                    "end": segment.get("end"),
+                })
+    return rows
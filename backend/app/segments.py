@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Компактне зберігання сегментів транскрипції.
+
+Сегменти зберігаються колонками: start, end і числові метрики - окремими
+масивами, текст - окремим масивом. tokens, seek та id (він збігається з
+індексом) не зберігаються. Поля, що є не в усіх сегментах або не числові
+(words, htmlContent фронтенду), лежать у розрідженому словнику extra.
+
+Відредаговані сегменти зберігаються як різниця з оригіналом: кількість
+сегментів і лише змінені поля змінених сегментів.
+"""
+from typing import Any, Dict, List, Optional
+
+FORMAT_VERSION = 1
+
+# Поля, які не зберігаються: tokens відтворити неможливо, але вони й не використовуються
+DROPPED_FIELDS = {"tokens", "seek", "id"}
+# Метрики декодування Whisper, які API віддає лише з expand=metrics
+METRIC_FIELDS = ("temperature", "avg_logprob", "compression_ratio", "no_speech_prob")
+# Знаків після коми: час - до мілісекунди, метрики - до 4 знаків
+TIME_DIGITS = 3
+METRIC_DIGITS = 4
+
+
+def _round(field: str, value: Any) -> Any:
+    if isinstance(value, float):
+        return round(value, TIME_DIGITS if field in ("start", "end") else METRIC_DIGITS)
+    return value
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _clean(segment: dict) -> dict:
+    return {key: _round(key, value) for key, value in segment.items() if key not in DROPPED_FIELDS}
+
+
+def is_packed(value: Any) -> bool:
+    return isinstance(value, dict) and "v" in value
+
+
+def pack_segments(segments: Optional[List[dict]]) -> dict:
+    """Список сегментів у колонковий формат"""
+    cleaned = [_clean(segment) for segment in segments or []]
+    count = len(cleaned)
+    keys = list(dict.fromkeys(key for segment in cleaned for key in segment))
+    packed: Dict[str, Any] = {"v": FORMAT_VERSION, "n": count, "text": [s.get("text", "") for s in cleaned]}
+    columns: Dict[str, list] = {}
+    extra: Dict[str, dict] = {}
+    for key in keys:
+        if key == "text":
+            continue
+        values = [segment.get(key) for segment in cleaned]
+        if all(key in segment and _is_number(segment[key]) for segment in cleaned):
+            columns[key] = values
+            continue
+        for index, segment in enumerate(cleaned):
+            if key in segment:
+                extra.setdefault(str(index), {})[key] = segment[key]
+    packed["columns"] = columns
+    if extra:
+        packed["extra"] = extra
+    return packed
+
+
+def unpack_segments(packed: Any, metrics: bool = False) -> List[dict]:
+    """Сегменти у форматі API; метрики Whisper - лише якщо metrics.
+
+    Приймає і старий формат (список сегментів), що лишився в записах до міграції.
+    """
+    if not is_packed(packed):
+        packed = pack_segments(packed)
+    columns = packed.get("columns", {})
+    extra = packed.get("extra", {})
+    segments = []
+    for index in range(packed["n"]):
+        segment = {"id": index}
+        for key, values in columns.items():
+            if metrics or key not in METRIC_FIELDS:
+                segment[key] = values[index]
+        segment["text"] = packed["text"][index]
+        segment.update(extra.get(str(index), {}))
+        segments.append(segment)
+    return segments
+
+
+def diff_segments(original: Any, edited: Optional[List[dict]]) -> Optional[dict]:
+    """Різниця відредагованих сегментів з оригіналом; None - сегменти не змінювалися"""
+    if edited is None:
+        return None
+    base = unpack_segments(original, metrics=True)
+    changed: Dict[str, dict] = {}
+    removed: Dict[str, list] = {}
+    for index, segment in enumerate(edited):
+        segment = {"id": index, **_clean(segment)}
+        before = base[index] if index < len(base) else {}
+        fields = {key: value for key, value in segment.items() if key not in before or before[key] != value}
+        if fields:
+            changed[str(index)] = fields
+        # Метрики відповідь API без expand не містить, тож їх відсутність - не видалення
+        missing = [key for key in before if key not in segment and key not in METRIC_FIELDS]
+        if missing:
+            removed[str(index)] = missing
+    if not changed and not removed and len(edited) == len(base):
+        return None
+    diff: Dict[str, Any] = {"v": FORMAT_VERSION, "n": len(edited)}
+    if changed:
+        diff["set"] = changed
+    if removed:
+        diff["unset"] = removed
+    return diff
+
+
+def apply_diff(original: Any, diff: Any, metrics: bool = False) -> List[dict]:
+    """Відредаговані сегменти з оригіналу і різниці; старий формат повертається як є"""
+    if diff is None:
+        return unpack_segments(original, metrics)
+    if not is_packed(diff):
+        return unpack_segments(diff, metrics)
+    base = unpack_segments(original, metrics=True)
+    changed = diff.get("set", {})
+    removed = diff.get("unset", {})
+    segments = []
+    for index in range(diff["n"]):
+        segment = dict(base[index]) if index < len(base) else {"id": index}
+        segment.update(changed.get(str(index), {}))
+        for key in removed.get(str(index), []):
+            segment.pop(key, None)
+        if not metrics:
+            for key in METRIC_FIELDS:
+                segment.pop(key, None)
+        segments.append(segment)
+    return segments
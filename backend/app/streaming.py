@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""Живе транскрибування аудіопотоку з мікрофона через /ws.
+
+Клієнт надсилає кадри PCM або Opus бінарними повідомленнями. Сесія тримає
+ковзний буфер лише з ще не підтвердженим аудіо: після кожного декодування
+сегменти, що закінчилися достатньо давно, стають остаточними і вирізаються
+з буфера, тож наступного разу декодується тільки нестабільний хвіст.
+Розмір буфера обмежений, тому пам'ять сесії не росте з тривалістю запису;
+якщо декодування не встигає і найстаріше аудіо відкидається, клієнт отримує
+повідомлення dropped з проміжком, якого не буде в тексті. Декодування, що
+виконується, переривається після stop_stream чи відключення клієнта.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from typing import List, Optional
+
+import numpy as np
+
+from .audio import SAMPLE_RATE, FfmpegStreamDecoder, pcm16_to_float, resample
+from .inference import raise_if_cancelled, wait_pool
+from .progress import Subscriber
+from .scheduler import INTERACTIVE, Ticket
+from .transcription import DECODE_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+# Скільки нового аудіо (с) накопичити перед наступним декодуванням
+STREAM_STEP_SECONDS = float(os.getenv('STREAM_STEP_SECONDS', '1.0'))
+# Сегменти, що закінчуються ближче до кінця буфера, ще можуть змінитися
+STREAM_UNSTABLE_SECONDS = float(os.getenv('STREAM_UNSTABLE_SECONDS', '2.0'))
+# Після цієї довжини буфера підтверджуються всі сегменти, крім останнього
+STREAM_MAX_BUFFER_SECONDS = float(os.getenv('STREAM_MAX_BUFFER_SECONDS', '20'))
+# Одночасних потокових сесій на сервер
+STREAM_MAX_SESSIONS = int(os.getenv('STREAM_MAX_SESSIONS', '8'))
+# Скільки символів підтвердженого тексту передається моделі як контекст
+STREAM_PROMPT_CHARS = 200
+
+# Формат кадрів -> демультиплексор ffmpeg (None - сирий PCM без ffmpeg)
+STREAM_FORMATS = {
+    "pcm16": None,
+    "opus": "ogg",
+    "webm": "matroska",
+}
+
+active_sessions = set()
+
+
+def _cancel_check(module, args):
+    raise_if_cancelled()
+
+
+def _install_cancel_check(model):
+    """Перевірка скасування перед кожним кроком декодера Whisper.
+
+    Буфер потоку не довший за одне вікно, тож прогрес по вікнах настає лише в кінці
+    декодування; кожна репліка має власний об'єкт моделі, тож гонки тут немає.
+    """
+    decoder = getattr(model, "decoder", None)
+    if decoder is not None and not getattr(decoder, "_cancel_check_installed", False):
+        decoder.register_forward_pre_hook(_cancel_check)
+        decoder._cancel_check_installed = True
+
+
+def run_stream_decode(model, audio: np.ndarray, prompt: str, options: dict) -> dict:
+    """Виконується в потоці репліки; prompt - кінець уже підтвердженого тексту"""
+    raise_if_cancelled()
+    if getattr(model, "native_progress", False):
+        options = {**options, "on_progress": lambda fraction: raise_if_cancelled()}
+    else:
+        _install_cancel_check(model)
+    return model.transcribe(
+        audio,
+        verbose=None,
+        initial_prompt=prompt or None,
+        condition_on_previous_text=False,
+        **options,
+    )
+
+
+class StreamSession:
+    """Одна потокова сесія в межах WebSocket з'єднання"""
+
+    def __init__(
+        self,
+        subscriber: Subscriber,
+        audio_format: str = "pcm16",
+        sample_rate: int = SAMPLE_RATE,
+        model_name: Optional[str] = None,
+        options: Optional[dict] = None,
+        client: Optional[str] = None,
+    ):
+        if audio_format not in STREAM_FORMATS:
+            raise ValueError(f"Непідтримуваний формат потоку: {audio_format}")
+        if not 8000 <= sample_rate <= 48000:
+            raise ValueError(f"Непідтримувана частота дискретизації: {sample_rate}")
+        if len(active_sessions) >= STREAM_MAX_SESSIONS:
+            raise ValueError("Забагато потокових сесій")
+
+        self.id = uuid.uuid4().hex
+        self.subscriber = subscriber
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self.model_name = model_name
+        self.options = DECODE_OPTIONS if options is None else options
+        self.client = client
+        # Непідтверджене аудіо: консолідований буфер і щойно отримані кадри
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._chunks: List[np.ndarray] = []
+        # Абсолютна позиція початку буфера у відліках від початку потоку
+        self._offset = 0
+        self._new_samples = 0
+        self._remainder = b""
+        self._prompt = ""
+        self._segment_id = 0
+        self._max_samples = int(2 * STREAM_MAX_BUFFER_SECONDS * SAMPLE_RATE)
+        # Останній суцільний проміжок відкинутого аудіо і загальна його кількість, у відліках
+        self._gap_start = 0
+        self._gap_end = 0
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        # Декодування в пулі, яке можна перервати, не зупиняючи сесію
+        self._inflight: Optional[asyncio.Future] = None
+        self._decoder: Optional[FfmpegStreamDecoder] = None
+
+    async def start(self):
+        input_format = STREAM_FORMATS[self.audio_format]
+        if input_format is not None:
+            self._decoder = FfmpegStreamDecoder(input_format, self._append)
+            await self._decoder.start()
+        active_sessions.add(self)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Потокова сесія {self.id}: формат {self.audio_format}, {self.sample_rate} Гц")
+
+    async def feed(self, data: bytes):
+        """Бінарний кадр від клієнта"""
+        if self._stopping:
+            return
+        if self._decoder is not None:
+            await self._decoder.write(data)
+            return
+        data = self._remainder + data
+        usable = len(data) - len(data) % 2
+        self._remainder = data[usable:]
+        if usable:
+            self._append(resample(pcm16_to_float(data[:usable]), self.sample_rate))
+
+    @property
+    def finished(self) -> bool:
+        return self._task is not None and self._task.done()
+
+    def stop(self):
+        """Кінець запису: декодувати залишок і завершити сесію"""
+        if self._stopping:
+            return
+        self._stopping = True
+        # Проміжний результат уже не потрібен - остаточне декодування починається одразу
+        if self._inflight is not None:
+            self._inflight.cancel()
+        self._wakeup.set()
+
+    async def close(self):
+        active_sessions.discard(self)
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._decoder is not None:
+            self._decoder.kill()
+
+    def _buffered(self) -> int:
+        return len(self._buffer) + sum(len(chunk) for chunk in self._chunks)
+
+    def _consolidate(self) -> np.ndarray:
+        if self._chunks:
+            self._buffer = np.concatenate([self._buffer, *self._chunks])
+            self._chunks.clear()
+        return self._buffer
+
+    def _trim(self, samples: int):
+        """Відкинути підтверджений початок буфера"""
+        if samples <= 0:
+            return
+        # Копія, щоб звільнити пам'ять відкинутої частини
+        self._buffer = self._consolidate()[samples:].copy()
+        self._offset += samples
+
+    def _append(self, samples: np.ndarray):
+        self._chunks.append(samples)
+        self._new_samples += len(samples)
+        overflow = self._buffered() - self._max_samples
+        if overflow > 0:
+            # Декодування не встигає за потоком - жертвуємо найстарішим аудіо
+            logger.warning(f"Потокова сесія {self.id}: відкинуто {overflow / SAMPLE_RATE:.2f} с аудіо")
+            self._report_dropped(overflow)
+            self._trim(overflow)
+        if self._new_samples >= STREAM_STEP_SECONDS * SAMPLE_RATE:
+            self._wakeup.set()
+
+    def _report_dropped(self, samples: int):
+        """Клієнт має знати, що в цьому проміжку тексту не буде"""
+        if self._offset != self._gap_end:
+            self._gap_start = self._offset
+        self._gap_end = self._offset + samples
+        self._dropped += samples
+        # Кожне нове значення замінює попереднє: проміжок росте, поки відкидання триває
+        self.subscriber.offer_progress(f"stream_dropped:{self.id}", {
+            "type": "dropped",
+            "stream_id": self.id,
+            "start": round(self._gap_start / SAMPLE_RATE, 3),
+            "end": round(self._gap_end / SAMPLE_RATE, 3),
+            "total": round(self._dropped / SAMPLE_RATE, 3),
+        })
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                if self._stopping:
+                    if self._decoder is not None:
+                        await self._decoder.finish()
+                    await self._decode(final=True)
+                    # Під тим самим ключем, що й частковий результат, щоб замінити його
+                    self.subscriber.offer_progress(f"stream:{self.id}", {"type": "stream_end", "stream_id": self.id})
+                    return
+                await self._decode(final=False)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Помилка потокової сесії {self.id}: {str(e)}")
+            self.subscriber.offer_progress(
+                f"stream:{self.id}", {"type": "stream_error", "stream_id": self.id, "detail": str(e)}
+            )
+        finally:
+            active_sessions.discard(self)
+            if self._decoder is not None:
+                self._decoder.kill()
+
+    async def _decode(self, final: bool):
+        audio = self._consolidate()
+        start = self._offset
+        self._new_samples = 0
+        if not len(audio):
+            return
+
+        duration = len(audio) / SAMPLE_RATE
+        pool = await wait_pool()
+        # Живий потік завжди інтерактивний: буфер не довший за одне вікно Whisper.
+        # Скасування future знімає запит з черги або перериває його в репліці
+        inflight = asyncio.ensure_future(pool.submit_waiting(
+            run_stream_decode, audio, self._prompt, self.options,
+            model_name=self.model_name, ticket=Ticket(INTERACTIVE, duration, self.client)
+        ))
+        self._inflight = None if final else inflight
+        try:
+            await asyncio.wait({inflight})
+        except asyncio.CancelledError:
+            # Сесію закрито - зупиняємо і декодування
+            inflight.cancel()
+            raise
+        finally:
+            self._inflight = None
+        if inflight.cancelled():
+            # Перервано через stop_stream; аудіо лишилося в буфері для остаточного декодування
+            return
+        result = inflight.result()
+        segments = [s for s in result["segments"] if s["text"].strip()]
+
+        if final:
+            stable = len(segments)
+        else:
+            cutoff = duration - STREAM_UNSTABLE_SECONDS
+            stable = 0
+            while stable < len(segments) and segments[stable]["end"] <= cutoff:
+                stable += 1
+            if duration >= STREAM_MAX_BUFFER_SECONDS:
+                # Буфер не повинен перевищувати одне вікно Whisper
+                stable = max(stable, len(segments) - 1, 1 if segments else 0)
+
+        committed, tail = segments[:stable], segments[stable:]
+        if committed:
+            cut = int(min(committed[-1]["end"], duration) * SAMPLE_RATE)
+            self._commit(committed, start / SAMPLE_RATE)
+        elif not segments:
+            # Лише тиша - тримаємо тільки короткий хвіст
+            cut = max(0, len(audio) - int(STREAM_UNSTABLE_SECONDS * SAMPLE_RATE))
+        else:
+            cut = 0
+        # Поки йшло декодування, переповнення могло вже відкинути частину буфера
+        self._trim(cut - (self._offset - start))
+
+        if final:
+            return
+        # Частковий результат: кожне нове значення замінює попереднє
+        partial = "".join(s["text"] for s in tail).strip()
+        self.subscriber.offer_progress(f"stream:{self.id}", {
+            "type": "partial",
+            "stream_id": self.id,
+            "text": partial,
+            "start": round(self._offset / SAMPLE_RATE, 3),
+        })
+
+    def _commit(self, segments: List[dict], offset: float):
+        final_segments = []
+        for segment in segments:
+            final_segments.append({
+                "id": self._segment_id,
+                "start": round(segment["start"] + offset, 3),
+                "end": round(segment["end"] + offset, 3),
+                "text": segment["text"],
+            })
+            self._segment_id += 1
+        text = "".join(s["text"] for s in segments)
+        self._prompt = (self._prompt + text)[-STREAM_PROMPT_CHARS:]
+        # Підтверджений текст не повторюється в наступних результатах, тож його не можна відкинути
+        self.subscriber.offer_reliable({"type": "final", "stream_id": self.id, "segments": final_segments})
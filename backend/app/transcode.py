@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Фонове перекодування збереженого аудіо в Opus.
+
+Вмикається змінною AUDIO_TRANSCODE=opus. Файл, на який посилається історія,
+перекодовується в моно Ogg Opus (<sha256>.opus) і замінює оригінал, лише
+якщо вийшов меншим. Хеш (а отже, і дедуплікація повторних завантажень) лишається
+хешем оригіналу, а його тривалість і розмір зберігаються в audio_blobs.
+Оригінал, який використовує задача або на який нещодавно послався запит,
+не замінюється: перекодування повториться пізніше.
+"""
+import asyncio
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from .audio import transcode_opus
+from .audio_store import (
+    AUDIO_DIR, BLOB_DIR, TRANSCODED_CONTENT_TYPE, TRANSCODED_SUFFIX, UPLOAD_TMP_DIR,
+    install_transcoded, recently_used, relative_audio_path, remove_blob
+)
+from .db import finish_transcode, get_audio_blob, pending_transcodes
+
+logger = logging.getLogger(__name__)
+
+# "opus" - перекодовувати аудіо історії; порожнє значення вимикає перекодування
+AUDIO_TRANSCODE = os.getenv('AUDIO_TRANSCODE', '').lower()
+AUDIO_OPUS_BITRATE = os.getenv('AUDIO_OPUS_BITRATE', '32k')
+# Через скільки секунд повторити, якщо файл зараз використовує задача
+TRANSCODE_RETRY_SECONDS = 60
+
+# Формати, які вже стиснуті кодеком для мовлення
+SKIP_CONTENT_TYPES = {"audio/ogg", "audio/webm", "audio/amr"}
+
+
+class Transcoder:
+    """Черга хешів аудіо і одна фонова задача, що їх перекодовує по черзі"""
+
+    def __init__(self, enabled: bool = AUDIO_TRANSCODE == "opus"):
+        self.enabled = enabled
+        self._queue: Optional[asyncio.Queue] = None
+
+    def schedule(self, audio_hash: Optional[str]):
+        if self.enabled and audio_hash and self._queue is not None:
+            self._queue.put_nowait(audio_hash)
+
+    def _retry(self, audio_hash: str, src: Path):
+        delay = max(TRANSCODE_RETRY_SECONDS, recently_used(src))
+        asyncio.get_running_loop().call_later(delay, self.schedule, audio_hash)
+        logger.info(f"Аудіо {src.name} використовується, перекодування відкладено")
+
+    async def _postpone(self, audio_hash: str, src: Path, is_busy: Callable[[Path], Awaitable[bool]]) -> bool:
+        """Відкласти, якщо файл читає задача або на нього щойно послався запит"""
+        if not recently_used(src) and not await is_busy(src):
+            return False
+        self._retry(audio_hash, src)
+        return True
+
+    async def run(self, is_busy: Callable[[Path], Awaitable[bool]]):
+        """is_busy(path) - чи використовує файл незавершена задача транскрибування"""
+        if not self.enabled:
+            return
+        if shutil.which("ffmpeg") is None:
+            # Не позначаємо файли перевіреними - їх перекодує наступний запуск з ffmpeg
+            logger.error("AUDIO_TRANSCODE увімкнено, але ffmpeg не знайдено")
+            self.enabled = False
+            return
+        self._queue = asyncio.Queue()
+        # Аудіо, збережене до вмикання або під час попереднього запуску
+        for audio_hash in await pending_transcodes():
+            self._queue.put_nowait(audio_hash)
+        logger.info(f"Перекодування аудіо в Opus увімкнено, у черзі {self._queue.qsize()}")
+
+        while True:
+            audio_hash = await self._queue.get()
+            try:
+                await self._process(audio_hash, is_busy)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Помилка перекодування {audio_hash}: {str(e)}")
+                # Не повторюємо нескінченно файл, який ffmpeg не може прочитати
+                await finish_transcode(audio_hash)
+
+    async def _process(self, audio_hash: str, is_busy: Callable[[Path], Awaitable[bool]]):
+        blob = await get_audio_blob(audio_hash)
+        if blob is None or blob.transcoded_at is not None or blob.refcount <= 0:
+            return
+        src = AUDIO_DIR / blob.path
+        if not src.is_file():
+            return
+        if blob.content_type in SKIP_CONTENT_TYPES or src.suffix == ".ogg":
+            await finish_transcode(audio_hash)
+            return
+        if await self._postpone(audio_hash, src, is_busy):
+            return
+
+        temp_path = UPLOAD_TMP_DIR / f"{audio_hash}.opus.part"
+        try:
+            duration = await transcode_opus(str(src), str(temp_path), AUDIO_OPUS_BITRATE)
+            original_size = src.stat().st_size
+            size = temp_path.stat().st_size
+            if size >= original_size:
+                logger.info(f"Opus не менший за оригінал, лишаємо {src.name}")
+                await finish_transcode(audio_hash, duration=duration)
+                return
+
+            # Поки працював ffmpeg, на оригінал могли послатися: задачі перевіряємо тут,
+            # а нещодавні посилання - ще раз під блокуванням сховища разом із заміною
+            dst = BLOB_DIR / f"{audio_hash}{TRANSCODED_SUFFIX}"
+            if await self._postpone(audio_hash, src, is_busy):
+                return
+            if not await asyncio.to_thread(install_transcoded, src, temp_path, dst):
+                self._retry(audio_hash, src)
+                return
+        finally:
+            if temp_path.exists():
+                os.unlink(temp_path)
+
+        await finish_transcode(
+            audio_hash, relative_audio_path(dst), TRANSCODED_CONTENT_TYPE, size, original_size, duration
+        )
+        # Оригінал, на який уже послалося нове завантаження, прибере фонове очищення
+        await asyncio.to_thread(remove_blob, relative_audio_path(src))
+        logger.info(f"Аудіо {src.name} перекодовано: {original_size} -> {size} байт")
+
+
+transcoder = Transcoder()
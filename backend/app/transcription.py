@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""Спільний конвеєр транскрибування для /transcribe та /jobs"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.requests import HTTPConnection
+from pydantic import BaseModel
+
+from .audio import SAMPLE_RATE, decode_audio, get_duration
+from .cache import cache, file_sha256, make_key
+from .inference import InferencePool, raise_if_cancelled, wait_pool
+from .metrics import AUDIO_SECONDS, CACHE_RESULTS, REALTIME_FACTOR, STAGE_SECONDS
+from .models import resolve_model
+from .scheduler import INTERACTIVE, PRIORITY_CLASSES, Ticket
+from .uploads import SpooledUpload
+from .vad import split_on_silence
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int], Awaitable[None]]
+
+# Мова за замовчуванням; клієнт може обрати іншу або "auto" для автовизначення
+WHISPER_LANGUAGE = os.getenv('WHISPER_LANGUAGE', 'uk')
+# Параметри декодування; входять у ключ кешу
+DECODE_OPTIONS = {"language": WHISPER_LANGUAGE}  # За замовчуванням українська мова
+
+# Записи, довші за поріг (секунд), діляться по паузах і транскрибуються паралельно
+LONG_AUDIO_THRESHOLD = float(os.getenv('LONG_AUDIO_THRESHOLD', '600'))
+LONG_AUDIO_CHUNK = float(os.getenv('LONG_AUDIO_CHUNK', '300'))
+# Заголовок з ідентифікатором клієнта для квот планувальника; береться до уваги лише
+# від адрес із TRUSTED_PROXIES (через кому), інакше клієнт обходив би квоту новим значенням
+CLIENT_ID_HEADER = os.getenv('CLIENT_ID_HEADER', 'X-Client-Id')
+TRUSTED_PROXIES = {host.strip() for host in os.getenv('TRUSTED_PROXIES', '').split(',') if host.strip()}
+# Mel-кадрів на секунду (HOP_LENGTH = 160 при 16 кГц), у них Whisper рахує seek
+FRAMES_PER_SECOND = 100
+
+# Колбек прогресу поточної задачі в потоці репліки
+_progress_local = threading.local()
+_hook_lock = threading.Lock()
+_hook_installed = False
+
+
+class _DecodeProgressBar:
+    """Заміна tqdm у whisper.transcribe.
+
+    Whisper оновлює смугу на кількість mel-кадрів, на які зсунулося вікно
+    декодування, тож n / total - це реальна частка вже декодованого аудіо.
+    """
+
+    def __init__(self, *args, total=None, **kwargs):
+        self.total = total or 0
+        self.n = 0
+        self.callback = getattr(_progress_local, "callback", None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def update(self, n=1):
+        self.n += n
+        if self.callback is not None and self.total:
+            self.callback(min(self.n / self.total, 1.0))
+
+
+class _TqdmShim:
+    tqdm = _DecodeProgressBar
+
+
+def _timed_mel(log_mel_spectrogram):
+    """Обгортка log_mel_spectrogram з whisper.transcribe для метрики етапу mel"""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return log_mel_spectrogram(*args, **kwargs)
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, "mel")
+    return wrapper
+
+
+def _install_progress_hook():
+    global _hook_installed
+    with _hook_lock:
+        if _hook_installed:
+            return
+        import whisper  # noqa: F401 - гарантує, що модуль whisper.transcribe завантажено
+        module = sys.modules["whisper.transcribe"]
+        module.tqdm = _TqdmShim
+        module.log_mel_spectrogram = _timed_mel(module.log_mel_spectrogram)
+        _hook_installed = True
+
+
+class TranscriptionResponse(BaseModel):
+    text: str
+    segments: List[Dict[str, Any]]
+    # sha256 збереженого аудіо; за ним /history може послатися на файл без повторного завантаження
+    audioHash: Optional[str] = None
+
+
+def validate_audio_upload(upload: SpooledUpload):
+    """Перевіряємо формат файлу"""
+    if not upload.declared_type or not upload.declared_type.startswith('audio/'):
+        logger.error(f"Невірний формат файлу: {upload.declared_type}")
+        raise HTTPException(status_code=400, detail="Файл повинен бути аудіо")
+
+
+def decode_options(language: Optional[str] = None) -> dict:
+    """Параметри декодування для мови, обраної клієнтом"""
+    if not language:
+        return dict(DECODE_OPTIONS)
+    language = language.strip().lower()
+    if language == "auto":
+        return {"language": None}
+    from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+
+    code = language if language in LANGUAGES else TO_LANGUAGE_CODE.get(language)
+    if code is None:
+        raise ValueError(f"Невідома мова: {language}")
+    return {"language": code}
+
+
+def validate_model_options(model: Optional[str], language: Optional[str]) -> Tuple[str, dict]:
+    """Перевіряємо вибір моделі та мови; повертає канонічну назву моделі і параметри"""
+    try:
+        return resolve_model(model), decode_options(language)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def validate_priority(priority: Optional[str], default: str = INTERACTIVE) -> str:
+    """Клас пріоритету з форми запиту"""
+    if not priority:
+        return default
+    priority = priority.strip().lower()
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Невідомий клас пріоритету: {priority}")
+    return priority
+
+
+def client_id(connection: HTTPConnection) -> Optional[str]:
+    """Хто надіслав запит - ключ квоти в планувальнику"""
+    host = connection.client.host if connection.client else None
+    if host in TRUSTED_PROXIES:
+        value = connection.headers.get(CLIENT_ID_HEADER)
+        if value:
+            return value.strip()[:128]
+    return host
+
+
+def run_transcribe(
+    model,
+    audio: np.ndarray,
+    on_progress: Optional[Callable[[float], None]] = None,
+    options: Optional[dict] = None,
+) -> dict:
+    """Виконується в потоці репліки пулу інференсу; audio - вже декодований буфер"""
+    options = DECODE_OPTIONS if options is None else options
+
+    def progress(fraction: float):
+        # Прогрес оновлюється після кожного вікна - тут і зупиняємо скасовану задачу
+        raise_if_cancelled()
+        if on_progress is not None:
+            on_progress(fraction)
+
+    if getattr(model, "native_progress", False):
+        return model.transcribe(audio, verbose=False, on_progress=progress, **options)
+    _install_progress_hook()
+    _progress_local.callback = progress
+    try:
+        return model.transcribe(audio, verbose=False, **options)
+    finally:
+        _progress_local.callback = None
+
+
+def _shift_segment(segment: dict, offset: float, segment_id: int) -> dict:
+    segment = dict(segment)
+    segment["id"] = segment_id
+    segment["start"] = round(segment["start"] + offset, 3)
+    segment["end"] = round(segment["end"] + offset, 3)
+    if "seek" in segment:
+        segment["seek"] += int(round(offset * FRAMES_PER_SECOND))
+    if segment.get("words"):
+        segment["words"] = [
+            {**word, "start": round(word["start"] + offset, 3), "end": round(word["end"] + offset, 3)}
+            for word in segment["words"]
+        ]
+    return segment
+
+
+def stitch_results(parts: List[Tuple[float, dict]]) -> dict:
+    """Зшиває результати частин: абсолютний час і наскрізна нумерація сегментів"""
+    segments: List[dict] = []
+    texts = []
+    for offset, result in parts:
+        texts.append(result["text"])
+        for segment in result["segments"]:
+            segments.append(_shift_segment(segment, offset, len(segments)))
+    return {"text": "".join(texts), "segments": segments}
+
+
+async def transcribe_chunks(
+    pool: InferencePool,
+    audio: np.ndarray,
+    on_progress: Callable[[float], None],
+    model_name: Optional[str] = None,
+    options: Optional[dict] = None,
+    priority: str = INTERACTIVE,
+    client: Optional[str] = None,
+) -> dict:
+    """Довгий запис: частини по паузах паралельно в різних репліках пулу.
+
+    Кожна частина окремо проходить планувальник, тож квота клієнта обмежує
+    і кількість частин одного запису, що декодуються одночасно.
+    """
+    chunks = split_on_silence(audio, LONG_AUDIO_CHUNK, LONG_AUDIO_CHUNK * 1.2)
+    weights = [(end - start) / len(audio) for start, end in chunks]
+    fractions = [0.0] * len(chunks)
+    # Не більше задач у черзі, ніж реплік, щоб не витісняти інші запити
+    semaphore = asyncio.Semaphore(pool.replicas)
+
+    async def run_chunk(index: int, start: int, end: int) -> dict:
+        def chunk_progress(fraction: float):
+            fractions[index] = fraction
+            on_progress(sum(w * f for w, f in zip(weights, fractions)))
+
+        ticket = Ticket(priority, (end - start) / SAMPLE_RATE, client)
+        async with semaphore:
+            return await pool.submit_waiting(
+                run_transcribe, audio[start:end], chunk_progress, options,
+                model_name=model_name, ticket=ticket
+            )
+
+    tasks = [asyncio.create_task(run_chunk(i, start, end)) for i, (start, end) in enumerate(chunks)]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return stitch_results([(start / SAMPLE_RATE, result) for (start, _), result in zip(chunks, results)])
+
+
+async def warm_up(pool: InferencePool):
+    """Короткий прогін тиші в кожній репліці, щоб перший запит не платив за ініціалізацію"""
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    started = time.time()
+    await asyncio.gather(*(pool.submit_waiting(run_transcribe, silence) for _ in range(pool.replicas)))
+    logger.info(f"Прогрів моделі завершено за {time.time() - started:.2f} с")
+
+
+async def transcribe_decoded(
+    audio: np.ndarray,
+    on_progress: Optional[ProgressCallback] = None,
+    model_name: Optional[str] = None,
+    options: Optional[dict] = None,
+    priority: str = INTERACTIVE,
+    client: Optional[str] = None,
+) -> dict:
+    """Транскрибувати вже декодований буфер у пулі інференсу.
+
+    priority і client визначають місце запиту в планувальнику; у межах класу
+    коротші записи йдуть першими.
+    """
+    duration = get_duration(audio)
+    logger.info(f"Тривалість аудіо: {duration:.2f} секунд")
+
+    logger.info("Початок транскрибування...")
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    last_reported = -1
+
+    async def report(progress: int):
+        if on_progress is not None:
+            await on_progress(progress)
+
+    def on_decode_progress(fraction: float):
+        # Викликається з потоку репліки; повідомляємо лише зміну цілого відсотка
+        nonlocal last_reported
+        progress = min(int(fraction * 100), 99)
+        if progress > last_reported:
+            last_reported = progress
+            asyncio.run_coroutine_threadsafe(report(progress), loop)
+
+    # Відправляємо початковий прогрес
+    await report(0)
+
+    # Виконуємо транскрибування в пулі, не блокуючи event loop
+    pool = await wait_pool()
+    if duration >= LONG_AUDIO_THRESHOLD and pool.replicas > 1:
+        result = await transcribe_chunks(
+            pool, audio, on_decode_progress, model_name, options, priority, client
+        )
+    else:
+        result = await pool.submit_waiting(
+            run_transcribe, audio, on_decode_progress, options,
+            model_name=model_name, ticket=Ticket(priority, duration, client)
+        )
+
+    elapsed = time.time() - start_time
+    if duration > 0:
+        REALTIME_FACTOR.observe(elapsed / duration)
+        AUDIO_SECONDS.inc(amount=duration)
+
+    # Відправляємо фінальний прогрес
+    await report(100)
+    logger.info(f"Транскрибування успішно завершено за {elapsed:.2f} с")
+
+    return {"text": result["text"], "segments": result["segments"]}
+
+
+async def transcribe_file(
+    audio_path: str,
+    on_progress: Optional[ProgressCallback] = None,
+    audio_hash: Optional[str] = None,
+    model_name: Optional[str] = None,
+    options: Optional[dict] = None,
+    priority: str = INTERACTIVE,
+    client: Optional[str] = None,
+) -> dict:
+    """Транскрибувати файл у пулі інференсу, повідомляючи прогрес.
+
+    Якщо такий самий файл вже транскрибувався тією ж моделлю з тими самими
+    параметрами, результат повертається з кешу без інференсу.
+    """
+    if audio_hash is None:
+        audio_hash = await asyncio.to_thread(file_sha256, audio_path)
+    model_name = resolve_model(model_name)
+    options = DECODE_OPTIONS if options is None else options
+    cache_key = make_key(audio_hash, model_name, options)
+    cached = await cache.aget(cache_key)
+    CACHE_RESULTS.inc("miss" if cached is None else "hit")
+    if cached is not None:
+        logger.info(f"Результат знайдено в кеші: {audio_hash}")
+        if on_progress is not None:
+            await on_progress(100)
+        return cached
+
+    # Декодуємо один раз; тривалість рахується з кількості відліків
+    audio = await decode_audio(audio_path)
+    result = await transcribe_decoded(audio, on_progress, model_name, options, priority, client)
+    await cache.aput(cache_key, result)
+    return result
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Потокове збереження завантажень на диск.
+
+Тіло multipart-запиту розбирається в міру надходження: файлові частини
+пишуться одразу у власний тимчасовий файл, одночасно рахується sha256 і
+перевіряється ліміт розміру, а тип контейнера визначається за
+сигнатурою перших байтів, а не за заголовком клієнта. Проміжної копії
+у SpooledTemporaryFile, як при розборі форми FastAPI, немає.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Максимальний розмір тіла запиту із завантаженням
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(1024 * 1024 * 1024)))
+
+# Максимальний розмір звичайного (не файлового) поля форми
+MAX_FORM_FIELD_BYTES = 1024 * 1024
+
+# Скільки байтів потрібно для визначення типу
+SNIFF_BYTES = 16
+
+
+@dataclass
+class SpooledUpload:
+    path: Path
+    sha256: str
+    size: int
+    extension: str
+    content_type: str
+    # Ім'я файлу і тип, заявлені клієнтом у частині форми
+    file_name: Optional[str] = None
+    declared_type: Optional[str] = None
+
+
+@dataclass
+class UploadForm:
+    """Поля форми і файли, записані на диск під час читання тіла запиту"""
+    fields: Dict[str, str] = field(default_factory=dict)
+    files: Dict[str, List[SpooledUpload]] = field(default_factory=dict)
+
+    def get(self, name: str) -> Optional[str]:
+        return self.fields.get(name)
+
+    def file(self, name: str) -> Optional[SpooledUpload]:
+        files = self.files.get(name)
+        return files[0] if files else None
+
+    def require_file(self, name: str) -> SpooledUpload:
+        upload = self.file(name)
+        if upload is None:
+            raise HTTPException(status_code=422, detail=f"Missing file field: {name}")
+        return upload
+
+
+def sniff_audio_type(head: bytes, file_name: Optional[str] = None) -> Tuple[str, str]:
+    """Повертає (розширення, MIME тип) за сигнатурою файлу"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return ".wav", "audio/wav"
+    if head[:4] == b"OggS":
+        return ".ogg", "audio/ogg"
+    if head[:4] == b"fLaC":
+        return ".flac", "audio/flac"
+    if head[4:8] == b"ftyp":
+        return ".m4a", "audio/mp4"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return ".webm", "audio/webm"
+    if head[:6] == b"#!AMR\n":
+        return ".amr", "audio/amr"
+    if head[:3] == b"ID3":
+        return ".mp3", "audio/mpeg"
+    if len(head) >= 2 and head[0] == 0xFF:
+        # ADTS AAC: 1111 1111 1111 x00x, MPEG audio: 1111 1111 111x xxxx
+        if head[1] & 0xF6 == 0xF0:
+            return ".aac", "audio/aac"
+        if head[1] & 0xE0 == 0xE0:
+            return ".mp3", "audio/mpeg"
+    # Невідома сигнатура - покладаємося на розширення імені файлу
+    extension = Path(file_name or "").suffix.lower()
+    return extension or ".bin", "application/octet-stream"
+
+
+class _FormWriter:
+    """Колбеки MultipartParser: поля збираються в пам'яті, файли пишуться на диск"""
+
+    def __init__(self, directory: Path, max_bytes: int, max_files: Optional[int]):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.form = UploadForm()
+        # Усі створені тимчасові файли; ті, що не перенесено у сховище, видаляються в кінці
+        self.temp_paths: List[Path] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = ""
+        self._value: Optional[bytearray] = None
+        self._upload: Optional[SpooledUpload] = None
+        self._out: Optional[BinaryIO] = None
+        self._digest = None
+        self._head = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in options:
+            self._value = bytearray()
+            return
+        files_count = sum(len(files) for files in self.form.files.values())
+        if self.max_files is not None and files_count >= self.max_files:
+            raise HTTPException(status_code=413, detail=f"At most {self.max_files} files per request")
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        self.temp_paths.append(Path(temp_path))
+        self._out = os.fdopen(fd, "wb")
+        self._digest = hashlib.sha256()
+        self._head = b""
+        declared = self._headers.get(b"content-type")
+        self._upload = SpooledUpload(
+            Path(temp_path), "", 0, "", "",
+            file_name=options[b"filename"].decode("utf-8", "replace"),
+            declared_type=declared.decode("latin-1") if declared else None,
+        )
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if self._upload is None:
+            self._value += chunk
+            if len(self._value) > MAX_FORM_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Поле {self._name} завелике")
+            return
+        self._upload.size += len(chunk)
+        if self._upload.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail="Файл завеликий")
+        if len(self._head) < SNIFF_BYTES:
+            self._head += chunk[:SNIFF_BYTES - len(self._head)]
+        self._digest.update(chunk)
+        self._out.write(chunk)
+
+    def on_part_end(self):
+        upload, self._upload = self._upload, None
+        if upload is None:
+            self.form.fields[self._name] = self._value.decode("utf-8", "replace")
+            return
+        self._out.close()
+        self._out = None
+        # Порожнє поле файлу без імені - браузер так надсилає невибраний файл
+        if upload.size == 0 and not upload.file_name:
+            return
+        upload.sha256 = self._digest.hexdigest()
+        upload.extension, upload.content_type = sniff_audio_type(self._head, upload.file_name)
+        logger.info(f"Файл збережено частинами: {upload.size} байт, тип {upload.content_type}")
+        self.form.files.setdefault(self._name, []).append(upload)
+
+    def cleanup(self):
+        if self._out is not None:
+            self._out.close()
+        for path in self.temp_paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+@asynccontextmanager
+async def receive_form(
+    request: Request,
+    directory: Path,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    max_files: Optional[int] = None,
+) -> AsyncIterator[UploadForm]:
+    """Розбирає multipart-тіло запиту частинами в міру надходження.
+
+    Файли, які за межами блоку не перенесено у сховище, видаляються.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    writer = _FormWriter(directory, max_bytes, max_files)
+    if content_type == b"application/x-www-form-urlencoded":
+        # Форма без файлів
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > MAX_FORM_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail="Форма завелика")
+        writer.form.fields.update(parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True))
+        yield writer.form
+        return
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Очікується multipart/form-data")
+    os.makedirs(directory, exist_ok=True)
+    parser = MultipartParser(options[b"boundary"], writer.callbacks())
+    try:
+        with stage_timer("upload"):
+            async for chunk in request.stream():
+                parser.write(chunk)
+            parser.finalize()
+        yield writer.form
+    finally:
+        writer.cleanup()
+
+
+class UploadLimitMiddleware:
+    """Відхиляє занадто великі запити до того, як тіло буде розібране.
+
+    Перевіряє Content-Length одразу, а для запитів без нього рахує байти,
+    що надходять, і обриває читання після перевищення ліміту.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > self.max_bytes
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    await self._reject(send)
+                    return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Файл завеликий")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _reject(send):
+        body = '{"detail":"Файл завеликий"}'.encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
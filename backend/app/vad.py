@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Енергетичний VAD на NumPy для поділу довгого аудіо на частини по паузах"""
+import logging
+from typing import List, Tuple
+
+import numpy as np
+
+from .audio import SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+FRAME_SECONDS = 0.03
+# Поріг тиші над рівнем шуму, дБ
+SILENCE_MARGIN_DB = 10.0
+# Абсолютний мінімум порогу, щоб цифрова тиша не знижувала його до нуля
+SILENCE_FLOOR_DB = -60.0
+MIN_SILENCE_SECONDS = 0.3
+
+
+def frame_energy_db(audio: np.ndarray, frame_size: int) -> np.ndarray:
+    """RMS енергія кожного кадру в дБ"""
+    frames = len(audio) // frame_size
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    framed = audio[:frames * frame_size].reshape(frames, frame_size)
+    rms = np.sqrt(np.mean(np.square(framed, dtype=np.float32), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def silence_mask(energy_db: np.ndarray) -> np.ndarray:
+    # Рівень шуму оцінюємо як 10-й процентиль енергії кадрів
+    noise_floor = np.percentile(energy_db, 10) if len(energy_db) else SILENCE_FLOOR_DB
+    threshold = max(noise_floor + SILENCE_MARGIN_DB, SILENCE_FLOOR_DB)
+    return energy_db < threshold
+
+
+def silence_centers(mask: np.ndarray, min_frames: int) -> np.ndarray:
+    """Індекси кадрів у центрах пауз, не коротших за min_frames"""
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.diff(padded)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    long_enough = (ends - starts) >= min_frames
+    return (starts[long_enough] + ends[long_enough]) // 2
+
+
+def split_on_silence(
+    audio: np.ndarray,
+    target_seconds: float,
+    max_seconds: float,
+    sample_rate: int = SAMPLE_RATE,
+) -> List[Tuple[int, int]]:
+    """Ділить аудіо на частини близько target_seconds, розрізаючи по паузах.
+
+    Повертає пари (початок, кінець) у відліках. Якщо в допустимому вікні
+    немає паузи, розріз робиться у найтихішому кадрі вікна.
+    """
+    total = len(audio)
+    if total <= max_seconds * sample_rate:
+        return [(0, total)]
+
+    frame_size = int(FRAME_SECONDS * sample_rate)
+    energy = frame_energy_db(audio, frame_size)
+    centers = silence_centers(silence_mask(energy), max(1, int(MIN_SILENCE_SECONDS / FRAME_SECONDS)))
+
+    target_frames = int(target_seconds / FRAME_SECONDS)
+    min_frames = target_frames // 2
+    max_frames = int(max_seconds / FRAME_SECONDS)
+
+    chunks = []
+    start = 0
+    frames_total = len(energy)
+    while frames_total - start > max_frames:
+        low, high = start + min_frames, start + max_frames
+        candidates = centers[(centers >= low) & (centers <= high)]
+        if len(candidates):
+            # Пауза, найближча до бажаної довжини частини
+            cut = int(candidates[np.argmin(np.abs(candidates - (start + target_frames)))])
+        else:
+            cut = low + int(np.argmin(energy[low:high]))
+        chunks.append((start * frame_size, cut * frame_size))
+        start = cut
+    chunks.append((start * frame_size, total))
+    logger.info(f"Аудіо розділено на {len(chunks)} частин по паузах")
+    return chunks
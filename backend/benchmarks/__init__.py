@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Офлайн бенчмарки транскрибування та історії.
+
+Запуск з каталогу backend:
+
+    python -m benchmarks.transcribe --url http://localhost:8001
+    python -m benchmarks.history --sizes 10000,100000
+
+Результати записуються в JSON (benchmarks/results/ за замовчуванням),
+щоб порівнювати запуски між собою.
+"""
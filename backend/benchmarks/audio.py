@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Синтетичне аудіо для бенчмарків без TTS і без мережі.
+
+"Склади" - гармонічний тон зі змінною висотою і огинаючою близько 4 Гц,
+між фразами - паузи, щоб VAD мав де різати довгі записи, поверх - шум
+із заданим SNR. Той самий seed дає той самий файл, інший seed - інший
+вміст, а отже, й інший хеш (кеш транскрибувань не спрацює).
+"""
+import io
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def synthesize(seconds: float, seed: int = 0, snr_db: float = 20.0, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Моно float32 у діапазоні [-1, 1]"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    signal = np.zeros(total, dtype=np.float32)
+
+    position = 0
+    while position < total:
+        # Фраза 1.5-6 с, потім пауза 0.3-1.2 с
+        phrase = int(rng.uniform(1.5, 6.0) * sample_rate)
+        end = min(total, position + phrase)
+        t = np.arange(end - position) / sample_rate
+        pitch = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.2, 0.8) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        syllables = 0.5 * (1 - np.cos(2 * np.pi * rng.uniform(3, 5) * t))
+        signal[position:end] = 0.3 * voiced * syllables
+        position = end + int(rng.uniform(0.3, 1.2) * sample_rate)
+
+    power = float(np.mean(signal ** 2)) or 1e-6
+    noise = rng.normal(0, np.sqrt(power / 10 ** (snr_db / 10)), total)
+    return np.clip(signal + noise, -1, 1).astype(np.float32)
+
+
+def to_wav(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """16-бітний PCM WAV у пам'яті"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes((audio * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def synthetic_wav(seconds: float, seed: int = 0, snr_db: float = 20.0) -> bytes:
+    return to_wav(synthesize(seconds, seed, snr_db))
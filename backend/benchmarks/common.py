@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Спільне для бенчмарків: статистика затримок, опис середовища, запис JSON"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Перцентиль з лінійною інтерполяцією; sorted_values уже відсортовані"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(samples: List[float], scale: float = 1000.0) -> Dict[str, float]:
+    """min/mean/p50/p95/p99/max; за замовчуванням секунди переводяться в мілісекунди"""
+    values = sorted(value * scale for value in samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "min": round(values[0], 3),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 0.50), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "commit": _git_commit(),
+    }
+
+
+def write_results(suite: str, config: dict, results: list, output: Optional[str]) -> Path:
+    """Записує результати запуску; без output - у RESULTS_DIR з часом запуску в імені"""
+    started = datetime.now(timezone.utc)
+    if output:
+        path = Path(output)
+    else:
+        path = RESULTS_DIR / f"{suite}-{started.strftime('%Y%m%dT%H%M%SZ')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document = {
+        "suite": suite,
+        "created_at": started.isoformat(),
+        "environment": environment(),
+        "config": config,
+        "results": results,
+    }
+    path.write_text(json.dumps(document, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def parse_list(value: str, cast=float) -> List:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк /history: список, запис, сегменти, пошук і видалення при зростанні історії.
+
+Працює в одному процесі з окремою БД (тимчасовий SQLite, якщо не вказано
+--database-url): історія заповнюється синтетичними записами до кожного
+розміру з --sizes, після чого запити проходять крізь FastAPI напряму через
+ASGI, без мережі. Вимірюється маршрутизація, БД і серіалізація відповіді.
+
+    python -m benchmarks.history --sizes 10000,100000 --samples 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
+
+from .common import BACKEND_DIR, log, parse_list, summarize, write_results
+
+# Записів за одну транзакцію при заповненні
+SEED_BATCH = 1000
+
+WORDS = (
+    "аудіо запис голос мова слово речення текст пауза частина сегмент модель результат "
+    "історія файл розмова інтерв'ю лекція зустріч питання відповідь український переклад "
+    "година хвилина секунда початок кінець приклад система сервер клієнт перевірка"
+).split()
+
+
+def synthetic_work(rng: random.Random, index: int, segments: int) -> dict:
+    """Запис у форматі фронтенду: сегменти з метриками Whisper, частина - відредагована"""
+    items = []
+    start = 0.0
+    for number in range(segments):
+        duration = rng.uniform(1.5, 6.0)
+        items.append({
+            "id": number,
+            "seek": int(start * 100),
+            "start": round(start, 2),
+            "end": round(start + duration, 2),
+            "text": " " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14))),
+            "tokens": [rng.randint(0, 51000) for _ in range(rng.randint(10, 40))],
+            "temperature": 0.0,
+            "avg_logprob": -rng.random(),
+            "compression_ratio": rng.uniform(1.0, 2.2),
+            "no_speech_prob": rng.random() * 0.1,
+        })
+        start += duration
+    text = "".join(segment["text"] for segment in items)
+    edited = [dict(segment) for segment in items]
+    if rng.random() < 0.3:
+        edited[rng.randrange(len(edited))]["text"] = " виправлений текст"
+    return {
+        "id": str(1_700_000_000_000 + index),
+        "fileName": f"bench_{index}.wav",
+        "date": "2025-01-01T00:00:00",
+        "transcribedText": text,
+        "editedText": "".join(segment["text"] for segment in edited),
+        "segments": items,
+        "editedSegments": edited,
+    }
+
+
+async def asgi_request(app, method: str, path: str, query: Optional[dict] = None) -> Tuple[int, bytes]:
+    """Запит до ASGI застосунку без мережі і без httpx"""
+    body = []
+    status = 0
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(query or {}).encode(),
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(body)
+
+
+async def measure(app, samples: int, request) -> dict:
+    """request() -> (method, path, query); кожен запит вимірюється окремо"""
+    latencies = []
+    failures = 0
+    for _ in range(samples):
+        method, path, query = request()
+        started = time.perf_counter()
+        status, _ = await asgi_request(app, method, path, query)
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            failures += 1
+    return {"latency_ms": summarize(latencies), "failed": failures}
+
+
+async def run(args) -> List[dict]:
+    # app.db читає DATABASE_URL під час імпорту
+    sys.path.insert(0, str(BACKEND_DIR))
+    from fastapi import FastAPI
+
+    from app.db import Base, bulk_create_transcriptions, engine
+    from app.routers import history
+
+    app = FastAPI()
+    app.include_router(history.router)
+    # Лише таблиці: init_db ще й мігрував би transcription_history.json у бенчмарк-БД
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    rng = random.Random(args.seed)
+    results = []
+    seeded = 0
+    # id у синтетичній БД ідуть підряд з 1; видалені записи з вибірки прибираються
+    alive: List[int] = []
+    for size in sorted(parse_list(args.sizes, int)):
+        started = time.perf_counter()
+        first_new = seeded + 1
+        while seeded < size:
+            batch = [
+                synthetic_work(rng, seeded + offset, args.segments)
+                for offset in range(min(SEED_BATCH, size - seeded))
+            ]
+            seeded += await bulk_create_transcriptions(batch)
+        seed_seconds = time.perf_counter() - started
+        log(f"Історія: {seeded} записів (заповнення {seed_seconds:.1f} с)")
+
+        alive.extend(range(first_new, seeded + 1))
+        pick = lambda: rng.choice(alive)  # noqa: E731
+        operations = {
+            "list": lambda: ("GET", "/history/", {"limit": 50}),
+            "list_deep_page": lambda: ("GET", "/history/", {"limit": 50, "after": pick()}),
+            "list_with_segments": lambda: ("GET", "/history/", {"limit": 50, "fields": "id,segments,editedSegments"}),
+            "get": lambda: ("GET", f"/history/{pick()}", None),
+            "get_segments": lambda: ("GET", f"/history/{pick()}/segments", None),
+            "search": lambda: ("GET", "/history/search", {"q": rng.choice(WORDS), "limit": 20}),
+        }
+        for name, request in operations.items():
+            result = await measure(app, args.samples, request)
+            results.append({"size": seeded, "operation": name, **result})
+            log(f"  {name}: p50 {result['latency_ms']['p50']:.2f} мс, p95 {result['latency_ms']['p95']:.2f} мс")
+
+        # Видалення останнім: видалені записи не потрапляють у вибірку інших операцій
+        victims = rng.sample(alive, min(args.samples, len(alive)))
+        deleted = set(victims)
+        result = await measure(app, len(victims), lambda: ("DELETE", f"/history/{victims.pop()}", None))
+        alive = [work_id for work_id in alive if work_id not in deleted]
+        results.append({"size": seeded, "operation": "delete", **result})
+        log(f"  delete: p50 {result['latency_ms']['p50']:.2f} мс, p95 {result['latency_ms']['p95']:.2f} мс")
+        results.append({"size": seeded, "operation": "seed", "seconds": round(seed_seconds, 3)})
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="розміри історії через кому")
+    parser.add_argument("--samples", type=int, default=200, help="запитів на кожну операцію")
+    parser.add_argument("--segments", type=int, default=20, help="сегментів у синтетичному записі")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=None, help="за замовчуванням - тимчасовий SQLite")
+    parser.add_argument("--output", default=None, help="файл JSON з результатами")
+    args = parser.parse_args(argv)
+
+    temp_dir = tempfile.TemporaryDirectory(prefix="history-bench-")
+    database_url = args.database_url or f"sqlite+aiosqlite:///{Path(temp_dir.name) / 'history.sqlite3'}"
+    os.environ["DATABASE_URL"] = database_url
+    # Роутер історії імпортує задачі і кеш; їхні файли теж не мають торкатися робочих
+    os.environ["JOBS_DB_PATH"] = str(Path(temp_dir.name) / "jobs.sqlite3")
+    os.environ["CACHE_DB_PATH"] = str(Path(temp_dir.name) / "cache.sqlite3")
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        temp_dir.cleanup()
+
+    config = {**vars(args), "database": database_url.split(":", 1)[0]}
+    config.pop("database_url")
+    path = write_results("history", config, results, args.output)
+    log(f"Результати: {path}")
+
+
+if __name__ == "__main__":
+    main()
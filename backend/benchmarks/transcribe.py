@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк POST /transcribe: затримка, real-time factor і пропускна здатність.
+
+Потрібен запущений сервер (python main.py). Кожен запит отримує власний
+синтетичний файл, тож кеш результатів не спотворює вимірювання. Сервер
+зберігає результати в історію, тому краще запускати його з окремою БД:
+
+    DATABASE_URL=sqlite+aiosqlite:///./bench.sqlite3 python main.py
+    python -m benchmarks.transcribe --lengths 10,60,300 --concurrency 1,2,4
+"""
+import argparse
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from .audio import synthetic_wav
+from .common import log, parse_list, summarize, write_results
+
+# Скільки разів повторити запит, відхилений з 429
+MAX_RETRIES = 20
+
+
+def _multipart(fields: dict, file_name: str, content: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+        )
+    parts.append(
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{file_name}\"\r\n"
+        f"Content-Type: audio/wav\r\n\r\n".encode()
+    )
+    parts.append(content)
+    parts.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def transcribe_once(url: str, wav: bytes, fields: dict, timeout: float) -> dict:
+    """Один запит; 429 повторюється після Retry-After, час очікування входить у затримку"""
+    body, content_type = _multipart(fields, "bench.wav", wav)
+    started = time.perf_counter()
+    retries = 0
+    while True:
+        request = urllib.request.Request(
+            f"{url}/transcribe", data=body, method="POST", headers={"Content-Type": content_type}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+            if status == 429 and retries < MAX_RETRIES:
+                retries += 1
+                time.sleep(float(e.headers.get("Retry-After", "1")))
+                continue
+        except (urllib.error.URLError, TimeoutError) as e:
+            return {"ok": False, "status": None, "error": str(e), "seconds": time.perf_counter() - started, "retries": retries}
+        return {"ok": status == 200, "status": status, "seconds": time.perf_counter() - started, "retries": retries}
+
+
+def run_level(
+    url: str, seconds: float, concurrency: int, requests: int, seed: int, fields: dict, timeout: float
+) -> dict:
+    # Аудіо генерується заздалегідь, щоб не входити у вимірювання
+    files = [synthetic_wav(seconds, seed + index) for index in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda wav: transcribe_once(url, wav, fields, timeout), files))
+    wall = time.perf_counter() - started
+
+    ok = [outcome for outcome in outcomes if outcome["ok"]]
+    latencies = [outcome["seconds"] for outcome in ok]
+    errors: List[str] = sorted({
+        outcome.get("error") or f"HTTP {outcome['status']}" for outcome in outcomes if not outcome["ok"]
+    })
+    return {
+        "audio_seconds": seconds,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(ok),
+        "failed": len(outcomes) - len(ok),
+        "errors": errors,
+        "retries_429": sum(outcome["retries"] for outcome in outcomes),
+        "wall_seconds": round(wall, 3),
+        "latency_ms": summarize(latencies),
+        "realtime_factor": summarize([latency / seconds for latency in latencies], scale=1.0),
+        "throughput": {
+            "requests_per_second": round(len(ok) / wall, 4) if wall else 0,
+            # Скільки секунд аудіо обробляється за секунду реального часу
+            "audio_seconds_per_second": round(len(ok) * seconds / wall, 3) if wall else 0,
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--lengths", default="10,60", help="тривалості аудіо, секунд, через кому")
+    parser.add_argument("--concurrency", default="1,2,4", help="рівні паралельності через кому")
+    parser.add_argument("--requests", type=int, default=8, help="запитів на кожну комбінацію")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--language", default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--no-warmup", action="store_true", help="не робити прогрівочний запит")
+    parser.add_argument("--output", default=None, help="файл JSON з результатами")
+    args = parser.parse_args(argv)
+
+    url = args.url.rstrip("/")
+    fields = {name: value for name, value in (("model", args.model), ("language", args.language)) if value}
+    lengths = parse_list(args.lengths)
+    levels = parse_list(args.concurrency, int)
+
+    if not args.no_warmup:
+        log("Прогрівочний запит...")
+        warmup = transcribe_once(url, synthetic_wav(5, seed=0), fields, args.timeout)
+        if not warmup["ok"]:
+            raise SystemExit(f"Сервер {url} недоступний: {warmup.get('error') or warmup['status']}")
+
+    results = []
+    seed = args.seed * 1_000_000
+    for seconds in lengths:
+        for concurrency in levels:
+            log(f"Аудіо {seconds:g} с, паралельно {concurrency}, запитів {args.requests}...")
+            result = run_level(url, seconds, concurrency, args.requests, seed, fields, args.timeout)
+            seed += args.requests
+            log(
+                f"  p50 {result['latency_ms'].get('p50', 0):.0f} мс, "
+                f"RTF p50 {result['realtime_factor'].get('p50', 0):.3f}, "
+                f"{result['throughput']['audio_seconds_per_second']} с аудіо/с"
+            )
+            results.append(result)
+
+    config = {**vars(args), "lengths": lengths, "concurrency": levels}
+    path = write_results("transcribe", config, results, args.output)
+    log(f"Результати: {path}")
+
+
+if __name__ == "__main__":
+    main()
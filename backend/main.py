@@ -1,19 +1,27 @@
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import whisper
-import os
-import tempfile
-from pydantic import BaseModel
-from typing import List, Dict, Any
-import logging
-from datetime import datetime
-import time
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import json
 import asyncio
-from typing import Set
-from app.routers import history
-from app.db import init_db, AsyncSessionLocal, Transcription, create_transcription
+import logging
+from typing import List, Optional
+from app.routers import batch, export, history, jobs as jobs_router
+from app import jobs
+from app.cache import cache
+from app.db import get_audio_blob, init_db, is_audio_referenced
+from app.inference import QueueFullError, get_pool, pool_status, start_pool, stop_pool
+from app import metrics
+from app.models import available_models, load_model
+from app.audio import SAMPLE_RATE, AudioDecodeError
+from app.audio_store import AUDIO_DIR, receive_upload_form, run_blob_sweeper, store_upload
+from app.transcode import transcoder
+from app.progress import hub
+from app.streaming import StreamSession
+from app.transcription import (
+    TranscriptionResponse, client_id, validate_audio_upload, validate_model_options, validate_priority, warm_up
+)
+from app.uploads import UploadLimitMiddleware
 
 # Налаштування логування
 logging.basicConfig(
@@ -24,11 +32,11 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# Підключаємо роутер історії
+# Підключаємо роутери історії, задач і пакетного транскрибування
 app.include_router(history.router)
-
-# Сховище активних WebSocket з'єднань
-active_connections: Set[WebSocket] = set()
+app.include_router(jobs_router.router)
+app.include_router(batch.router)
+app.include_router(export.router)
 
 # Налаштування CORS
 app.add_middleware(
@@ -40,182 +48,283 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Відхиляємо завеликі завантаження до розбору тіла запиту
+app.add_middleware(UploadLimitMiddleware)
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     logger.info("Нове WebSocket з'єднання...")
+    subscriber = None
+    stream: Optional[StreamSession] = None
+    finishing: List[StreamSession] = []
     try:
         await websocket.accept()
-        active_connections.add(websocket)
-        logger.info(f"Активних з'єднань: {len(active_connections)}")
-        
+        subscriber = hub.connect(websocket)
+        logger.info(f"Активних з'єднань: {len(hub.connections)}")
+
         # Відправляємо початкове повідомлення про успішне підключення
-        try:
-            await websocket.send_json({"status": "connected"})
-            logger.info("Відправлено початкове повідомлення про підключення")
-        except Exception as e:
-            logger.error(f"Помилка відправки початкового повідомлення: {str(e)}")
-            return
-        
+        subscriber.offer({"status": "connected"})
+
         while True:
             try:
-                data = await websocket.receive_text()
-                logger.info(f"Отримано повідомлення: {data}")
-                
-                # Відправляємо підтвердження отримання
-                await websocket.send_json({"status": "message_received", "data": data})
+                received = await websocket.receive()
             except Exception as e:
-                logger.error(f"Помилка отримання повідомлення: {str(e)}")
+                logger.info(f"З'єднання перервано: {str(e)}")
                 break
+            if received["type"] == "websocket.disconnect":
+                logger.info("Клієнт закрив з'єднання")
+                break
+
+            # Бінарні повідомлення - кадри аудіо поточної потокової сесії
+            if received.get("bytes") is not None:
+                if stream is None:
+                    subscriber.offer({"status": "error", "detail": "Потокову сесію не розпочато"})
+                    continue
+                try:
+                    await stream.feed(received["bytes"])
+                except AudioDecodeError as e:
+                    subscriber.offer({"type": "stream_error", "stream_id": stream.id, "detail": str(e)})
+                    await stream.close()
+                    stream = None
+                continue
+
+            data = received.get("text") or ""
+            try:
+                message = json.loads(data)
+            except ValueError:
+                message = None
+
+            # Живе транскрибування: {"type": "start_stream", "format": "pcm16", "sample_rate": 16000},
+            # далі бінарні кадри аудіо і {"type": "stop_stream"} наприкінці
+            if isinstance(message, dict) and message.get("type") == "start_stream":
+                if stream is not None:
+                    await stream.close()
+                    stream = None
+                try:
+                    model_name, options = validate_model_options(message.get("model"), message.get("language"))
+                    stream = StreamSession(
+                        subscriber,
+                        audio_format=str(message.get("format", "pcm16")),
+                        sample_rate=int(message.get("sample_rate", SAMPLE_RATE)),
+                        model_name=model_name,
+                        options=options,
+                        client=client_id(websocket),
+                    )
+                    await stream.start()
+                except HTTPException as e:
+                    stream = None
+                    subscriber.offer({"status": "error", "detail": e.detail})
+                    continue
+                except (ValueError, AudioDecodeError) as e:
+                    stream = None
+                    subscriber.offer({"status": "error", "detail": str(e)})
+                    continue
+                subscriber.offer({"status": "stream_started", "stream_id": stream.id})
+                continue
+            if isinstance(message, dict) and message.get("type") == "stop_stream":
+                if stream is not None:
+                    # Залишок декодується у фоні; сесія сама надішле stream_end
+                    stream.stop()
+                    finishing[:] = [session for session in finishing if not session.finished]
+                    finishing.append(stream)
+                    stream = None
+                continue
+
+            # Підписка на прогрес конкретної задачі: {"type": "subscribe", "job_id": "..."}
+            if isinstance(message, dict) and message.get("type") in ("subscribe", "unsubscribe"):
+                job_id = str(message.get("job_id", ""))
+                if message["type"] == "unsubscribe":
+                    hub.unsubscribe(subscriber, job_id)
+                    subscriber.offer({"status": "unsubscribed", "job_id": job_id})
+                    continue
+                if not hub.subscribe(subscriber, job_id):
+                    subscriber.offer({"status": "error", "detail": "Забагато підписок"})
+                    continue
+                subscriber.offer({"status": "subscribed", "job_id": job_id})
+                # Одразу повідомляємо поточний стан, якщо задача вже існує
+                job = await jobs.manager.get(job_id)
+                if job:
+                    hub.publish(job_id, job["progress"], job["state"])
+                continue
+
+            logger.debug(f"Отримано повідомлення: {data}")
+            # Відправляємо підтвердження отримання
+            subscriber.offer({"status": "message_received", "data": data})
     except Exception as e:
         logger.error(f"Помилка WebSocket: {str(e)}")
     finally:
-        if websocket in active_connections:
-            active_connections.remove(websocket)
-            logger.info(f"З'єднання закрито. Залишилось активних: {len(active_connections)}")
-
-async def broadcast_progress(progress: int):
-    """Відправляє прогрес всім підключеним клієнтам"""
-    logger.info(f"Відправляємо прогрес: {progress}%")
-    disconnected = set()
-    for connection in active_connections:
-        try:
-            await connection.send_json({"progress": progress})
-            logger.debug(f"Прогрес {progress}% відправлено успішно")
-        except Exception as e:
-            logger.error(f"Помилка відправки прогресу: {str(e)}")
-            disconnected.add(connection)
-    
-    # Видаляємо відключені з'єднання
-    for connection in disconnected:
-        active_connections.remove(connection)
-        logger.info(f"Видалено відключене з'єднання. Залишилось: {len(active_connections)}")
+        for session in ([stream] if stream is not None else []) + finishing:
+            await session.close()
+        if subscriber is not None:
+            await hub.disconnect(subscriber)
+            logger.info(f"З'єднання закрито. Залишилось активних: {len(hub.connections)}")
+
+blob_sweeper: Optional[asyncio.Task] = None
+model_loader: Optional[asyncio.Task] = None
+audio_transcoder: Optional[asyncio.Task] = None
+job_maintenance: Optional[asyncio.Task] = None
+
+async def is_blob_referenced(path) -> bool:
+    """Аудіо потрібне, поки на нього посилається запис історії або незавершена задача.
+
+    Другий файл того самого хешу (оригінал, що лишився після перекодування, чи
+    копія після повторного завантаження оригіналу) потрібен лише задачі.
+    """
+    if await is_blob_busy(path):
+        return True
+    if not await is_audio_referenced(path.stem):
+        return False
+    blob = await get_audio_blob(path.stem)
+    return blob is None or AUDIO_DIR / blob.path == path
+
+async def is_blob_busy(path) -> bool:
+    """Файл читає незавершена задача - його не можна видаляти чи перекодовувати"""
+    return await asyncio.to_thread(jobs.manager.store.uses_audio, str(path))
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("Запуск сервера...")
+    global blob_sweeper, model_loader, audio_transcoder, job_maintenance
+    # Моделі завантажуються у фоні, порт відкривається одразу; готовність - /readyz.
+    # Запити, що прийшли раніше, чекають на пул
+    model_loader = asyncio.create_task(load_models())
+    await init_db()  # створення таблиць у БД
+    logger.info("Базу даних ініціалізовано")
+    await jobs.manager.resume()  # незавершені задачі з попереднього запуску
+    job_maintenance = asyncio.create_task(jobs.manager.run_maintenance())
+    blob_sweeper = asyncio.create_task(run_blob_sweeper(is_blob_referenced))
+    audio_transcoder = asyncio.create_task(transcoder.run(is_blob_busy))
+
+async def load_models():
     try:
-        global model
-        model = whisper.load_model("base")
+        await start_pool(load_model, warm_up)
         logger.info("Модель Whisper успішно завантажена")
-        await init_db()  # створення таблиць у БД
-        logger.info("Базу даних ініціалізовано")
     except Exception as e:
         logger.error(f"Помилка при завантаженні моделі Whisper: {str(e)}")
-        raise
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Зупинка сервера...")
+    if job_maintenance is not None:
+        job_maintenance.cancel()
+    await jobs.manager.shutdown()
+    if blob_sweeper is not None:
+        blob_sweeper.cancel()
+    if model_loader is not None:
+        model_loader.cancel()
+    if audio_transcoder is not None:
+        audio_transcoder.cancel()
     # Закриваємо всі активні WebSocket з'єднання
-    for connection in active_connections:
-        try:
-            await connection.close()
-        except Exception as e:
-            logger.error(f"Помилка закриття з'єднання: {str(e)}")
-    active_connections.clear()
+    await hub.close_all()
     logger.info("Всі з'єднання закрито")
+    stop_pool()
+
+@app.get("/healthz")
+async def healthz():
+    """Процес живий; помилка лише якщо модель не вдалося завантажити"""
+    state, error = pool_status()
+    if state == "failed":
+        return JSONResponse(status_code=500, content={"status": state, "detail": error})
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Готовність приймати трафік: модель завантажена і прогріта"""
+    state, error = pool_status()
+    if state != "ready":
+        return JSONResponse(
+            status_code=503,
+            content={"status": state, "detail": error},
+            headers={"Retry-After": "5"}
+        )
+    return {"status": state, "models": get_pool().loaded_models()}
+
+@app.get("/models")
+async def list_models():
+    """Моделі, які може обрати клієнт, і ті, що вже завантажені в репліках"""
+    state, _ = pool_status()
+    loaded = get_pool().loaded_models() if state == "ready" else []
+    return {"available": available_models(), "loaded": loaded}
+
+# Gauge читаються в момент запиту /metrics; поки пул не запущено, значень немає
+metrics.WEBSOCKET_CONNECTIONS.set_function(lambda: len(hub.connections))
+metrics.QUEUE_DEPTH.set_function(lambda: get_pool().queue_depth)
+metrics.BUSY_WORKERS.set_function(lambda: get_pool().busy)
+metrics.MODEL_MEMORY_BYTES.set_function(lambda: get_pool().memory_usage())
+metrics.SCHEDULER_WAITING.set_function(lambda: get_pool().scheduler.waiting_by_priority())
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Метрики у текстовому форматі Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Лічильники кешу результатів транскрибування"""
+    return await asyncio.to_thread(cache.stats)
 
-class TranscriptionResponse(BaseModel):
-    text: str
-    segments: List[Dict[str, Any]]
+# Як часто синхронний /transcribe перевіряє, чи клієнт ще чекає відповідь
+DISCONNECT_POLL_SECONDS = 1.0
 
-def get_duration(audio_path: str) -> float:
-    """Отримати тривалість аудіо файлу в секундах"""
-    import subprocess
+async def wait_connected(request: Request, job_id: str) -> Optional[dict]:
+    """Чекає завершення задачі; якщо клієнт відключився, скасовує її і повертає None"""
+    waiter = asyncio.ensure_future(jobs.manager.wait(job_id))
     try:
-        cmd = ['ffprobe', '-i', audio_path, '-show_entries', 'format=duration', '-v', 'quiet', '-of', 'csv=p=0']
-        output = subprocess.check_output(cmd).decode().strip()
-        return float(output)
-    except:
-        return 0
+        while True:
+            done, _ = await asyncio.wait({waiter}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return waiter.result()
+            if await request.is_disconnected():
+                logger.info(f"Клієнт відключився, скасовуємо задачу {job_id}")
+                await jobs.manager.cancel(job_id)
+                return None
+    finally:
+        waiter.cancel()
 
 @app.post("/transcribe", response_model=TranscriptionResponse)
-async def transcribe_audio(file: UploadFile = File(...)):
-    logger.info(f"Отримано файл: {file.filename}, тип: {file.content_type}")
-    
-    # Перевіряємо формат файлу
-    if not file.content_type.startswith('audio/'):
-        logger.error(f"Невірний формат файлу: {file.content_type}")
-        raise HTTPException(status_code=400, detail="Файл повинен бути аудіо")
-
-    # Створюємо тимчасовий файл для аудіо
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-        temp_file_path = temp_file.name
-        try:
-            logger.info("Читання вмісту файлу...")
-            content = await file.read()
-            temp_file.write(content)
-            logger.info(f"Файл збережено у тимчасове сховище: {temp_file_path}")
-
-            # Отримуємо тривалість аудіо
-            duration = get_duration(temp_file_path)
-            logger.info(f"Тривалість аудіо: {duration:.2f} секунд")
-
-            # Транскрибуємо аудіо
-            logger.info("Початок транскрибування...")
-            start_time = time.time()
-
-            # Відправляємо початковий прогрес
-            await broadcast_progress(0)
-
-            # Запускаємо задачу для оновлення прогресу
-            async def update_progress():
-                while True:
-                    elapsed = time.time() - start_time
-                    # Припускаємо, що транскрибування займе приблизно 2x тривалість аудіо
-                    estimated_duration = duration * 2
-                    progress = min(int((elapsed / estimated_duration) * 100), 99)
-                    await broadcast_progress(progress)
-                    if progress >= 99:
-                        break
-                    await asyncio.sleep(0.1)
-
-            # Запускаємо оновлення прогресу у фоновому режимі
-            progress_task = asyncio.create_task(update_progress())
-
-            # Виконуємо транскрибування
-            result = model.transcribe(
-                temp_file_path,
-                language="uk",  # Вказуємо українську мову
-                verbose=False
-            )
-
-            # Скасовуємо задачу оновлення прогресу
-            progress_task.cancel()
-            try:
-                await progress_task
-            except asyncio.CancelledError:
-                pass
-
-            # Відправляємо фінальний прогрес
-            await broadcast_progress(100)
-            
-            logger.info("Транскрибування успішно завершено")
-
-            # Зберігаємо результат в "БД"
-            transcription_data = {
-                "id": str(int(time.time())),  # Використовуємо timestamp як ID
-                "fileName": file.filename,
-                "date": datetime.utcnow().isoformat(),
-                "transcribedText": result["text"],
-                "editedText": result["text"],
-                "segments": result["segments"],
-                "editedSegments": result["segments"]
-            }
-            await create_transcription(transcription_data)
-
-            return {"text": result["text"], "segments": result["segments"]}
-        except Exception as e:
-            logger.error(f"Помилка при транскрибуванні: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Помилка при транскрибуванні: {str(e)}")
-        finally:
-            # Видаляємо тимчасовий файл
-            if os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    logger.info(f"Тимчасовий файл видалено: {temp_file_path}")
-                except Exception as e:
-                    logger.error(f"Помилка при видаленні тимчасового файлу: {str(e)}")
+async def transcribe_audio(request: Request):
+    """Форма: file, а також необов'язкові job_id, model, language, priority"""
+    # Тіло розбирається потоком: файл пишеться на диск один раз, без проміжної копії
+    async with receive_upload_form(request) as form:
+        upload = form.require_file("file")
+        logger.info(f"Отримано файл: {upload.file_name}, тип: {upload.declared_type}")
+
+        # Перевіряємо формат файлу, модель, мову і клас пріоритету
+        validate_audio_upload(upload)
+        model_name, options = validate_model_options(form.get("model"), form.get("language"))
+        priority = validate_priority(form.get("priority"))
+        await store_upload(upload)
+
+    # Синхронний режим - тонка обгортка над задачами: ставимо задачу і чекаємо результат.
+    # Клієнт може передати власний job_id, щоб заздалегідь підписатися на прогрес через /ws
+    try:
+        job_id = await jobs.manager.submit(
+            str(upload.path), upload.file_name, job_id=form.get("job_id"), content_type=upload.content_type,
+            model_name=model_name, options=options, priority=priority, client=client_id(request)
+        )
+        job = await wait_connected(request, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        logger.warning(f"Черга інференсу заповнена, Retry-After: {e.retry_after}")
+        raise HTTPException(
+            status_code=429,
+            detail="Сервер перевантажений, спробуйте пізніше",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        logger.error(f"Помилка при транскрибуванні: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Помилка при транскрибуванні: {str(e)}")
+
+    if job is None:
+        # Відповідь уже нікому читати; 499 - як у nginx для закритого клієнтом запиту
+        return Response(status_code=499)
+    if job["state"] != jobs.DONE:
+        logger.error(f"Помилка при транскрибуванні: {job['error']}")
+        raise HTTPException(status_code=500, detail=f"Помилка при транскрибуванні: {job['error']}")
+    result = json.loads(job["result"])
+    result["audioHash"] = upload.sha256
+    return result
 
 if __name__ == "__main__":
     import uvicorn
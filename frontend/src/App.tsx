@@ -5,6 +5,7 @@ import { BrowserRouter as Router, Routes, Route } from 'react-router-dom';
 
 interface TranscriptionResponse {
   text: string;
+  audioHash?: string;
   segments: Array<{
     id: number;
     text: string;
@@ -382,6 +383,11 @@ function App() {
   const wsRef = useRef<WebSocket | null>(null);
   const editorRef = useRef<HTMLDivElement>(null);
   const [savedWorks, setSavedWorks] = useState<SavedWork[]>([]);
+  // Курсор наступної сторінки історії з заголовка X-Next-Cursor (null - сторінок більше немає)
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
+  const [isLoadingHistory, setIsLoadingHistory] = useState(false);
+  // Хеш аудіо, вже збереженого на сервері під час транскрибування
+  const [audioHash, setAudioHash] = useState<string | null>(null);
   const [showHistory, setShowHistory] = useState(true);
 
   // Мапа для швидких анотацій по гарячих клавішах
@@ -512,14 +518,42 @@ function App() {
     }
   }, [audioFile]);
 
+  // Сторінка історії; сервер віддає по 50 записів і курсор наступної сторінки
+  const fetchHistoryPage = async (after?: string | null) => {
+    const response = await axios.get<SavedWork[]>('http://localhost:8001/history', {
+      params: after ? { after } : undefined
+    });
+    setHistoryCursor(response.headers['x-next-cursor'] || null);
+    return response.data;
+  };
+
+  const loadMoreHistory = async () => {
+    if (!historyCursor || isLoadingHistory) return;
+    setIsLoadingHistory(true);
+    try {
+      const page = await fetchHistoryPage(historyCursor);
+      setSavedWorks(prev => {
+        // Запис, збережений після завантаження першої сторінки, не дублюємо
+        const known = new Set(prev.map(work => work.id));
+        const updated = [...prev, ...page.filter(work => !known.has(work.id))];
+        localStorage.setItem('transcriptionHistory', JSON.stringify(updated));
+        return updated;
+      });
+    } catch (error) {
+      console.error('Error loading more history:', error);
+    } finally {
+      setIsLoadingHistory(false);
+    }
+  };
+
   // Завантаження збережених робіт при старті
   useEffect(() => {
     const loadHistory = async () => {
       try {
-        const response = await axios.get<SavedWork[]>('http://localhost:8001/history');
-        setSavedWorks(response.data);
+        const page = await fetchHistoryPage();
+        setSavedWorks(page);
         // Зберігаємо в localStorage як резервну копію
-        localStorage.setItem('transcriptionHistory', JSON.stringify(response.data));
+        localStorage.setItem('transcriptionHistory', JSON.stringify(page));
       } catch (error) {
         console.error('Error loading history:', error);
         // Якщо не вдалося завантажити з сервера, пробуємо завантажити з localStorage
@@ -548,6 +582,7 @@ function App() {
         return;
       }
       setAudioFile(file);
+      setAudioHash(null);
       setError(null);
       setProgress(0);
     }
@@ -564,8 +599,12 @@ function App() {
     setStartTime(Date.now());
     setProgress(0);
 
+    // Ідентифікатор задачі генеруємо на клієнті, щоб підписатися на її прогрес до завантаження
+    const jobId = crypto.randomUUID().replace(/-/g, '');
     const formData = new FormData();
     formData.append('file', audioFile);
+    formData.append('job_id', jobId);
+    const subscribeMessage = JSON.stringify({ type: 'subscribe', job_id: jobId });
 
     try {
       // Перевіряємо стан WebSocket з'єднання
@@ -576,6 +615,7 @@ function App() {
         wsRef.current.onopen = () => {
           console.log('WebSocket з\'єднання відновлено');
           wsRef.current?.send(JSON.stringify({ type: 'init' }));
+          wsRef.current?.send(subscribeMessage);
         };
         
         wsRef.current.onmessage = (event) => {
@@ -601,6 +641,8 @@ function App() {
         wsRef.current.onclose = (event) => {
           console.log('WebSocket з\'єднання закрито. Код:', event.code, 'Причина:', event.reason);
         };
+      } else {
+        wsRef.current.send(subscribeMessage);
       }
 
       const response = await axios.post<TranscriptionResponse>('http://localhost:8001/transcribe', formData, {
@@ -635,6 +677,7 @@ function App() {
         words: s.text.split(/\s+/).filter(word => word.length > 0).length
       })));
 
+      setAudioHash(response.data.audioHash ?? null);
       setTranscribedText(response.data.text);
       setEditedText(response.data.text);
       setSegments(segmentsWithConfidence);
@@ -872,9 +915,14 @@ function App() {
     };
 
     // Створюємо FormData для відправки на сервер
+    // Якщо аудіо вже на сервері, посилаємося на нього за хешем замість повторного завантаження
     const formData = new FormData();
-    formData.append('file', audioFile);
-    formData.append('work', JSON.stringify(workForLocalStorage));
+    if (audioHash) {
+      formData.append('work', JSON.stringify({ ...workForLocalStorage, audioHash }));
+    } else {
+      formData.append('file', audioFile);
+      formData.append('work', JSON.stringify(workForLocalStorage));
+    }
 
     try {
       // Зберігаємо в базу даних
@@ -901,6 +949,18 @@ function App() {
 
   // Відновлення роботи
   const restoreWork = async (work: SavedWork) => {
+    // Список історії містить лише метадані, повний запис завантажуємо окремо
+    if (work.segments === undefined) {
+      try {
+        const record = await axios.get<SavedWork>(`http://localhost:8001/history/${work.id}`);
+        work = { ...work, ...record.data };
+      } catch (error) {
+        console.error('Error loading work:', error);
+        setError('Не вдалося завантажити роботу. Спробуйте ще раз.');
+        return;
+      }
+    }
+
     try {
       // Отримуємо аудіофайл з сервера
       const response = await axios.get(`http://localhost:8001/history/${work.id}/audio`, {
@@ -911,6 +971,7 @@ function App() {
       const blob = response.data as Blob;
       const file = new File([blob], work.fileName, { type: blob.type || 'audio/mpeg' });
       setAudioFile(file);
+      setAudioHash(null);
       
       // Створюємо URL для відтворення
       const url = URL.createObjectURL(file);
@@ -964,6 +1025,7 @@ function App() {
     setSegments([]);
     setEditedSegments([]);
     setAudioFile(null);
+    setAudioHash(null);
     setAudioUrl(null);
   };
 
@@ -1289,6 +1351,11 @@ function App() {
                     <Button onClick={() => deleteWork(work.id)}>Видалити</Button>
                   </HistoryItem>
                 ))}
+                {historyCursor && (
+                  <Button onClick={loadMoreHistory} disabled={isLoadingHistory}>
+                    {isLoadingHistory ? 'Завантаження...' : 'Завантажити ще'}
+                  </Button>
+                )}
               </HistoryContainer>
             )}
 